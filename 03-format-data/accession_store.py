@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+
+"""
+accession_store.py
+
+One-time SQLite index of the NCBI assembly summaries, so accession2taxid.map files for
+any number of accession lists are written in seconds instead of rescanning
+all_assembly.txt for each list.
+
+    build   load assembly_summary_refseq.txt / assembly_summary_genbank.txt (or their
+            concatenation, all_assembly.txt) into the store; curated accession<TAB>taxid
+            tables (what format_missing.py formats) can be loaded with --manual.
+    add     add curated accession<TAB>taxid rows to an existing store.
+    lookup  write accession2taxid.map (base, accession, taxid, 0) and the list of
+            accessions that could not be resolved, for the union of the given lists.
+
+Each accession is resolved by the first rule that matches:
+
+    exact     the accession.version itself
+    version   another version of the same accession (the latest one, else the highest)
+    paired    the GCA/GCF twin listed in gbrs_paired_asm
+    prefix    another version of the GCA/GCF twin (same number, other prefix)
+
+Usage:
+    python accession_store.py build --summaries assembly_summary_refseq.txt assembly_summary_genbank.txt \
+        --db accession_store.sqlite
+    python accession_store.py lookup --db accession_store.sqlite \
+        --accessions virid_boot/virid_db*_accession_counts.tsv --out accession2taxid.map
+"""
+
+import argparse
+import csv
+import os
+import sqlite3
+import sys
+import time
+from collections import Counter
+from typing import Iterator, List, Optional, Set, Tuple
+
+DEFAULT_DB = "accession_store.sqlite"
+MATCH_KINDS = ("exact", "version", "paired", "prefix")
+
+# assembly_summary columns
+COL_ACCESSION = 0
+COL_TAXID = 5
+COL_PAIRED = 17
+COL_STATUS = 10
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS assembly (
+    accession TEXT PRIMARY KEY,
+    base      TEXT NOT NULL,
+    version   INTEGER NOT NULL,
+    taxid     TEXT NOT NULL,
+    paired    TEXT,
+    latest    INTEGER NOT NULL,
+    source    TEXT NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+INDEXES = """
+CREATE INDEX IF NOT EXISTS assembly_base ON assembly (base, latest, version);
+CREATE INDEX IF NOT EXISTS assembly_paired ON assembly (paired);
+"""
+
+
+def split_accession(accession: str) -> Tuple[str, int]:
+    """'GCA_000001405.28' -> ('GCA_000001405', 28); no version -> 0."""
+    base, _, version = accession.partition(".")
+    return base, int(version) if version.isdigit() else 0
+
+
+def twin_base(base: str) -> Optional[str]:
+    """GCA_x <-> GCF_x, None for anything else."""
+    if base.startswith("GCA_"):
+        return "GCF_" + base[4:]
+    if base.startswith("GCF_"):
+        return "GCA_" + base[4:]
+    return None
+
+
+# ----------------------------
+# Build
+# ----------------------------
+
+def iter_summary_rows(path: str) -> Iterator[tuple]:
+    """(accession, base, version, taxid, paired, latest, source) of an assembly summary file."""
+    source = os.path.basename(path)
+    with open(path, newline="", encoding="utf-8", errors="replace") as f:
+        for row in csv.reader(f, delimiter="\t"):
+            if not row or row[0].startswith("#") or len(row) <= COL_TAXID:
+                continue  # skip comments and incomplete lines
+            accession = row[COL_ACCESSION].strip()
+            taxid = row[COL_TAXID].strip()
+            if not accession or not taxid:
+                continue
+            base, version = split_accession(accession)
+            paired = row[COL_PAIRED].strip() if len(row) > COL_PAIRED else ""
+            latest = len(row) > COL_STATUS and row[COL_STATUS].strip() == "latest"
+            yield accession, base, version, taxid, paired if paired not in ("", "na") else None, int(latest), source
+
+
+def iter_manual_rows(path: str) -> Iterator[tuple]:
+    """Rows of a curated accession<TAB>taxid table (the input of format_missing.py)."""
+    source = os.path.basename(path)
+    with open(path, newline="") as f:
+        for lineno, row in enumerate(csv.reader(f, delimiter="\t"), start=1):
+            if len(row) < 2 or not row[0].strip() or not row[1].strip():
+                print(f"[SKIPPED] {source} line {lineno}: {row}", file=sys.stderr)
+                continue
+            accession, taxid = row[0].strip(), row[1].strip()
+            if lineno == 1 and accession.lower() == "accession":
+                continue  # header
+            if not taxid.isdigit():
+                print(f"[SKIPPED] {source} line {lineno}: taxid is not a number: {row}", file=sys.stderr)
+                continue
+            base, version = split_accession(accession)
+            # Curated rows replace summary rows of the same accession and count as current
+            yield accession, base, version, taxid, None, 1, f"manual:{source}"
+
+
+def connect(db_path: str) -> sqlite3.Connection:
+    con = sqlite3.connect(db_path)
+    con.execute("PRAGMA journal_mode=OFF")
+    con.execute("PRAGMA synchronous=OFF")
+    con.execute("PRAGMA temp_store=MEMORY")
+    con.execute("PRAGMA cache_size=-262144")  # 256 MiB
+    return con
+
+
+def load_rows(con: sqlite3.Connection, rows: Iterator[tuple]) -> int:
+    before = con.total_changes
+    con.executemany("INSERT OR REPLACE INTO assembly VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+    return con.total_changes - before
+
+
+def build_store(db_path: str, summaries: List[str], manual: List[str]) -> int:
+    """(Re)build the store from assembly summaries (+ curated tables); returns the number of rows."""
+    t0 = time.perf_counter()
+    tmp = f"{db_path}.tmp"
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    con = connect(tmp)
+    con.executescript(SCHEMA)
+    with con:
+        for path in summaries:
+            print(f"{path}: {load_rows(con, iter_summary_rows(path))} rows")
+        for path in manual:
+            print(f"{path}: {load_rows(con, iter_manual_rows(path))} curated rows")
+        con.executescript(INDEXES)
+        con.executemany("INSERT OR REPLACE INTO meta VALUES (?, ?)", [
+            ("built", time.strftime("%Y-%m-%d %H:%M:%S")),
+            ("sources", "\t".join(os.path.abspath(p) for p in summaries + manual)),
+        ])
+    n = con.execute("SELECT COUNT(*) FROM assembly").fetchone()[0]
+    con.execute("ANALYZE")
+    con.close()
+    os.replace(tmp, db_path)
+    print(f"Stored {n} accessions in {db_path} ({time.perf_counter() - t0:.1f}s)")
+    return n
+
+
+def add_manual(db_path: str, manual: List[str]) -> int:
+    # sqlite3.connect would create an empty database with no tables
+    if not os.path.exists(db_path):
+        raise SystemExit(f"No store at {db_path}; run `accession_store.py build` first")
+    con = connect(db_path)
+    with con:
+        n = sum(load_rows(con, iter_manual_rows(path)) for path in manual)
+    con.close()
+    print(f"Added {n} curated rows to {db_path}")
+    return n
+
+
+# ----------------------------
+# Lookup
+# ----------------------------
+
+def read_accessions(path: str) -> Set[str]:
+    """Accessions of a plain list (one per line) or of a TSV with an 'accession' column."""
+    with open(path, newline="") as f:
+        first = f.readline()
+        cols = first.rstrip("\r\n").split("\t")
+        if "accession" in cols:
+            col = cols.index("accession")
+            rows = (line.rstrip("\r\n").split("\t") for line in f)
+            return {r[col].strip() for r in rows if len(r) > col and r[col].strip()}
+        found = {line.strip() for line in f if line.strip()}
+        if first.strip():
+            found.add(first.strip())
+        return found
+
+
+# Each rule maps the query table to (query, taxid) pairs; later rules only see what is still unresolved
+LOOKUP_SQL = {
+    "exact": """
+        SELECT q.accession, a.taxid FROM query q JOIN assembly a ON a.accession = q.accession
+        WHERE q.taxid IS NULL""",
+    "version": """
+        SELECT q.accession, (SELECT a.taxid FROM assembly a WHERE a.base = q.base
+                             ORDER BY a.latest DESC, a.version DESC LIMIT 1)
+        FROM query q WHERE q.taxid IS NULL""",
+    "paired": """
+        SELECT q.accession, (SELECT a.taxid FROM assembly a WHERE a.paired = q.accession
+                             ORDER BY a.latest DESC, a.version DESC LIMIT 1)
+        FROM query q WHERE q.taxid IS NULL""",
+    "prefix": """
+        SELECT q.accession, (SELECT a.taxid FROM assembly a WHERE a.base = q.twin
+                             ORDER BY a.latest DESC, a.version DESC LIMIT 1)
+        FROM query q WHERE q.taxid IS NULL AND q.twin IS NOT NULL""",
+}
+
+
+def lookup(db_path: str, accession_files: List[str], out_path: str, missing_path: str,
+           strict: bool = False) -> Tuple[Counter, List[str]]:
+    """Resolve the union of the accession lists; returns (matches per rule, missing accessions)."""
+    if not os.path.exists(db_path):
+        raise SystemExit(f"No store at {db_path}; run `accession_store.py build` first")
+    accessions: Set[str] = set()
+    for path in accession_files:
+        accessions |= read_accessions(path)
+
+    con = sqlite3.connect(db_path)
+    con.execute("PRAGMA temp_store=MEMORY")
+    con.execute("CREATE TEMP TABLE query (accession TEXT PRIMARY KEY, base TEXT, twin TEXT, "
+                "taxid TEXT, kind TEXT) WITHOUT ROWID")
+    con.executemany("INSERT INTO query VALUES (?, ?, ?, NULL, NULL)",
+                    ((a, split_accession(a)[0], twin_base(split_accession(a)[0])) for a in accessions))
+
+    kinds = MATCH_KINDS[:1] if strict else MATCH_KINDS
+    counts: Counter = Counter()
+    for kind in kinds:
+        found = [(taxid, kind, acc) for acc, taxid in con.execute(LOOKUP_SQL[kind]) if taxid]
+        con.executemany("UPDATE query SET taxid = ?, kind = ? WHERE accession = ?", found)
+        counts[kind] = len(found)
+
+    tmp = f"{out_path}.tmp"
+    with open(tmp, "w") as out:
+        # Kraken2 accession2taxid format, keyed by the accession as listed
+        for acc, base, taxid in con.execute(
+                "SELECT accession, base, taxid FROM query WHERE taxid IS NOT NULL ORDER BY accession"):
+            out.write(f"{base}\t{acc}\t{taxid}\t0\n")
+    os.replace(tmp, out_path)
+
+    missing = [a for (a,) in con.execute("SELECT accession FROM query WHERE taxid IS NULL ORDER BY accession")]
+    with open(missing_path, "w") as f:
+        f.writelines(a + "\n" for a in missing)
+    con.close()
+    return counts, missing
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Indexed accession -> taxid store built from NCBI assembly summaries.")
+    sub = ap.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("build", help="Build the store from assembly summaries")
+    p.add_argument("--summaries", nargs="+", required=True,
+                   help="assembly_summary_refseq.txt / assembly_summary_genbank.txt / all_assembly.txt")
+    p.add_argument("--manual", nargs="*", default=[], help="Curated accession<TAB>taxid tables")
+    p.add_argument("--db", default=DEFAULT_DB, help=f"Store to write (default {DEFAULT_DB})")
+
+    p = sub.add_parser("add", help="Add curated accession<TAB>taxid tables to the store")
+    p.add_argument("manual", nargs="+")
+    p.add_argument("--db", default=DEFAULT_DB)
+
+    p = sub.add_parser("lookup", help="Write accession2taxid.map for accession lists")
+    p.add_argument("--accessions", nargs="+", required=True,
+                   help="Accession lists, or TSVs with an 'accession' column (e.g. *_accession_counts.tsv)")
+    p.add_argument("--db", default=DEFAULT_DB)
+    p.add_argument("--out", default="accession2taxid.map")
+    p.add_argument("--missing", default="missing_accessions.txt")
+    p.add_argument("--strict", action="store_true", help="Exact accession.version matches only")
+
+    args = ap.parse_args()
+    if args.command == "build":
+        build_store(args.db, args.summaries, args.manual)
+    elif args.command == "add":
+        add_manual(args.db, args.manual)
+    else:
+        t0 = time.perf_counter()
+        counts, missing = lookup(args.db, args.accessions, args.out, args.missing, args.strict)
+        print(f"Wrote {sum(counts.values())} entries to {args.out} ({time.perf_counter() - t0:.1f}s): "
+              + ", ".join(f"{counts[k]} {k}" for k in MATCH_KINDS if k in counts))
+        print(f"{len(missing)} accessions were not found; written to {args.missing}")
+
+
+if __name__ == "__main__":
+    main()
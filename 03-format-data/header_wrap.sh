@@ -10,5 +10,9 @@ date
 
 python headers2taxid.py $MYPATH/entropy/db_files/fastas $MYPATH/entropy/db_files/accession2taxid.map
 
+# or, without rewriting the fastas (run with -c 8):
+# python headers2taxid.py $MYPATH/entropy/db_files/fastas $MYPATH/entropy/db_files/accession2taxid.map \
+#   --seqid2taxid $MYPATH/entropy/db_files/seqid2taxid.map --jobs 8
+
 echo "END"
 date
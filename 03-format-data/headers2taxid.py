@@ -1,6 +1,17 @@
+import argparse
+import gzip
+import multiprocessing as mp
 import os
 import sys
 import re
+import zlib
+
+# Header scan (--seqid2taxid): FASTAs are read in large binary blocks and only the bytes
+# between "\n>" and the next newline are looked at; sequence data is never split into
+# lines, decoded or rewritten.
+BLOCK_SIZE = 1 << 24  # 16 MiB
+FASTA_SUFFIXES = ('.fna', '.fna.gz')
+SAMPLE_SIZE = 10
 
 def load_accession_taxid_map(map_file):
     accession_taxid = {}
@@ -13,14 +24,16 @@ def load_accession_taxid_map(map_file):
                 accession_taxid[full_accession] = taxid
     return accession_taxid
 
+def accession_from_filename(fasta_file):
+    match = re.match(r'^(GCA|GCF)_\d+\.\d+', os.path.basename(fasta_file))
+    return match.group(0) if match else None
+
 def modify_fasta_headers(fasta_file, accession_taxid_map):
     # Extract accession from filename using regex
-    filename = os.path.basename(fasta_file)
-    match = re.match(r'^(GCA|GCF)_\d+\.\d+', filename)
-    if not match:
-        print(f"Could not extract accession from filename: {filename}")
+    accession = accession_from_filename(fasta_file)
+    if not accession:
+        print(f"Could not extract accession from filename: {os.path.basename(fasta_file)}")
         return
-    accession = match.group(0)
     taxid = accession_taxid_map.get(accession)
     if not taxid:
         print(f"TaxID not found for accession {accession} in {fasta_file}")
@@ -37,6 +50,133 @@ def modify_fasta_headers(fasta_file, accession_taxid_map):
                 outfile.write(line)
     os.replace(temp_file, fasta_file)
 
+def iter_fasta_headers(fasta_file, block_size=BLOCK_SIZE):
+    """Yield header lines (without '>' and line ending) of a .fna or .fna.gz file."""
+    opener = gzip.open if fasta_file.endswith('.gz') else open
+    # Slot 0 holds the last byte of the previous block, so "\n>" is found across block
+    # boundaries; a virtual newline before the file start catches the first header
+    buf = bytearray(block_size + 1)
+    view = memoryview(buf)
+    buf[0:1] = b'\n'
+    partial = None  # header cut off at the end of the previous block
+    with opener(fasta_file, 'rb') as f:
+        while True:
+            n = f.readinto(view[1:])
+            if not n:
+                break
+            end = n + 1
+            pos = 0
+            if partial is not None:
+                nl = buf.find(b'\n', 1, end)
+                if nl < 0:
+                    partial += buf[1:end]
+                    buf[0] = buf[end - 1]
+                    continue
+                yield (partial + buf[1:nl]).rstrip(b'\r')
+                partial = None
+                pos = nl
+            while True:
+                i = buf.find(b'\n>', pos, end)
+                if i < 0:
+                    break
+                nl = buf.find(b'\n', i + 2, end)
+                if nl < 0:
+                    partial = bytes(buf[i + 2:end])
+                    break
+                yield bytes(buf[i + 2:nl]).rstrip(b'\r')
+                pos = nl
+            buf[0] = buf[end - 1]
+    if partial is not None:
+        yield partial.rstrip(b'\r')
+
+def scan_fasta(fasta_file, accession_taxid_map):
+    """(accession, taxid, seqids, error) for one FASTA; seqids are the first words of its headers."""
+    accession = accession_from_filename(fasta_file)
+    if not accession:
+        return None, None, [], f"Could not extract accession from filename: {os.path.basename(fasta_file)}"
+    taxid = accession_taxid_map.get(accession)
+    if not taxid:
+        return accession, None, [], f"TaxID not found for accession {accession} in {fasta_file}"
+    try:
+        seqids = [h.split(None, 1)[0].decode() for h in iter_fasta_headers(fasta_file) if h.strip()]
+    except (OSError, EOFError, zlib.error) as e:
+        return accession, taxid, [], f"Could not read {fasta_file}: {e}"
+    return accession, taxid, seqids, None
+
+def find_fastas(fasta_dir, suffixes=FASTA_SUFFIXES):
+    found = []
+    for root, dirs, files in os.walk(fasta_dir):
+        for file in files:
+            if file.endswith(suffixes):
+                found.append(os.path.join(root, file))
+    return sorted(found)
+
+# accession2taxid map of a pool worker (set once per worker, not pickled per file)
+WORKER_MAP = None
+
+def init_scan_worker(accession_taxid_map):
+    global WORKER_MAP
+    WORKER_MAP = accession_taxid_map
+
+def scan_in_worker(fasta_file):
+    return scan_fasta(fasta_file, WORKER_MAP)
+
+def write_seqid2taxid(fasta_dir, map_file, out_path, n_jobs=1):
+    """
+    Write a Kraken seqid2taxid.map (seqid<TAB>taxid) for every .fna / .fna.gz under
+    fasta_dir, leaving the FASTAs untouched. Copy it into the database directory as
+    seqid2taxid.map before `kraken2-build --build`, which then uses it instead of
+    kraken:taxid headers. Returns the number of seqids written.
+    """
+    accession_taxid_map = load_accession_taxid_map(map_file)
+    fastas = find_fastas(fasta_dir)
+    if not fastas:
+        raise SystemExit(f"No {' / '.join(FASTA_SUFFIXES)} files under {fasta_dir}")
+
+    seen = {}
+    conflicts = []
+    n_written = n_skipped = 0
+    tmp_path = out_path + '.tmp'
+    try:
+        with open(tmp_path, 'w') as out:
+            if n_jobs > 1:
+                pool = mp.Pool(n_jobs, initializer=init_scan_worker, initargs=(accession_taxid_map,))
+                results = pool.imap(scan_in_worker, fastas, chunksize=1)
+            else:
+                pool = None
+                results = (scan_fasta(f, accession_taxid_map) for f in fastas)
+            try:
+                # imap keeps input order, so the map is the same whatever the number of workers
+                for accession, taxid, seqids, error in results:
+                    if error:
+                        print(error)
+                        n_skipped += 1
+                        continue
+                    for seqid in seqids:
+                        prev = seen.get(seqid)
+                        if prev is None:
+                            seen[seqid] = taxid
+                            out.write(f"{seqid}\t{taxid}\n")
+                            n_written += 1
+                        elif prev != taxid:
+                            conflicts.append(f"{seqid} ({prev} vs {taxid} in {accession})")
+            finally:
+                if pool is not None:
+                    pool.close()
+                    pool.join()
+    except BaseException:
+        # No half-written map left behind (e.g. a worker died)
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, out_path)
+
+    print(f"Wrote {n_written} seqids from {len(fastas) - n_skipped} of {len(fastas)} FASTAs to {out_path}")
+    if conflicts:
+        print(f"WARNING: {len(conflicts)} seqids occur in FASTAs with different taxids; kept the first: "
+              + ", ".join(conflicts[:SAMPLE_SIZE]), file=sys.stderr)
+    return n_written
+
 def main(fasta_dir, map_file):
     accession_taxid_map = load_accession_taxid_map(map_file)
     for root, dirs, files in os.walk(fasta_dir):
@@ -46,9 +186,17 @@ def main(fasta_dir, map_file):
                 modify_fasta_headers(fasta_path, accession_taxid_map)
 
 if __name__ == "__main__":
-    if len(sys.argv) != 3:
-        print("Usage: python modify_fasta_headers.py <fasta_directory> <accession2taxid.map>")
-        sys.exit(1)
-    fasta_directory = sys.argv[1]
-    accession2taxid_map = sys.argv[2]
-    main(fasta_directory, accession2taxid_map)
+    parser = argparse.ArgumentParser(
+        description="Tag FASTA headers with kraken:taxid in place, or (--seqid2taxid) write a Kraken "
+                    "seqid2taxid.map from the headers without touching the FASTAs."
+    )
+    parser.add_argument("fasta_directory", help="Directory searched recursively for .fna (and .fna.gz with --seqid2taxid)")
+    parser.add_argument("accession2taxid_map", help="accession2taxid.map (base accession, accession.version, taxid)")
+    parser.add_argument("--seqid2taxid", default=None, metavar="OUT",
+                        help="Write seqid<TAB>taxid here instead of rewriting headers")
+    parser.add_argument("--jobs", type=int, default=1, help="Files scanned in parallel with --seqid2taxid (default 1)")
+    args = parser.parse_args()
+    if args.seqid2taxid:
+        write_seqid2taxid(args.fasta_directory, args.accession2taxid_map, args.seqid2taxid, args.jobs)
+    else:
+        main(args.fasta_directory, args.accession2taxid_map)
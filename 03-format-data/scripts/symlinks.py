@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+
+"""
+symlinks.py
+
+symlinks.sh for all bootstrap databases at once. The fna directory is scanned once into
+a filename index (plus accession -> .fna file, for files whose assembly name differs from
+the table), then every <accession>_dup<i>.fna link of every count table is made with
+os.symlink, without a subprocess per link.
+
+Each table gets its own output directory, named after the table:
+
+    virid_boot/virid_db3_accession_counts.tsv -> <outdir>/virid_db3/
+
+with a missing_symlinks.tsv (accession, filename, expected_path) like symlinks.sh, plus a
+substituted_with column: a genome whose filename is missing but whose accession has another
+.fna file is linked to that file and logged there too. Links are replaced if they point
+elsewhere; _dupN.fna links left over from an earlier table are removed. Exits 1 if any
+filename was missing (substituted or not), 2 on bad input.
+
+Usage:
+    python symlinks.py fastas/ symlinks/ virid_boot/virid_db*_accession_counts.tsv
+"""
+
+import argparse
+import os
+import re
+import sys
+from typing import Dict, List, Tuple
+
+ACCESSION_RE = re.compile(r"^GC[AF]_\d+\.\d+")
+DUP_RE = re.compile(r"_dup\d+\.fna$")
+COUNTS_SUFFIX = "_accession_counts.tsv"
+# Only plain .fna files can stand in for a missing filename, as links are named _dupN.fna
+FALLBACK_SUFFIX = ".fna"
+MISSING_NAME = "missing_symlinks.tsv"
+REQUIRED_COLS = ("accession", "filename", "count")
+
+
+def index_fna_dir(fna_dir: str) -> Tuple[Dict[str, str], Dict[str, str]]:
+    """(filename -> path, accession -> .fna path) from one scan of fna_dir."""
+    by_name: Dict[str, str] = {}
+    by_accession: Dict[str, str] = {}
+    with os.scandir(fna_dir) as it:
+        for entry in it:
+            if not entry.is_file():
+                continue
+            by_name[entry.name] = entry.path
+            m = ACCESSION_RE.match(entry.name)
+            if m and entry.name.endswith(FALLBACK_SUFFIX):
+                # Several files for one accession: keep the first in name order
+                prev = by_accession.get(m.group(0))
+                if prev is None or entry.name < os.path.basename(prev):
+                    by_accession[m.group(0)] = entry.path
+    return by_name, by_accession
+
+
+def read_counts(path: str) -> List[Tuple[str, str, int]]:
+    """(accession, filename, count) rows; exits 2 on a bad header or count, like symlinks.sh."""
+    with open(path) as f:
+        header = f.readline().rstrip("\r\n").split("\t")
+        if any(c not in header for c in REQUIRED_COLS):
+            shown = "\t".join(header)
+            print(f"ERROR: counts_tsv header must include 'accession', 'filename', and 'count' columns.\n"
+                  f"Header was: {shown} ({path})", file=sys.stderr)
+            sys.exit(2)
+        cols = [header.index(c) for c in REQUIRED_COLS]
+        rows = []
+        for line in f:
+            fields = line.rstrip("\r\n").split("\t")
+            accession, filename, count = (fields[c].strip() if c < len(fields) else "" for c in cols)
+            if not accession or not filename or not count:
+                continue
+            if not count.isdigit():
+                print(f"ERROR: Non-integer count for accession '{accession}': '{count}' ({path})", file=sys.stderr)
+                sys.exit(2)
+            rows.append((accession, filename, int(count)))
+    return rows
+
+
+def output_name(counts_path: str) -> str:
+    name = os.path.basename(counts_path)
+    return name[:-len(COUNTS_SUFFIX)] if name.endswith(COUNTS_SUFFIX) else os.path.splitext(name)[0]
+
+
+def link(src: str, dst: str) -> bool:
+    """Point dst at src (ln -sf); returns False if it already did."""
+    try:
+        os.symlink(src, dst)
+        return True
+    except FileExistsError:
+        if os.path.islink(dst) and os.readlink(dst) == src:
+            return False
+        os.unlink(dst)
+        os.symlink(src, dst)
+        return True
+
+
+def build_farm(counts_path: str, fna_dir: str, output_dir: str, by_name: Dict[str, str],
+               by_accession: Dict[str, str], realpaths: Dict[str, str]) -> Tuple[int, int, int, int, int]:
+    """
+    Links for one count table; returns (links made, links already in place, stale removed,
+    missing, substituted).
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    rows = read_counts(counts_path)
+    wanted = set()
+    created = kept = 0
+    missing = []
+    substituted = 0
+    for accession, filename, count in rows:
+        src = by_name.get(filename)
+        if src is None:
+            expected = os.path.join(fna_dir, filename)
+            src = by_accession.get(accession)
+            if src is None:
+                print(f"WARNING: filename '{filename}' for accession '{accession}' was not found in {fna_dir}",
+                      file=sys.stderr)
+                missing.append((accession, filename, expected, ""))
+                continue
+            print(f"WARNING: filename '{filename}' for accession '{accession}' was not found in {fna_dir}; "
+                  f"using {os.path.basename(src)}", file=sys.stderr)
+            missing.append((accession, filename, expected, src))
+            substituted += 1
+        real_src = realpaths.get(src)
+        if real_src is None:
+            real_src = realpaths[src] = os.path.realpath(src)
+        for i in range(1, count + 1):
+            name = f"{accession}_dup{i}.fna"
+            wanted.add(name)
+            if link(real_src, os.path.join(output_dir, name)):
+                created += 1
+            else:
+                kept += 1
+
+    stale = 0
+    with os.scandir(output_dir) as it:
+        for entry in it:
+            if DUP_RE.search(entry.name) and entry.is_symlink() and entry.name not in wanted:
+                os.unlink(entry.path)
+                stale += 1
+
+    with open(os.path.join(output_dir, MISSING_NAME), "w") as f:
+        f.write("accession\tfilename\texpected_path\tsubstituted_with\n")
+        f.writelines(f"{a}\t{fn}\t{p}\t{sub}\n" for a, fn, p, sub in missing)
+    return created, kept, stale, len(missing) - substituted, substituted
+
+
+def main():
+    ap = argparse.ArgumentParser(
+        description="Create <accession>_dup<i>.fna symlinks for any number of bootstrap count tables."
+    )
+    ap.add_argument("fna_dir", help="Directory with the genome .fna files")
+    ap.add_argument("output_dir", help="One subdirectory per table is created here")
+    ap.add_argument("counts_tsv", nargs="+", help="*_accession_counts.tsv (accession, filename, count columns)")
+    args = ap.parse_args()
+
+    if not os.path.isdir(args.fna_dir):
+        print(f"ERROR: fna_dir not found: {args.fna_dir}", file=sys.stderr)
+        sys.exit(2)
+    for path in args.counts_tsv:
+        if not os.path.isfile(path):
+            print(f"ERROR: counts_tsv not found: {path}", file=sys.stderr)
+            sys.exit(2)
+    names = [output_name(p) for p in args.counts_tsv]
+    if len(set(names)) != len(names):
+        print("ERROR: Several count tables map to the same output directory", file=sys.stderr)
+        sys.exit(2)
+
+    by_name, by_accession = index_fna_dir(args.fna_dir)
+    print(f"Indexed {len(by_name)} files in {args.fna_dir}")
+
+    realpaths: Dict[str, str] = {}
+    total_missing = 0
+    for path, name in zip(args.counts_tsv, names):
+        out = os.path.join(args.output_dir, name)
+        created, kept, stale, missing, substituted = build_farm(
+            path, args.fna_dir, out, by_name, by_accession, realpaths
+        )
+        total_missing += missing + substituted
+        print(f"{out}: {created} symlinks created, {kept} already in place, {stale} stale removed, "
+              f"{missing} missing, {substituted} substituted"
+              + (f" (see {os.path.join(out, MISSING_NAME)})" if missing or substituted else ""))
+    if total_missing:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
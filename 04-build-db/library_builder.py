@@ -0,0 +1,513 @@
+#!/usr/bin/env python3
+
+"""
+library_builder.py
+
+Build the Kraken2 libraries of all bootstrap databases from one shared, deduplicated
+store of tagged genomes, instead of rewriting headers in place and running one
+kraken2-build --add-to-library per symlinked file for every database.
+
+    pack      every genome in any *_dbN_accession_counts.tsv is read once (in parallel),
+              its headers tagged as >ACC|kraken:taxid|TAXID <header> (as headers2taxid.py
+              does), and appended to a few large chunk files in the store. index.tsv
+              records where each genome landed. Genomes already in the store (same
+              file, size and mtime) are skipped, so later bootstraps only pack new ones.
+
+    assemble  for one database: write DB/library_manifest.tsv (chunk, offset, length and
+              count of every genome it samples), then materialize DB/library/bootstrap/
+              from it. Chunks used whole with one count are symlinked; everything else is
+              copied range by range with copy_file_range (in-kernel, a reflink on XFS /
+              Btrfs), with each genome repeated `count` times like the _dupN symlinks.
+              DB/seqid2taxid.map is written too, so kraken2-build --build skips the
+              header scan.
+
+Usage:
+    python library_builder.py pack --counts boot/virid_db*_accession_counts.tsv \
+        --fna-dir fastas/ --store libstore/ --jobs 20
+    python library_builder.py assemble --counts boot/virid_db1_accession_counts.tsv \
+        --store libstore/ --db virid_db1
+    kraken2-build --build --db virid_db1 ...
+"""
+
+import argparse
+import csv
+import gzip
+import multiprocessing as mp
+import os
+import re
+import shutil
+import sys
+import zlib
+from collections import defaultdict
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+INDEX_NAME = "index.tsv"
+CHUNK_DIR = "chunks"
+MISSING_NAME = "missing_genomes.tsv"
+MANIFEST_NAME = "library_manifest.tsv"
+LIBRARY_SUBDIR = os.path.join("library", "bootstrap")
+
+DEFAULT_CHUNK_SIZE = "4G"
+BLOCK_SIZE = 1 << 24  # 16 MiB
+COPY_STEP = 1 << 30   # max bytes per copy_file_range call
+
+INDEX_FIELDS = ("accession", "taxid", "filename", "source_size", "source_mtime_ns",
+                "chunk", "offset", "length", "n_seqs")
+MANIFEST_FIELDS = ("chunk", "offset", "length", "count", "accession", "taxid")
+
+SIZE_RE = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*([KMGT]?)i?B?\s*$", re.I)
+
+
+def parse_size(text: str) -> int:
+    """'512M', '4G' or a plain byte count -> bytes."""
+    m = SIZE_RE.match(str(text))
+    if not m:
+        raise ValueError(f"Invalid size: {text!r} (use e.g. 512M or 4G)")
+    scale = {"": 1, "K": 1 << 10, "M": 1 << 20, "G": 1 << 30, "T": 1 << 40}[m.group(2).upper()]
+    return int(float(m.group(1)) * scale)
+
+
+class Genome(NamedTuple):
+    accession: str
+    taxid: str
+    filename: str
+
+
+class IndexRecord(NamedTuple):
+    accession: str
+    taxid: str
+    filename: str
+    source_size: int
+    source_mtime_ns: int
+    chunk: str
+    offset: int
+    length: int
+    n_seqs: int
+
+
+# ----------------------------
+# Inputs
+# ----------------------------
+
+def read_counts(path: str) -> List[Tuple[Genome, int]]:
+    """(genome, count) rows of an accession_counts.tsv (accession, taxid, filename, count columns)."""
+    rows = []
+    with open(path, newline="") as f:
+        reader = csv.DictReader(f, delimiter="\t")
+        missing = {"accession", "taxid", "filename", "count"} - set(reader.fieldnames or ())
+        if missing:
+            raise SystemExit(f"{path}: missing column(s) {', '.join(sorted(missing))}")
+        for row in reader:
+            accession, taxid, filename, count = (row[k].strip() for k in ("accession", "taxid", "filename", "count"))
+            if not accession or not filename or not count:
+                continue
+            if not count.isdigit():
+                raise SystemExit(f"{path}: non-integer count for accession '{accession}': '{count}'")
+            rows.append((Genome(accession, taxid, filename), int(count)))
+    return rows
+
+
+def read_index(store: str) -> Dict[str, IndexRecord]:
+    """accession -> latest IndexRecord of the store."""
+    records: Dict[str, IndexRecord] = {}
+    path = os.path.join(store, INDEX_NAME)
+    if not os.path.exists(path):
+        return records
+    with open(path, newline="") as f:
+        for row in csv.DictReader(f, delimiter="\t"):
+            rec = IndexRecord(**{k: (int(row[k]) if k in ("source_size", "source_mtime_ns", "offset", "length",
+                                                         "n_seqs") else row[k]) for k in INDEX_FIELDS})
+            records[rec.accession] = rec
+    return records
+
+
+def write_index(store: str, records: Dict[str, IndexRecord]):
+    path = os.path.join(store, INDEX_NAME)
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        f.write("\t".join(INDEX_FIELDS) + "\n")
+        for rec in sorted(records.values(), key=lambda r: (r.chunk, r.offset)):
+            f.write("\t".join(str(v) for v in rec) + "\n")
+    os.replace(tmp, path)
+
+
+# ----------------------------
+# Pack
+# ----------------------------
+
+def read_blocks(f, block_size: int = BLOCK_SIZE):
+    """Blocks of a binary file with CRLF and lone CR turned into LF, as text-mode reads do."""
+    held = b""  # a trailing CR, which may be the first half of CRLF
+    while True:
+        block = f.read(block_size)
+        if not block:
+            if held:
+                yield b"\n"
+            return
+        block = held + block
+        held = b""
+        if b"\r" in block:
+            if block.endswith(b"\r"):
+                block, held = block[:-1], b"\r"
+            block = block.replace(b"\r\n", b"\n").replace(b"\r", b"\n")
+        if block:
+            yield block
+
+
+def tag_fasta(src_path: str, out, prefix: bytes, block_size: int = BLOCK_SIZE) -> int:
+    """
+    Copy a .fna / .fna.gz to out with every header rewritten as >{prefix} {header}
+    (the output of headers2taxid.modify_fasta_headers, line endings included). Sequence
+    bytes are copied in blocks, never split into lines. Ends the genome with a newline;
+    returns the number of headers.
+    """
+    opener = gzip.open if src_path.endswith(".gz") else open
+    n_headers = 0
+    pending = None       # header cut off at the end of the previous block
+    line_start = True
+    last = b"\n"
+
+    def header(h: bytes):
+        out.write(b">" + prefix + b" " + h.strip() + b"\n")
+
+    with opener(src_path, "rb") as f:
+        for block in read_blocks(f, block_size):
+            pos = 0
+            if pending is not None:
+                nl = block.find(b"\n")
+                if nl < 0:
+                    pending += block
+                    continue
+                header(pending + block[:nl])
+                n_headers += 1
+                pending = None
+                pos = nl + 1
+                line_start = True
+                last = b"\n"
+            n = len(block)
+            while pos < n:
+                if line_start and block[pos] == 0x3E:  # '>'
+                    nl = block.find(b"\n", pos)
+                    if nl < 0:
+                        pending = block[pos + 1:]
+                        break
+                    header(block[pos + 1:nl])
+                    n_headers += 1
+                    pos = nl + 1
+                    last = b"\n"
+                    continue
+                i = block.find(b"\n>", pos)
+                end = n if i < 0 else i + 1
+                out.write(block[pos:end])
+                last = block[end - 1:end]
+                line_start = last == b"\n"
+                pos = end
+    if pending is not None:
+        header(pending)
+        n_headers += 1
+    elif last != b"\n":
+        out.write(b"\n")
+    return n_headers
+
+
+def pack_worker(args) -> Tuple[List[IndexRecord], List[Tuple[Genome, str]]]:
+    """
+    Pack a list of genomes into this worker's own chunk files; returns (records, errors).
+    Unreadable genomes are cut back out of their chunk and reported; if anything else goes
+    wrong, the worker stops and reports the rest of its list, keeping what it packed.
+    """
+    genomes, fna_dir, chunk_dir, chunk_prefix, chunk_size = args
+    records: List[IndexRecord] = []
+    errors: List[Tuple[Genome, str]] = []
+    out = None
+    chunk_name = None
+    n_chunks = 0
+
+    def close_chunk():
+        tmp = os.path.join(chunk_dir, chunk_name + ".tmp")
+        empty = out.tell() == 0
+        out.close()
+        if empty:
+            os.remove(tmp)
+        else:
+            os.replace(tmp, os.path.join(chunk_dir, chunk_name))
+
+    def next_chunk():
+        nonlocal out, chunk_name, n_chunks
+        if out is not None:
+            close_chunk()
+        n_chunks += 1
+        chunk_name = f"{chunk_prefix}_{n_chunks:04d}.fna"
+        out = open(os.path.join(chunk_dir, chunk_name + ".tmp"), "wb", buffering=1 << 22)
+
+    i = 0
+    start = None
+    try:
+        for i, g in enumerate(genomes):
+            src = os.path.join(fna_dir, g.filename)
+            start = None
+            if out is None or out.tell() >= chunk_size:
+                next_chunk()
+            start = out.tell()
+            try:
+                st = os.stat(src)
+                n_seqs = tag_fasta(src, out, f"{g.accession}|kraken:taxid|{g.taxid}".encode())
+            except (OSError, EOFError, zlib.error) as e:
+                # Drop whatever was written for the genome
+                out.seek(start)
+                out.truncate()
+                errors.append((g, str(e) or type(e).__name__))
+                continue
+            records.append(IndexRecord(g.accession, g.taxid, g.filename, st.st_size, st.st_mtime_ns,
+                                       chunk_name, start, out.tell() - start, n_seqs))
+    except Exception as e:
+        g = genomes[i]
+        if start is not None and out is not None and not out.closed:
+            out.seek(start)
+            out.truncate()
+        errors.append((g, f"{type(e).__name__}: {e}"))
+        errors.extend((rest, f"not packed, worker stopped at {g.accession}") for rest in genomes[i + 1:])
+    finally:
+        if out is not None and not out.closed:
+            close_chunk()
+    return records, errors
+
+
+def is_packed(g: Genome, rec: Optional[IndexRecord], fna_dir: str) -> bool:
+    if rec is None or rec.taxid != g.taxid or rec.filename != g.filename:
+        return False
+    try:
+        st = os.stat(os.path.join(fna_dir, g.filename))
+    except OSError:
+        return True  # source gone, the packed copy is still good
+    return (st.st_size, st.st_mtime_ns) == (rec.source_size, rec.source_mtime_ns)
+
+
+def partition_by_size(genomes: List[Genome], fna_dir: str, n_bins: int) -> List[List[Genome]]:
+    """Largest first onto the lightest bin, so workers finish together."""
+    def size(g):
+        try:
+            return os.path.getsize(os.path.join(fna_dir, g.filename))
+        except OSError:
+            return 0
+
+    bins: List[List[Genome]] = [[] for _ in range(n_bins)]
+    loads = [0] * n_bins
+    for g in sorted(genomes, key=lambda g: (-size(g), g.accession)):
+        i = min(range(n_bins), key=lambda b: (loads[b], b))
+        bins[i].append(g)
+        loads[i] += size(g)
+    return [b for b in bins if b]
+
+
+def pack(counts_files: List[str], fna_dir: str, store: str, n_jobs: int, chunk_size: int) -> int:
+    chunk_dir = os.path.join(store, CHUNK_DIR)
+    os.makedirs(chunk_dir, exist_ok=True)
+    index = read_index(store)
+
+    unique: Dict[str, Genome] = {}
+    n_rows = n_reads = 0
+    for path in counts_files:
+        for g, count in read_counts(path):
+            prev = unique.setdefault(g.accession, g)
+            if prev != g:
+                raise SystemExit(f"{path}: {g.accession} listed with a different taxid or file than in another table")
+            n_rows += 1
+            n_reads += count
+    todo = [g for g in unique.values() if not is_packed(g, index.get(g.accession), fna_dir)]
+    print(f"{len(unique)} unique genomes in {n_rows} rows of {len(counts_files)} tables ({n_reads} sampled copies); "
+          f"{len(unique) - len(todo)} already packed, packing {len(todo)}")
+
+    missing = [g for g in todo if not os.path.exists(os.path.join(fna_dir, g.filename))]
+    todo = [g for g in todo if os.path.exists(os.path.join(fna_dir, g.filename))]
+    errors: List[Tuple[Genome, str]] = [(g, "not found") for g in missing]
+
+    if todo:
+        # New chunks get a run number above every chunk already in the store
+        runs = [int(m.group(1)) for m in (re.match(r"^r(\d+)_", r.chunk) for r in index.values()) if m]
+        run = max(runs, default=0) + 1
+        bins = partition_by_size(todo, fna_dir, max(1, n_jobs))
+        tasks = [(b, fna_dir, chunk_dir, f"r{run:03d}_w{i:03d}", chunk_size) for i, b in enumerate(bins)]
+        pool = mp.Pool(min(n_jobs, len(tasks))) if n_jobs > 1 else None
+        try:
+            results = pool.imap_unordered(pack_worker, tasks) if pool else map(pack_worker, tasks)
+            for records, errs in results:
+                for rec in records:
+                    index[rec.accession] = rec
+                errors.extend(errs)
+        finally:
+            if pool is not None:
+                pool.terminate()
+            # Keep what the finished workers packed, even if another one died
+            write_index(store, index)
+
+    missing_log = os.path.join(store, MISSING_NAME)
+    with open(missing_log, "w") as f:
+        f.write("accession\tfilename\texpected_path\terror\n")
+        for g, err in sorted(errors):
+            f.write(f"{g.accession}\t{g.filename}\t{os.path.join(fna_dir, g.filename)}\t{err}\n")
+
+    n_chunks = len({r.chunk for r in index.values()})
+    print(f"Store: {len(index)} genomes in {n_chunks} chunks ({store})")
+    if errors:
+        print(f"WARNING: {len(errors)} genomes could not be packed (see {missing_log})", file=sys.stderr)
+        return 1
+    return 0
+
+
+# ----------------------------
+# Assemble
+# ----------------------------
+
+def copy_range(src_fd: int, dst_fd: int, offset: int, length: int):
+    """Append src[offset:offset+length] to dst, in-kernel where the OS allows it."""
+    done = 0
+    if hasattr(os, "copy_file_range"):
+        try:
+            while done < length:
+                n = os.copy_file_range(src_fd, dst_fd, min(length - done, COPY_STEP), offset + done)
+                if n == 0:
+                    break
+                done += n
+        except OSError:
+            pass  # e.g. EXDEV on older kernels; finish with plain reads
+    while done < length:
+        data = os.pread(src_fd, min(length - done, BLOCK_SIZE), offset + done)
+        if not data:
+            raise OSError(f"Unexpected end of chunk at offset {offset + done}")
+        os.write(dst_fd, data)
+        done += len(data)
+
+
+def build_manifest(counts: List[Tuple[Genome, int]], index: Dict[str, IndexRecord]):
+    """Manifest rows (chunk, offset, length, count, accession, taxid) in chunk order, plus problems."""
+    rows = []
+    problems = []
+    for g, count in counts:
+        rec = index.get(g.accession)
+        if rec is None:
+            problems.append(f"{g.accession} is not in the store (run pack with this table)")
+        elif rec.taxid != g.taxid:
+            problems.append(f"{g.accession} was packed with taxid {rec.taxid}, table says {g.taxid} (repack)")
+        elif count > 0:
+            rows.append((rec.chunk, rec.offset, rec.length, count, rec.accession, rec.taxid))
+    rows.sort()
+    return rows, problems
+
+
+def write_manifest(path: str, rows):
+    with open(path, "w") as f:
+        f.write("\t".join(MANIFEST_FIELDS) + "\n")
+        for row in rows:
+            f.write("\t".join(map(str, row)) + "\n")
+
+
+def materialize(rows, store: str, db: str, part_size: int) -> Tuple[int, int, int]:
+    """Write DB/library/bootstrap/ from manifest rows; returns (files linked, files written, bytes copied)."""
+    chunk_dir = os.path.abspath(os.path.join(store, CHUNK_DIR))
+    lib_dir = os.path.join(db, LIBRARY_SUBDIR)
+    if os.path.isdir(lib_dir):
+        shutil.rmtree(lib_dir)
+    os.makedirs(lib_dir)
+
+    by_chunk: Dict[str, list] = defaultdict(list)
+    for row in rows:
+        by_chunk[row[0]].append(row)
+
+    n_linked = n_parts = copied = 0
+    out_fd = None
+    out_size = 0
+
+    def next_part():
+        nonlocal out_fd, out_size, n_parts
+        if out_fd is not None:
+            os.close(out_fd)
+        n_parts += 1
+        out_fd = os.open(os.path.join(lib_dir, f"library_{n_parts:04d}.fna"), os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
+                         0o644)
+        out_size = 0
+
+    try:
+        for chunk in sorted(by_chunk):
+            chunk_rows = by_chunk[chunk]
+            src = os.path.join(chunk_dir, chunk)
+            counts = {r[3] for r in chunk_rows}
+            # A chunk used whole, every genome the same number of times: link it instead of copying
+            if len(counts) == 1 and sum(r[2] for r in chunk_rows) == os.path.getsize(src):
+                for k in range(1, counts.pop() + 1):
+                    os.symlink(src, os.path.join(lib_dir, f"{chunk[:-4]}_dup{k}.fna"))
+                    n_linked += 1
+                continue
+            src_fd = os.open(src, os.O_RDONLY)
+            try:
+                for _, offset, length, count, _, _ in chunk_rows:
+                    for _ in range(count):
+                        if out_fd is None or out_size >= part_size:
+                            next_part()
+                        copy_range(src_fd, out_fd, offset, length)
+                        out_size += length
+                        copied += length
+            finally:
+                os.close(src_fd)
+    finally:
+        if out_fd is not None:
+            os.close(out_fd)
+    return n_linked, n_parts, copied
+
+
+def assemble(counts_file: str, store: str, db: str, part_size: int) -> int:
+    index = read_index(store)
+    if not index:
+        raise SystemExit(f"No {INDEX_NAME} in {store}; run pack first")
+    counts = read_counts(counts_file)
+    rows, problems = build_manifest(counts, index)
+    if problems:
+        for p in problems[:20]:
+            print(f"ERROR: {p}", file=sys.stderr)
+        if len(problems) > 20:
+            print(f"ERROR: ... {len(problems) - 20} more", file=sys.stderr)
+        print(f"Nothing written to {db}", file=sys.stderr)
+        return 1
+
+    os.makedirs(db, exist_ok=True)
+    write_manifest(os.path.join(db, MANIFEST_NAME), rows)
+    n_linked, n_parts, copied = materialize(rows, store, db, part_size)
+
+    # Every sequence of a genome carries the same seqid (ACC|kraken:taxid|TAXID)
+    taxids = {f"{r[4]}|kraken:taxid|{r[5]}": r[5] for r in rows}
+    with open(os.path.join(db, "seqid2taxid.map"), "w") as f:
+        for seqid in sorted(taxids):
+            f.write(f"{seqid}\t{taxids[seqid]}\n")
+
+    n_copies = sum(r[3] for r in rows)
+    print(f"{db}: {len(rows)} genomes, {n_copies} copies; {n_linked} chunk links, {n_parts} library files, "
+          f"{copied / (1 << 30):.2f} GiB copied")
+    return 0
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Deduplicated Kraken2 library builder for bootstrap databases.")
+    sub = ap.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("pack", help="Tag and pack every unique genome of the count tables into the store")
+    p.add_argument("--counts", nargs="+", required=True, help="*_dbN_accession_counts.tsv files (bootstraps.R)")
+    p.add_argument("--fna-dir", required=True, help="Directory with the genome .fna / .fna.gz files")
+    p.add_argument("--store", required=True, help="Store directory (chunks/, index.tsv)")
+    p.add_argument("--jobs", type=int, default=min(8, os.cpu_count() or 1))
+    p.add_argument("--chunk-size", default=DEFAULT_CHUNK_SIZE, help=f"Target chunk size (default {DEFAULT_CHUNK_SIZE})")
+
+    p = sub.add_parser("assemble", help="Write one database's manifest and library from the store")
+    p.add_argument("--counts", required=True, help="The database's *_dbN_accession_counts.tsv")
+    p.add_argument("--store", required=True)
+    p.add_argument("--db", required=True, help="Kraken2 database directory")
+    p.add_argument("--part-size", default=DEFAULT_CHUNK_SIZE,
+                   help=f"Size of copied library files (default {DEFAULT_CHUNK_SIZE})")
+
+    args = ap.parse_args()
+    if args.command == "pack":
+        sys.exit(pack(args.counts, args.fna_dir, args.store, args.jobs, parse_size(args.chunk_size)))
+    sys.exit(assemble(args.counts, args.store, args.db, parse_size(args.part_size)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,29 @@
+#!/usr/bin/env bash
+#SBATCH -J library
+#SBATCH -N 1
+#SBATCH --ntasks=1
+#SBATCH --cpus-per-task=20
+#SBATCH --mem=20G
+#SBATCH --time=48:00:00
+
+# Libraries for all bootstrap databases from one deduplicated store, instead of
+# kraken_library.sh once per database. Keep --jobs at --cpus-per-task.
+
+module load python/3.12.5
+
+echo "START"
+date
+
+cd $MYPATH/entropy/
+
+python library_builder.py pack --counts virid_boot/virid_db*_accession_counts.tsv \
+    --fna-dir $MYPATH/entropy/db_files/fastas --store $MYPATH/entropy/library_store --jobs 20
+
+for i in $(seq 1 10); do
+    mkdir -p $MYPATH/entropy/virid_db${i}/taxonomy
+    python library_builder.py assemble --counts virid_boot/virid_db${i}_accession_counts.tsv \
+        --store $MYPATH/entropy/library_store --db $MYPATH/entropy/virid_db${i}
+done
+
+echo "END"
+date
@@ -1,7 +1,10 @@
+import argparse
 import os
+import numpy as np
 import pandas as pd
 from pathlib import Path
 from collections import defaultdict
+from entropy_sketch import ValueSketch, sketch_path_for, write_sketches
 
 # Define paths
 TAXDUMP_DIR = Path("$MYPATH/entropy/accession2taxid_masters/tax")  # contains nodes.dmp
@@ -33,74 +36,122 @@ def get_lineage(taxid, parent_map):
     lineage.append(taxid)  # root
     return lineage
 
+# Lineage of a taxid as (list from taxid to root, {ancestor: steps up}), memoized in cache
+def cached_lineage(taxid, parent_map, cache):
+    entry = cache.get(taxid)
+    if entry is None:
+        lineage = get_lineage(taxid, parent_map)
+        steps = {}
+        for i, anc in enumerate(lineage):
+            steps.setdefault(anc, i)
+        entry = cache[taxid] = (lineage, steps)
+    return entry
+
 # Calculate distance between two taxids
-def tax_distance(t1, t2, parent_map):
+def tax_distance(t1, t2, parent_map, lineage_cache=None):
     if t1 == t2:
         return 0
-    lineage1 = get_lineage(t1, parent_map)
-    lineage2 = get_lineage(t2, parent_map)
-    set1 = set(lineage1)
+    if lineage_cache is None:
+        lineage_cache = {}
+    _, steps1 = cached_lineage(t1, parent_map, lineage_cache)
+    lineage2, _ = cached_lineage(t2, parent_map, lineage_cache)
     for i, anc2 in enumerate(lineage2):
-        if anc2 in set1:
-            j = lineage1.index(anc2)
+        j = steps1.get(anc2)
+        if j is not None:
             return i + j  # steps up + steps down
     return None  # No common ancestor (shouldn't happen)
 
+# Distances for every (true_taxid, pred) cell of a reads x dbs table
+# Pairs are factorized to integer codes so each distinct pair is scored once.
+# Returns (dist as float array, NaN where none; unclassified mask).
+def pair_distances(true_tax, pred_tax, parent_map):
+    n_reads, n_dbs = pred_tax.shape
+    true_codes, true_uniques = pd.factorize(true_tax)  # missing -> -1
+    pred_codes, pred_uniques = pd.factorize(pred_tax.ravel())
+    width = len(pred_uniques) + 1
+    pair_codes = (np.repeat(true_codes, n_dbs).astype(np.int64) + 1) * width + (pred_codes + 1)
+    uniques, inverse = np.unique(pair_codes, return_inverse=True)
+
+    dist_u = np.full(len(uniques), np.nan)
+    unclassified_u = np.zeros(len(uniques), dtype=bool)
+    lineage_cache = {}
+    for u, code in enumerate(uniques):
+        ti, pi = divmod(int(code), width)
+        true_t = true_uniques[ti - 1] if ti else None
+        pred_t = pred_uniques[pi - 1] if pi else None
+        if pred_t is None or pred_t in ("0", ""):
+            unclassified_u[u] = True
+        elif true_t in parent_map and pred_t in parent_map:
+            dist = tax_distance(true_t, pred_t, parent_map, lineage_cache)
+            if dist is not None:
+                dist_u[u] = dist
+        else:
+            unclassified_u[u] = True
+
+    inverse = inverse.reshape(n_reads, n_dbs)
+    return dist_u[inverse], unclassified_u[inverse]
+
+# Per-read column from float values: int while nothing is missing (as pandas infers from ints)
+def distance_column(values):
+    if len(values) and not np.isnan(values).any():
+        return values.astype(np.int64)
+    return values
+
 # Analyze a single summary file
-def analyze_summary_file(file_path, parent_map):
+def analyze_summary_file(file_path, parent_map, output_dir=None, db_name=DB_NAME):
+    output_dir = OUTPUT_DIR if output_dir is None else output_dir
     df = pd.read_csv(file_path, sep="\t", dtype=str)
-    base = file_path.stem.replace(f"_{DB_NAME}_summary", "")
-    tax_columns = [col for col in df.columns if col.startswith(DB_NAME)]
+    base = file_path.stem.replace(f"_{db_name}_summary", "")
+    tax_columns = [col for col in df.columns if col.startswith(db_name)]
     n_reads = len(df)
 
     # Per-read scores
-    per_read_rows = []
     per_sample_summary = []
 
-    for idx, row in df.iterrows():
-        sid = row["SequenceID"]
-        true_tax = row["true_taxid"]
-        dist_vals = []
-        unclassified = 0
-
-        for col in tax_columns:
-            pred_tax = row[col]
-            if pred_tax in ("0", None, "", pd.NA):
-                dist_vals.append(None)
-                unclassified += 1
-            elif true_tax in parent_map and pred_tax in parent_map:
-                dist = tax_distance(true_tax, pred_tax, parent_map)
-                dist_vals.append(dist)
-            else:
-                dist_vals.append(None)
-                unclassified += 1
-
-        dist_only = [d for d in dist_vals if d is not None]
-        mean_dist = sum(dist_only) / len(dist_only) if dist_only else None
-        range_dist = max(dist_only) - min(dist_only) if dist_only else None
-
-        row_data = {
-            "SequenceID": sid,
-            "true_taxid": true_tax,
-            **{f"{col}": row[col] for col in tax_columns},
-            **{f"dist{col[-1]}": dist_vals[i] for i, col in enumerate(tax_columns)},
-            "mean_dist": mean_dist,
-            "range_dist": range_dist,
-            "unclassified_count": unclassified
-        }
-        per_read_rows.append(row_data)
+    dist, unclassified = pair_distances(
+        df["true_taxid"].to_numpy(dtype=object),
+        df[tax_columns].to_numpy(dtype=object).reshape(n_reads, len(tax_columns)),
+        parent_map,
+    )
+    has_dist = ~np.isnan(dist)
+    n_dist = has_dist.sum(axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean_dist = np.where(has_dist, dist, 0).sum(axis=1) / n_dist
+    range_dist = np.where(has_dist, dist, -np.inf).max(axis=1, initial=-np.inf) \
+        - np.where(has_dist, dist, np.inf).min(axis=1, initial=np.inf)
+    range_dist[n_dist == 0] = np.nan
+
+    columns = {
+        "SequenceID": df["SequenceID"].to_numpy(),
+        "true_taxid": df["true_taxid"].to_numpy(),
+    }
+    for col in tax_columns:
+        columns[col] = df[col].to_numpy()
+    for i, col in enumerate(tax_columns):
+        columns[f"dist{col[-1]}"] = distance_column(dist[:, i])
+    columns["mean_dist"] = mean_dist
+    columns["range_dist"] = distance_column(range_dist)
+    columns["unclassified_count"] = unclassified.sum(axis=1)
 
     # Save per-read output
-    per_read_df = pd.DataFrame(per_read_rows)
-    out_path = OUTPUT_DIR / f"{base}_taxdist_per_read.tsv"
+    per_read_df = pd.DataFrame(columns)
+    out_path = output_dir / f"{base}_taxdist_per_read.tsv"
     per_read_df.to_csv(out_path, sep="\t", index=False)
 
+    # Mergeable per-database sketches next to the per-read output (see entropy_sketch.py)
+    sketches = []
+    for i, col in enumerate(tax_columns):
+        sketch = ValueSketch("tax_distance", bin_width=1)
+        sketch.add(dist[:, i])
+        sketches.append({"meta": {"output": str(out_path), "dataset": base, "db": col}, "sketch": sketch})
+    write_sketches(sketch_path_for(out_path), sketches)
+
     # Per-sample summary
     for i, col in enumerate(tax_columns):
         dist_col = f"dist{col[-1]}"
         col_vals = per_read_df[dist_col].dropna().astype(float)
         row_summary = {
-            f"sample_{DB_NAME}": f"{base}_{col}",
+            f"sample_{db_name}": f"{base}_{col}",
             "mean": col_vals.mean(),
             "median": col_vals.median(),
             "q25": col_vals.quantile(0.25),
@@ -114,18 +165,27 @@ def analyze_summary_file(file_path, parent_map):
     return per_sample_summary
 
 # Main script
-def run_taxonomic_distance_scoring():
-    OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
-    parent_map, rank_map = load_taxonomy(TAXDUMP_DIR / "nodes.dmp")
+def run_taxonomic_distance_scoring(nodes_file=None, summary_dir=SUMMARY_DIR, output_dir=OUTPUT_DIR, db_name=DB_NAME):
+    nodes_file = TAXDUMP_DIR / "nodes.dmp" if nodes_file is None else nodes_file
+    output_dir.mkdir(parents=True, exist_ok=True)
+    parent_map, rank_map = load_taxonomy(nodes_file)
 
     all_summaries = []
-    for summary_file in sorted(SUMMARY_DIR.glob(f"*_{DB_NAME}_summary.txt")):
+    for summary_file in sorted(summary_dir.glob(f"*_{db_name}_summary.txt")):
         print(f"Processing: {summary_file.name}")
-        file_summary = analyze_summary_file(summary_file, parent_map)
+        file_summary = analyze_summary_file(summary_file, parent_map, output_dir, db_name)
         all_summaries.extend(file_summary)
 
     # Save global summary
     summary_df = pd.DataFrame(all_summaries)
-    summary_df.to_csv(OUTPUT_DIR / f"full_summary_{DB_NAME}.tsv", sep="\t", index=False)
+    summary_df.to_csv(output_dir / f"full_summary_{db_name}.tsv", sep="\t", index=False)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Per-read taxonomic distance between true and predicted taxids.")
+    parser.add_argument("--nodes-dmp", type=Path, default=TAXDUMP_DIR / "nodes.dmp", help="NCBI nodes.dmp")
+    parser.add_argument("--summary-dir", type=Path, default=SUMMARY_DIR, help="Directory with *_<db>_summary.txt files")
+    parser.add_argument("--output-dir", type=Path, default=OUTPUT_DIR, help="Where to write scored outputs")
+    parser.add_argument("--db-name", default=DB_NAME, help=f"Database column prefix (default: {DB_NAME})")
+    args = parser.parse_args()
 
-run_taxonomic_distance_scoring()
+    run_taxonomic_distance_scoring(args.nodes_dmp, args.summary_dir, args.output_dir, args.db_name)
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+
+"""
+batch_manifest.py
+
+Crash-safe checkpoint manifest for weighted_entropy_batch runs.
+
+Each finished output appends one JSON line to <outdir>/manifest.jsonl recording the input's
+size and mtime, a hash of the scoring parameters, and the summary row. On resume an output
+is reused only if it exists and its latest manifest record matches the current input and
+parameters; everything else (missing, stale, different parameters, or interrupted before its
+record was written) is recomputed. Outputs themselves are written to a temp file and renamed
+into place, so a killed job never leaves a truncated file under the final name.
+"""
+
+import fcntl
+import hashlib
+import json
+import os
+from typing import Dict, Optional
+
+MANIFEST_NAME = "manifest.jsonl"
+
+# Task fields that change the content of a per-read output
+PARAM_KEYS = ("true_taxid", "alpha_up", "alpha_down", "unclassified_entropy", "write_diag")
+# Only hashed when set, so records written without them stay valid
+OPTIONAL_PARAM_KEYS = ("key_path", "key_signature", "taxonomy_signature", "keep_taxids_digest")
+
+# Result fields stored so a reused output can reproduce its summary row
+SUMMARY_KEYS = ("status", "n_reads", "n_valid", "mean_entropy", "codec_in", "codec_out",
+                "q25_entropy", "median_entropy", "q75_entropy")
+
+
+def tmp_path_for(out_path: str) -> str:
+    return f"{out_path}.tmp"
+
+
+def params_hash(task) -> str:
+    params = {k: task.get(k) for k in PARAM_KEYS}
+    params.update({k: task[k] for k in OPTIONAL_PARAM_KEYS if task.get(k) is not None})
+    params["true_taxid"] = str(params["true_taxid"]).strip()
+    blob = json.dumps(params, sort_keys=True).encode()
+    return hashlib.sha1(blob).hexdigest()[:16]
+
+
+def taxids_digest(taxids) -> str:
+    """Short digest of a taxid set, e.g. the --prune-to keep set."""
+    blob = ",".join(map(str, sorted(taxids))).encode()
+    return hashlib.sha1(blob).hexdigest()[:16]
+
+
+def input_signature(path: str) -> Optional[Dict[str, int]]:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+
+def load_manifest(manifest_path: str) -> Dict[str, dict]:
+    """Latest record per output path. A torn last line from a crash is ignored."""
+    records: Dict[str, dict] = {}
+    try:
+        with open(manifest_path, "r") as f:
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    continue
+                if isinstance(rec, dict) and "output" in rec:
+                    records[rec["output"]] = rec
+    except FileNotFoundError:
+        pass
+    return records
+
+
+def append_manifest(manifest_path: str, result) -> None:
+    """Append the record for a finished task (one write, under an advisory lock)."""
+    rec = {
+        "output": result["out_path"],
+        "input": result["path"],
+        "input_signature": result.get("input_signature"),
+        "params_hash": params_hash(result),
+        "summary": {k: result.get(k, "") for k in SUMMARY_KEYS},
+    }
+    line = (json.dumps(rec) + "\n").encode()
+    fd = os.open(manifest_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        except OSError:
+            pass  # e.g. NFS without lock support; O_APPEND still keeps small lines whole
+        os.write(fd, line)
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def is_up_to_date(task, record: Optional[dict]) -> bool:
+    """True if task's output can be reused as recorded in the manifest."""
+    if record is None or record.get("summary", {}).get("status") != "ok":
+        return False
+    if not os.path.exists(task["out_path"]):
+        return False
+    if record.get("input_signature") != task.get("input_signature"):
+        return False
+    return record.get("params_hash") == params_hash(task)
@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+
+"""
+batch_shards.py
+
+Split one weighted_entropy_batch run across the tasks of a SLURM array, and stitch the
+shards back together.
+
+Every shard discovers the full job list, sorts it by path and partitions it the same
+way: largest input first, each job to the currently lightest shard (ties to the lowest
+shard), so shards get about the same number of input bytes and every node computes the
+identical assignment. Keys missing from the key file are dealt round-robin in path
+order. Each shard records what it was given in <outdir>/shards/:
+
+    shard_0003_of_0020.json                  plan: fingerprint of the full job list, this
+                                             shard's inputs, its summary TSV
+    missing_key_for_outputs_0003_of_0020.txt this shard's share of the missing-key list
+
+`weighted_entropy_batch.py reduce` checks that all N plans are present and agree on the
+job list, that every job appears in exactly one shard summary (none lost, none
+duplicated), and writes the merged summary TSV and missing_key_for_outputs.txt.
+
+    sbatch --array=1-20 ...  weighted_entropy_batch.py ... --shard $SLURM_ARRAY_TASK_ID/$SLURM_ARRAY_TASK_COUNT
+    python weighted_entropy_batch.py reduce --outdir per_read --summary-tsv summary.tsv
+"""
+
+import argparse
+import glob
+import hashlib
+import json
+import os
+import re
+import sys
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+SHARD_DIR = "shards"
+MISSING_KEY_NAME = "missing_key_for_outputs.txt"
+
+SHARD_RE = re.compile(r"^\s*(\d+)\s*/\s*(\d+)\s*$")
+PLAN_RE = re.compile(r"^shard_(\d+)_of_(\d+)\.json$")
+
+# Paths listed in error messages
+SAMPLE_SIZE = 10
+
+
+def parse_shard(text: str) -> Tuple[int, int]:
+    """'3/20' -> (3, 20); shards are numbered from 1, like the SLURM array in the wrap script."""
+    m = SHARD_RE.match(text)
+    if not m:
+        raise ValueError(f"Invalid shard {text!r} (use i/N, e.g. 3/20)")
+    index, n_shards = int(m.group(1)), int(m.group(2))
+    if not 1 <= index <= n_shards:
+        raise ValueError(f"Invalid shard {text!r}: i must be between 1 and N")
+    return index, n_shards
+
+
+def shard_label(index: int, n_shards: int) -> str:
+    return f"{index:04d}_of_{n_shards:04d}"
+
+
+def job_size(job) -> int:
+    try:
+        return os.path.getsize(job["path"])
+    except OSError:
+        return 0
+
+
+def job_fingerprint(jobs: List[dict]) -> str:
+    """Hash of the full job list, so reduce can tell whether all shards saw the same one."""
+    h = hashlib.sha1()
+    for j in sorted(jobs, key=lambda j: j["path"]):
+        h.update(f"{j['path']}\t{str(j['true_taxid']).strip()}\t{j.get('key_path', '')}\n".encode())
+    return h.hexdigest()
+
+
+def partition_jobs(jobs: List[dict], n_shards: int) -> List[List[dict]]:
+    """Size-balanced, deterministic partition (greedy longest-processing-time on input bytes)."""
+    order = sorted(jobs, key=lambda j: (-job_size(j), j["path"]))
+    shards: List[List[dict]] = [[] for _ in range(n_shards)]
+    loads = [0] * n_shards
+    for j in order:
+        i = min(range(n_shards), key=lambda s: (loads[s], s))
+        shards[i].append(j)
+        loads[i] += job_size(j)
+    return [sorted(s, key=lambda j: j["path"]) for s in shards]
+
+
+def select_shard(jobs: List[dict], missing_key: List[str], index: int, n_shards: int):
+    """(this shard's jobs, this shard's missing-key paths) for shard index of n_shards."""
+    mine = partition_jobs(jobs, n_shards)[index - 1]
+    missing = sorted(missing_key)[index - 1::n_shards]
+    return mine, missing
+
+
+def write_shard_plan(outdir: str, index: int, n_shards: int, all_jobs: List[dict], jobs: List[dict],
+                     missing_key: List[str], summary_tsv: str) -> str:
+    """Record this shard's assignment (and write its missing-key list); returns the plan path."""
+    shard_dir = os.path.join(outdir, SHARD_DIR)
+    os.makedirs(shard_dir, exist_ok=True)
+    label = shard_label(index, n_shards)
+
+    missing_path = os.path.join(shard_dir, f"{MISSING_KEY_NAME[:-4]}_{label}.txt")
+    with open(missing_path, "w") as f:
+        f.writelines(p + "\n" for p in missing_key)
+
+    plan = {
+        "shard": index,
+        "n_shards": n_shards,
+        "n_jobs_total": len(all_jobs),
+        "fingerprint": job_fingerprint(all_jobs),
+        "summary_tsv": os.path.abspath(summary_tsv),
+        "missing_key": os.path.abspath(missing_path),
+        "inputs": [j["path"] for j in jobs],
+        "input_bytes": sum(job_size(j) for j in jobs),
+    }
+    path = os.path.join(shard_dir, f"shard_{label}.json")
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(plan, f, indent=1)
+    os.replace(tmp, path)
+    return path
+
+
+# ----------------------------
+# Reduce
+# ----------------------------
+
+def load_plans(outdir: str, n_shards: Optional[int] = None) -> Dict[int, dict]:
+    """shard index -> plan; all plans must be for the same N (or n_shards if given)."""
+    plans: Dict[int, Dict[int, dict]] = {}
+    for path in sorted(glob.glob(os.path.join(outdir, SHARD_DIR, "shard_*_of_*.json"))):
+        m = PLAN_RE.match(os.path.basename(path))
+        if not m:
+            continue
+        with open(path) as f:
+            plans.setdefault(int(m.group(2)), {})[int(m.group(1))] = json.load(f)
+    if not plans:
+        raise ValueError(f"No shard plans in {os.path.join(outdir, SHARD_DIR)}")
+    if n_shards is None:
+        if len(plans) > 1:
+            raise ValueError(f"Plans for several shard counts ({', '.join(map(str, sorted(plans)))}); "
+                             "pass --shards N")
+        n_shards = next(iter(plans))
+    if n_shards not in plans:
+        raise ValueError(f"No plans for {n_shards} shards")
+    return plans[n_shards]
+
+
+def _sample(paths) -> str:
+    paths = sorted(paths)
+    more = f", ... ({len(paths)} total)" if len(paths) > SAMPLE_SIZE else ""
+    return ", ".join(paths[:SAMPLE_SIZE]) + more
+
+
+def reduce_shards(outdir: str, summary_out: str, missing_out: Optional[str] = None,
+                  n_shards: Optional[int] = None) -> List[str]:
+    """
+    Verify the shards of a run and merge their summaries and missing-key lists.
+    Returns a list of problems; the merged files are written only if it is empty.
+    """
+    plans = load_plans(outdir, n_shards)
+    n_shards = next(iter(plans.values()))["n_shards"]
+    problems = []
+
+    absent = [i for i in range(1, n_shards + 1) if i not in plans]
+    if absent:
+        problems.append(f"{len(absent)} of {n_shards} shards never started: {', '.join(map(str, absent))}")
+    if len({p["fingerprint"] for p in plans.values()}) > 1:
+        problems.append("Shards saw different job lists (inputs or key file changed between shards); rerun them")
+
+    expected: Counter = Counter()
+    for p in plans.values():
+        expected.update(p["inputs"])
+    if plans and sum(expected.values()) != next(iter(plans.values()))["n_jobs_total"] and not absent:
+        problems.append("Shard plans do not add up to the discovered job list")
+    duplicated = [path for path, c in expected.items() if c > 1]
+    if duplicated:
+        problems.append(f"{len(duplicated)} inputs assigned to several shards: {_sample(duplicated)}")
+
+    header = None
+    rows: List[Tuple[str, str]] = []
+    seen: Counter = Counter()
+    for i in sorted(plans):
+        plan = plans[i]
+        try:
+            with open(plan["summary_tsv"]) as f:
+                shard_header = f.readline()
+                shard_rows = [line for line in f if line.strip()]
+        except OSError as e:
+            problems.append(f"Shard {i}: cannot read summary ({e})")
+            continue
+        if header is None:
+            header = shard_header
+        elif shard_header != header:
+            problems.append(f"Shard {i}: summary header differs from the other shards")
+            continue
+
+        assigned = set(plan["inputs"])
+        for line in shard_rows:
+            path = line.split("\t", 1)[0]
+            seen[path] += 1
+            if path not in assigned:
+                problems.append(f"Shard {i}: summary row for {path}, which was not assigned to it")
+            rows.append((path, line if line.endswith("\n") else line + "\n"))
+
+    lost = [path for path in expected if seen[path] == 0]
+    if lost:
+        problems.append(f"{len(lost)} jobs lost (no summary row): {_sample(lost)}")
+    repeated = [path for path, c in seen.items() if c > 1]
+    if repeated:
+        problems.append(f"{len(repeated)} jobs with several summary rows: {_sample(repeated)}")
+    if problems:
+        return problems
+
+    missing_key: List[str] = []
+    for i in sorted(plans):
+        with open(plans[i]["missing_key"]) as f:
+            missing_key.extend(line.rstrip("\n") for line in f if line.strip())
+    repeated = [p for p, c in Counter(missing_key).items() if c > 1]
+    if repeated:
+        return [f"{len(repeated)} missing-key entries listed by several shards: {_sample(repeated)}"]
+
+    rows.sort(key=lambda r: r[0])
+    with open(summary_out, "w") as f:
+        f.write(header)
+        f.writelines(line for _, line in rows)
+    with open(missing_out or os.path.join(outdir, MISSING_KEY_NAME), "w") as f:
+        f.writelines(p + "\n" for p in sorted(missing_key))
+    return []
+
+
+def count_failed(summary_tsv: str) -> int:
+    with open(summary_tsv) as f:
+        col = f.readline().rstrip("\n").split("\t").index("status")
+        return sum(1 for line in f if line.rstrip("\n").split("\t")[col] != "ok")
+
+
+def reduce_main(argv: List[str]) -> int:
+    ap = argparse.ArgumentParser(
+        prog="weighted_entropy_batch.py reduce",
+        description="Merge and verify the outputs of a --shard i/N run.",
+    )
+    ap.add_argument("--outdir", required=True, help="The --outdir shared by all shards")
+    ap.add_argument("--summary-tsv", required=True, help="Merged summary TSV to write")
+    ap.add_argument("--missing-key-out", default=None,
+                    help=f"Merged missing-key list (default: outdir/{MISSING_KEY_NAME})")
+    ap.add_argument("--shards", type=int, default=None, help="N, if plans for several shard counts exist")
+    args = ap.parse_args(argv)
+
+    try:
+        problems = reduce_shards(args.outdir, args.summary_tsv, args.missing_key_out, args.shards)
+    except (OSError, ValueError) as e:
+        problems = [str(e)]
+    if problems:
+        for p in problems:
+            print(f"ERROR: {p}", file=sys.stderr)
+        print("Nothing written.", file=sys.stderr)
+        return 1
+
+    n_failed = count_failed(args.summary_tsv)
+    if n_failed:
+        print(f"WARNING: {n_failed} jobs did not finish with status ok (see {args.summary_tsv})", file=sys.stderr)
+    print(f"Merged shards into {args.summary_tsv}", file=sys.stderr)
+    return 0
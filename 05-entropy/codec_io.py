@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+
+"""
+codec_io.py
+
+Pluggable compression for per-read inputs and outputs.
+
+The codec (plain, gzip or zstd) is chosen from the file extension unless given explicitly,
+and each codec has several backends tried in order of speed:
+
+    gzip:  isal (python-isal igzip)  ->  pigz (local subprocess)  ->  python (stdlib gzip)
+    zstd:  zstandard (multithreaded) ->  stdlib (compression.zstd) ->  cli (local zstd subprocess)
+
+The stdlib gzip backend is always available as a portable fallback. open_binary returns
+the file object together with a "codec:backend" label so callers can report what was used.
+"""
+
+import gzip
+import importlib
+import shutil
+import subprocess
+from typing import BinaryIO, Optional, Tuple
+
+CODECS = ("plain", "gzip", "zstd")
+BACKENDS = ("auto", "python", "isal", "pigz", "zstandard", "stdlib", "cli")
+
+EXTENSIONS = {".gz": "gzip", ".zst": "zstd"}
+SUFFIX_FOR_CODEC = {"plain": "", "gzip": ".gz", "zstd": ".zst"}
+
+DEFAULT_LEVELS = {"gzip": 3, "zstd": 3}
+# Backends that can write each codec, in the order "auto" tries them
+BACKENDS_FOR_CODEC = {"gzip": ("isal", "pigz", "python"), "zstd": ("zstandard", "stdlib", "cli")}
+# python-isal only has levels 0-3; higher levels are written as 3
+ISAL_MAX_LEVEL = 3
+
+
+def codec_for_path(path: str) -> str:
+    for ext, codec in EXTENSIONS.items():
+        if path.endswith(ext):
+            return codec
+    return "plain"
+
+
+def _optional_module(name: str):
+    try:
+        return importlib.import_module(name)
+    except ImportError:
+        return None
+
+
+def _backend_available(backend: str) -> bool:
+    if backend == "pigz":
+        return shutil.which("pigz") is not None
+    if backend == "cli":
+        return shutil.which("zstd") is not None
+    module = {"isal": "isal.igzip", "zstandard": "zstandard", "stdlib": "compression.zstd"}.get(backend)
+    return module is None or _optional_module(module) is not None
+
+
+def resolve_backend(codec: str, backend: str = "auto") -> str:
+    """
+    Backend open_binary would use to write codec, so a bad combination can be rejected
+    before any work starts. Raises ValueError if backend cannot write codec and
+    RuntimeError if it is not installed.
+    """
+    if codec == "plain":
+        if backend != "auto":
+            raise ValueError(f"Backend '{backend}' does not apply to plain output")
+        return "plain"
+    candidates = BACKENDS_FOR_CODEC[codec]
+    if backend != "auto":
+        if backend not in candidates:
+            raise ValueError(f"Backend '{backend}' does not support {codec}")
+        candidates = (backend,)
+    for name in candidates:
+        if _backend_available(name):
+            return name
+    if backend == "auto":
+        raise RuntimeError(f"No {codec} backend available")
+    raise RuntimeError(f"{codec} backend '{backend}' requested but it is not installed")
+
+
+class ProcessFile:
+    """File-like wrapper around a (de)compressor subprocess reading or writing `path`."""
+
+    def __init__(self, argv, path: str, mode: str):
+        self.argv = argv
+        self.mode = mode
+        if "r" in mode:
+            self._proc = subprocess.Popen(argv + [path], stdout=subprocess.PIPE)
+            self._pipe = self._proc.stdout
+            self._sink = None
+            self._eof = False
+        else:
+            self._sink = open(path, "wb")
+            self._proc = subprocess.Popen(argv, stdin=subprocess.PIPE, stdout=self._sink)
+            self._pipe = self._proc.stdin
+
+    def read(self, size: int = -1) -> bytes:
+        data = self._pipe.read(size)
+        if not data:
+            self._eof = True
+        return data
+
+    def write(self, data: bytes) -> int:
+        return self._pipe.write(data)
+
+    def close(self):
+        if self._pipe is None:
+            return
+        self._pipe.close()
+        self._pipe = None
+        rc = self._proc.wait()
+        if self._sink is not None:
+            self._sink.close()
+        # A reader closed before EOF legitimately kills the process with SIGPIPE
+        if rc != 0 and ("w" in self.mode or self._eof):
+            raise OSError(f"{' '.join(self.argv)} exited with status {rc}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+def _open_gzip(path: str, mode: str, backend: str, level: int, threads: int):
+    if backend in ("auto", "isal"):
+        igzip = _optional_module("isal.igzip")
+        if igzip is not None:
+            return igzip.open(path, mode, compresslevel=min(level, ISAL_MAX_LEVEL)), "gzip:isal"
+        if backend == "isal":
+            raise RuntimeError("gzip backend 'isal' requested but python-isal is not installed")
+
+    if backend in ("auto", "pigz"):
+        pigz = shutil.which("pigz")
+        if pigz is not None:
+            if "r" in mode:
+                argv = [pigz, "-dc"]
+            else:
+                argv = [pigz, "-c", f"-{level}", "-p", str(max(1, threads))]
+            return ProcessFile(argv, path, mode), "gzip:pigz"
+        if backend == "pigz":
+            raise RuntimeError("gzip backend 'pigz' requested but pigz is not on PATH")
+
+    if backend not in ("auto", "python"):
+        raise ValueError(f"Backend '{backend}' does not support gzip")
+    return gzip.open(path, mode, compresslevel=level), "gzip:python"
+
+
+def _open_zstd(path: str, mode: str, backend: str, level: int, threads: int):
+    if backend not in ("auto", "zstandard", "stdlib", "cli"):
+        raise ValueError(f"Backend '{backend}' does not support zstd")
+
+    if backend in ("auto", "zstandard"):
+        zstandard = _optional_module("zstandard")
+        if zstandard is not None:
+            fh = open(path, mode)
+            if "r" in mode:
+                dctx = zstandard.ZstdDecompressor()
+                return dctx.stream_reader(fh, read_across_frames=True, closefd=True), "zstd:zstandard"
+            cctx = zstandard.ZstdCompressor(level=level, threads=threads if threads > 1 else 0)
+            return cctx.stream_writer(fh, closefd=True), "zstd:zstandard"
+        if backend == "zstandard":
+            raise RuntimeError("zstd backend 'zstandard' requested but the zstandard package is not installed")
+
+    if backend in ("auto", "stdlib"):
+        zstd = _optional_module("compression.zstd")
+        if zstd is not None:
+            if "r" in mode:
+                return zstd.open(path, mode), "zstd:stdlib"
+            return zstd.open(path, mode, level=level), "zstd:stdlib"
+        if backend == "stdlib":
+            raise RuntimeError("zstd backend 'stdlib' requires Python 3.14+")
+
+    if backend in ("auto", "cli"):
+        exe = shutil.which("zstd")
+        if exe is not None:
+            if "r" in mode:
+                argv = [exe, "-dcq"]
+            else:
+                argv = [exe, "-cq", f"-{level}", f"-T{max(1, threads)}"]
+            return ProcessFile(argv, path, mode), "zstd:cli"
+        if backend == "cli":
+            raise RuntimeError("zstd backend 'cli' requested but zstd is not on PATH")
+
+    raise RuntimeError("No zstd backend available: install zstandard, use Python 3.14+, or put zstd on PATH")
+
+
+def open_binary(path: str,
+                mode: str,
+                codec: Optional[str] = None,
+                backend: str = "auto",
+                level: Optional[int] = None,
+                threads: int = 1) -> Tuple[BinaryIO, str]:
+    """
+    Open path for binary reading ("rb") or writing ("wb") through a compression codec.
+
+    codec defaults to codec_for_path(path). backend selects a specific implementation
+    (see BACKENDS); "auto" picks the fastest available. threads is used by backends that
+    compress in parallel (zstandard, pigz, zstd cli).
+
+    Returns (file object, "codec:backend" label).
+    """
+    if mode not in ("rb", "wb"):
+        raise ValueError(f"Unsupported mode: {mode}")
+    if codec is None:
+        codec = codec_for_path(path)
+    if codec not in CODECS:
+        raise ValueError(f"Unknown codec '{codec}'. Allowed: {', '.join(CODECS)}")
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend '{backend}'. Allowed: {', '.join(BACKENDS)}")
+
+    if codec == "plain":
+        return open(path, mode), "plain"
+    if level is None:
+        level = DEFAULT_LEVELS[codec]
+    if codec == "gzip":
+        return _open_gzip(path, mode, backend, level, threads)
+    return _open_zstd(path, mode, backend, level, threads)
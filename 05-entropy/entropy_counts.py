@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+
+"""
+entropy_counts.py
+
+Aggregated per-file entropy tables written by weighted_entropy_batch.py --aggregate.
+
+Within one Kraken output the true taxid is fixed, so entropy and the LCA diagnostics depend
+only on the predicted taxid. Instead of one row per read, the aggregated table has one row
+per distinct pred_taxid with its read count (n_reads, last column):
+
+    true_taxid  pred_taxid  entropy  [lca_taxid  lca_rank  up_from_true  down_to_pred  branch_size_LCA]  n_reads
+
+Values are formatted exactly as in the per-read output, so the per-read table can be
+rebuilt on demand by streaming the Kraken file again (expand_counts), or expanded without
+read IDs for distribution work (read_counts_table(..., expand=True)). Mixed samples scored
+against a per-read truth key have one row per distinct (true_taxid, pred_taxid).
+
+Usage:
+    python entropy_counts.py --counts X.entropy_counts.tsv --kraken-out X.out --output X.entropy.tsv
+"""
+
+import argparse
+import io
+from typing import Dict, Optional, Tuple
+
+from codec_io import codec_for_path, open_binary
+from kraken_io import PredTaxidParser, iter_kraken_blocks
+from truth_keys import TruthJoin
+
+COUNT_COLUMN = b"n_reads"
+
+
+def counts_header(read_header: bytes) -> bytes:
+    """Aggregated header for a per-read header: drop read_id, append n_reads."""
+    return read_header.split(b"\t", 1)[1].rstrip(b"\n") + b"\t" + COUNT_COLUMN + b"\n"
+
+
+def format_counts_rows(pred_stats: Dict[str, Tuple[int, Optional[float]]], row_suffixes: Dict[str, bytes]) -> bytes:
+    """
+    Body of an aggregated table, ordered by pred_taxid. row_suffixes holds the per-read row
+    after read_id ("\\ttrue\\tpred\\tentropy...\\n") for each pred.
+    """
+    out = []
+    for pred in sorted(pred_stats, key=lambda p: [(len(x), x) for x in p.split("\t")]):
+        count = pred_stats[pred][0]
+        out.append(row_suffixes[pred][1:-1] + b"\t" + str(count).encode() + b"\n")
+    return b"".join(out)
+
+
+def load_counts_rows(path: str) -> Tuple[bytes, Dict[bytes, bytes]]:
+    """(per-read header, b"true\\tpred" -> per-read row suffix) from an aggregated table."""
+    fin, _ = open_binary(path, "rb")
+    with fin:
+        lines = fin.read().split(b"\n")  # one line per distinct pred: small
+    header = lines[0].split(b"\t")
+    if header[-1] != COUNT_COLUMN or b"pred_taxid" not in header:
+        raise ValueError(f"{path} is not an aggregated entropy table")
+    true_i = header.index(b"true_taxid")
+    pred_i = header.index(b"pred_taxid")
+    rows: Dict[bytes, bytes] = {}
+    for line in lines[1:]:
+        fields = line.split(b"\t")
+        if len(fields) < len(header):
+            continue
+        rows[fields[true_i] + b"\t" + fields[pred_i]] = b"\t" + b"\t".join(fields[:-1]) + b"\n"
+    return b"read_id\t" + b"\t".join(header[:-1]) + b"\n", rows
+
+
+def expand_counts(counts_path: str, kraken_path: str, out_path: str, key_path: Optional[str] = None,
+                  backend: str = "auto", level: Optional[int] = None) -> int:
+    """
+    Rebuild the per-read output of one file from its aggregated table and the Kraken output
+    it was computed from. The result is identical to a per-read batch run. Returns reads written.
+
+    Tables of mixed samples (several true taxids) also need the per-read truth key_path
+    they were scored with.
+    """
+    header, rows = load_counts_rows(counts_path)
+    trues = {pair.split(b"\t")[0] for pair in rows}
+    truth = TruthJoin(key_path) if key_path else None
+    if truth is None and len(trues) > 1:
+        raise ValueError(f"{counts_path} has several true taxids; pass the truth key it was scored with")
+    true_b = next(iter(trues), b"")
+
+    parse_pred = PredTaxidParser()
+    n = 0
+    fin, _ = open_binary(kraken_path, "rb")
+    fout, _ = open_binary(out_path, "wb", codec=codec_for_path(out_path), backend=backend, level=level)
+    with fin, fout:
+        fout.write(header)
+        for records in iter_kraken_blocks(fin):
+            read_trues = truth.lookup([r[1] for r in records]) if truth else [true_b] * len(records)
+            out_rows = []
+            for (status, read_id, field3), t in zip(records, read_trues):
+                pair = t + b"\t" + parse_pred(field3, status)
+                row = rows.get(pair)
+                if row is None:
+                    raise ValueError(f"(true, pred) {pair.decode()!r} of read {read_id.decode()} not in {counts_path}")
+                out_rows.append(read_id)
+                out_rows.append(row)
+            fout.write(b"".join(out_rows))
+            n += len(records)
+    if truth:
+        truth.close()
+    return n
+
+
+def read_counts_table(path: str, expand: bool = False):
+    """
+    Read an aggregated table into a DataFrame. With expand=True each row is repeated
+    n_reads times (per-read values without read IDs) and n_reads is dropped.
+    """
+    import pandas as pd
+
+    fin, _ = open_binary(path, "rb")
+    with fin:
+        df = pd.read_csv(io.BytesIO(fin.read()), sep="\t")
+    if expand:
+        df = df.loc[df.index.repeat(df[COUNT_COLUMN.decode()])].drop(columns=COUNT_COLUMN.decode())
+        df = df.reset_index(drop=True)
+    return df
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Expand an aggregated entropy table back to per-read rows.")
+    ap.add_argument("--counts", required=True, help="*.entropy_counts.tsv[.gz|.zst] from --aggregate")
+    ap.add_argument("--kraken-out", required=True, help="Kraken output the table was computed from")
+    ap.add_argument("--output", required=True, help="Per-read TSV to write (.gz/.zst compresses)")
+    ap.add_argument("--truth-key", default=None, help="Per-read truth key the table was scored with (mixed samples)")
+    ap.add_argument("--compresslevel", type=int, default=None)
+    args = ap.parse_args()
+
+    n = expand_counts(args.counts, args.kraken_out, args.output, key_path=args.truth_key, level=args.compresslevel)
+    print(f"Wrote {n} reads to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+
+"""
+entropy_sketch.py
+
+Mergeable summaries of per-read values (entropy, taxonomic distance), written next to each
+output so distributions and cohort summaries never need the per-read data again.
+
+A ValueSketch holds, for one file / database / taxon:
+
+    count, n_missing, sum, min, max     exact (sum via math.fsum)
+    histogram                           fixed-width bins, sparse: bin i = [i*w, (i+1)*w)
+    digest                              quantile sketch: (value, weight) centroids
+
+The digest stays exact, i.e. one centroid per distinct value, while there are at most
+MAX_EXACT distinct values; quantiles are then identical to numpy's linear interpolation
+over the per-read values (count_quantile). Beyond that it is compressed as a merging
+t-digest (k1 scale function) to about `compression` centroids.
+
+Sketches of the same metric and bin width merge exactly (histogram, counts, sum, min/max)
+and approximately (digest once compressed), in any order.
+
+Sketch files (*.sketch.json) hold a list of entries, each a sketch plus metadata
+(output, dataset, db, true_taxid, metric...). Combine them by any metadata keys:
+
+    python entropy_sketch.py --by db --output by_db.tsv --histogram-output by_db_hist.tsv outdir/
+"""
+
+import argparse
+import contextlib
+import json
+import math
+import os
+import sys
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+
+from weighted_entropy import count_quantile
+
+SKETCH_SUFFIX = ".sketch.json"
+SKETCH_VERSION = 1
+
+DEFAULT_BIN_WIDTH = 0.1
+DEFAULT_COMPRESSION = 200
+MAX_EXACT = 2000
+
+QUANTILES = (("q25", 0.25), ("median", 0.5), ("q75", 0.75))
+
+
+def sketch_path_for(out_path: str) -> str:
+    return str(out_path) + SKETCH_SUFFIX
+
+
+# ----------------------------
+# Quantile digest
+# ----------------------------
+
+def _k1(q: np.ndarray, compression: float) -> np.ndarray:
+    return compression / (2 * math.pi) * np.arcsin(2 * np.clip(q, 0.0, 1.0) - 1)
+
+
+class Digest:
+    """Weighted centroids, sorted by value; exact while every centroid is one distinct value."""
+
+    def __init__(self, compression: int = DEFAULT_COMPRESSION):
+        self.compression = compression
+        self.means = np.empty(0)
+        self.weights = np.empty(0)
+        self.exact = True
+
+    def add(self, values: np.ndarray, weights: np.ndarray):
+        self.means = np.concatenate([self.means, values])
+        self.weights = np.concatenate([self.weights, weights])
+        self._normalize()
+
+    def merge(self, other: "Digest"):
+        self.exact = self.exact and other.exact
+        self.add(other.means, other.weights)
+
+    def _normalize(self):
+        if self.exact:
+            means, inverse = np.unique(self.means, return_inverse=True)
+            self.means = means
+            self.weights = np.bincount(inverse, weights=self.weights, minlength=len(means))
+            if len(means) <= MAX_EXACT:
+                return
+            self.exact = False
+        else:
+            order = np.argsort(self.means, kind="stable")
+            self.means, self.weights = self.means[order], self.weights[order]
+            if len(self.means) <= 2 * self.compression:
+                return
+        self._compress()
+
+    def _compress(self):
+        # Merge neighbours whose centre falls in the same half unit of the k1 scale (~compression centroids)
+        total = self.weights.sum()
+        centres = (np.cumsum(self.weights) - self.weights / 2) / total
+        cluster = np.floor(2 * _k1(centres, self.compression)).astype(np.int64)
+        starts = np.flatnonzero(np.r_[True, cluster[1:] != cluster[:-1]])
+        weights = np.add.reduceat(self.weights, starts)
+        self.means = np.add.reduceat(self.means * self.weights, starts) / weights
+        self.weights = weights
+
+    def quantile(self, q: float, lo: float, hi: float) -> float:
+        if not len(self.means):
+            return float("nan")
+        if self.exact:
+            return count_quantile(self.means, self.weights, q)
+        # Interpolate between centroid centres, pinned to the exact min and max
+        total = self.weights.sum()
+        centres = np.cumsum(self.weights) - self.weights / 2
+        xs = np.r_[0.0, centres, total]
+        ys = np.r_[lo, self.means, hi]
+        return float(np.interp(q * total, xs, ys))
+
+    def to_dict(self) -> dict:
+        return {
+            "compression": self.compression,
+            "exact": self.exact,
+            "means": self.means.tolist(),
+            "weights": [int(w) if float(w).is_integer() else float(w) for w in self.weights],
+        }
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "Digest":
+        digest = cls(d["compression"])
+        digest.means = np.asarray(d["means"], dtype=float)
+        digest.weights = np.asarray(d["weights"], dtype=float)
+        digest.exact = d["exact"]
+        return digest
+
+
+# ----------------------------
+# Value sketch
+# ----------------------------
+
+def bin_indices(values: np.ndarray, bin_width: float) -> np.ndarray:
+    """
+    Histogram bin of each value, bin i = [i*w, (i+1)*w). values / w is rounded to 9
+    decimals before flooring, so a value on a bin edge lands in the bin it starts even
+    when the division falls just short (0.3 / 0.1 = 2.9999999999999996):
+
+    >>> bin_indices(np.array([0.0, 0.3, 0.6, 0.65, 1.0]), 0.1).tolist()
+    [0, 3, 6, 6, 10]
+    """
+    return np.floor(np.round(values / bin_width, 9)).astype(np.int64)
+
+
+class ValueSketch:
+    """count / sum / min / max, fixed-bin histogram and quantile digest of one value stream."""
+
+    def __init__(self, metric: str = "entropy", bin_width: float = DEFAULT_BIN_WIDTH,
+                 compression: int = DEFAULT_COMPRESSION):
+        self.metric = metric
+        self.bin_width = bin_width
+        self.count = 0
+        self.n_missing = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self.bins: Dict[int, int] = {}
+        self.digest = Digest(compression)
+
+    def add(self, values, counts=None):
+        """Add values (NaN = missing), each seen counts[i] times (default once)."""
+        values = np.asarray(values, dtype=float)
+        counts = np.ones(len(values), dtype=np.int64) if counts is None else np.asarray(counts, dtype=np.int64)
+        missing = np.isnan(values)
+        self.n_missing += int(counts[missing].sum())
+        values, counts = values[~missing], counts[~missing]
+        if not len(values):
+            return
+        self.count += int(counts.sum())
+        self.sum = math.fsum([self.sum, math.fsum((values * counts).tolist())])
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+        bins, inverse = np.unique(bin_indices(values, self.bin_width), return_inverse=True)
+        for b, c in zip(bins.tolist(), np.bincount(inverse, weights=counts).tolist()):
+            self.bins[b] = self.bins.get(b, 0) + int(c)
+        self.digest.add(values, counts.astype(float))
+
+    def merge(self, other: "ValueSketch"):
+        if other.metric != self.metric or other.bin_width != self.bin_width:
+            raise ValueError(
+                f"Cannot merge {other.metric} sketches (bin width {other.bin_width}) into "
+                f"{self.metric} (bin width {self.bin_width})"
+            )
+        self.count += other.count
+        self.n_missing += other.n_missing
+        self.sum = math.fsum([self.sum, other.sum])
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        for b, c in other.bins.items():
+            self.bins[b] = self.bins.get(b, 0) + c
+        self.digest.merge(other.digest)
+
+    @property
+    def mean(self) -> float:
+        return self.sum / self.count if self.count else float("nan")
+
+    def quantile(self, q: float) -> float:
+        return self.digest.quantile(q, self.min, self.max)
+
+    def histogram(self) -> List[tuple]:
+        """[(bin_start, bin_end, count)] in value order."""
+        w = self.bin_width
+        return [(round(b * w, 12), round((b + 1) * w, 12), self.bins[b]) for b in sorted(self.bins)]
+
+    def to_dict(self) -> dict:
+        return {
+            "metric": self.metric,
+            "count": self.count,
+            "n_missing": self.n_missing,
+            "sum": self.sum,
+            "min": self.min if self.count else None,
+            "max": self.max if self.count else None,
+            "bin_width": self.bin_width,
+            "bins": {str(b): c for b, c in sorted(self.bins.items())},
+            "digest": self.digest.to_dict(),
+        }
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "ValueSketch":
+        s = cls(d["metric"], d["bin_width"], d["digest"]["compression"])
+        s.count = d["count"]
+        s.n_missing = d["n_missing"]
+        s.sum = d["sum"]
+        s.min = math.inf if d["min"] is None else d["min"]
+        s.max = -math.inf if d["max"] is None else d["max"]
+        s.bins = {int(b): c for b, c in d["bins"].items()}
+        s.digest = Digest.from_dict(d["digest"])
+        return s
+
+
+# ----------------------------
+# Sketch files
+# ----------------------------
+
+def write_sketches(path: str, entries: Sequence[dict]):
+    """Write [{"meta": {...}, "sketch": ValueSketch}] to path (atomically)."""
+    doc = {
+        "version": SKETCH_VERSION,
+        "entries": [{"meta": e["meta"], "sketch": e["sketch"].to_dict()} for e in entries],
+    }
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(doc, f)
+    os.replace(tmp, path)
+
+
+def read_sketches(path: str) -> List[dict]:
+    with open(path) as f:
+        doc = json.load(f)
+    if doc.get("version") != SKETCH_VERSION:
+        raise ValueError(f"{path}: unsupported sketch version {doc.get('version')}")
+    return [{"meta": e["meta"], "sketch": ValueSketch.from_dict(e["sketch"])} for e in doc["entries"]]
+
+
+def find_sketch_files(paths: Iterable[str]) -> List[str]:
+    found = []
+    for p in paths:
+        if os.path.isdir(p):
+            found.extend(sorted(str(x) for x in Path(p).rglob(f"*{SKETCH_SUFFIX}")))
+        else:
+            found.append(p)
+    return found
+
+
+def combine(entries: Iterable[dict], by: Sequence[str]) -> Dict[tuple, dict]:
+    """Merge entries sharing metric and the `by` metadata values; returns key -> {sketch, n_entries}."""
+    groups: Dict[tuple, dict] = {}
+    for e in entries:
+        key = (e["sketch"].metric,) + tuple(str(e["meta"].get(k, "")) for k in by)
+        g = groups.get(key)
+        if g is None:
+            groups[key] = {"sketch": e["sketch"], "n_entries": 1}
+        else:
+            g["sketch"].merge(e["sketch"])
+            g["n_entries"] += 1
+    return groups
+
+
+def _fmt(x: float) -> str:
+    return "" if x is None or (isinstance(x, float) and not math.isfinite(x)) else str(x)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Combine *.sketch.json summaries across files, databases and taxa.")
+    ap.add_argument("inputs", nargs="+", help="Sketch files or directories searched for *.sketch.json")
+    ap.add_argument(
+        "--by",
+        default="output",
+        help="Comma-separated metadata keys to group by, e.g. db or db,true_taxid ('' = everything; "
+        "default: output, i.e. one row per sketch)",
+    )
+    ap.add_argument("--output", default="-", help="Summary TSV (default: stdout)")
+    ap.add_argument("--histogram-output", default=None, help="Optional long-format histogram TSV")
+    args = ap.parse_args()
+
+    by = [k for k in args.by.split(",") if k]
+    entries = []
+    for path in find_sketch_files(args.inputs):
+        entries.extend(read_sketches(path))
+    if not entries:
+        raise SystemExit("No sketches found")
+    groups = combine(entries, by)
+
+    header = ["metric"] + by + ["n_entries", "n_reads", "n_valid", "mean", "min", "max"]
+    header += [name for name, _ in QUANTILES] + ["exact_quantiles"]
+    out = sys.stdout if args.output == "-" else open(args.output, "w")
+    with out if out is not sys.stdout else contextlib.nullcontext(out):
+        out.write("\t".join(header) + "\n")
+        for key in sorted(groups):
+            s = groups[key]["sketch"]
+            row = list(key) + [groups[key]["n_entries"], s.count + s.n_missing, s.count, _fmt(s.mean),
+                               _fmt(s.min), _fmt(s.max)]
+            row += [_fmt(s.quantile(q)) for _, q in QUANTILES] + [s.digest.exact]
+            out.write("\t".join(map(str, row)) + "\n")
+
+    if args.histogram_output:
+        with open(args.histogram_output, "w") as f:
+            f.write("\t".join(["metric"] + by + ["bin_start", "bin_end", "count"]) + "\n")
+            for key in sorted(groups):
+                for lo, hi, c in groups[key]["sketch"].histogram():
+                    f.write("\t".join(map(str, list(key) + [lo, hi, c])) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,380 @@
+#!/usr/bin/env python3
+
+"""
+entropy_sweep.py
+
+Hyperparameter sweep for weighted entropy: evaluate a grid of alpha_up / alpha_down /
+rank-weight settings over a set of Kraken outputs for about the cost of one batch run.
+
+Entropy depends on the parameters only through
+
+    H = R(rank(L)) * log2(1 + k_L) * (alpha_up * u + alpha_down * d)
+
+and the expensive inputs (LCA L, u, d, k_L) depend only on the distinct (true, pred)
+pair. So the Kraken files are read once, in parallel, into per-file (true, pred) read
+counts; the LCA features of every distinct pair are resolved once; and each grid point
+is evaluated as array arithmetic over the distinct pairs. Scoring follows
+weighted_entropy_batch.py exactly, so a grid point's summary is identical to a batch run
+with the same parameters.
+
+Outputs (in --outdir):
+    configs.tsv              one row per grid point (config_id and its parameters)
+    summary_<config_id>.tsv  per-file n_reads, n_valid_entropy, mean and quartiles
+    sweep_overview.tsv       pooled statistics per grid point
+
+Usage:
+    python entropy_sweep.py --nodes-dmp nodes.dmp --jobs-tsv jobs.tsv --outdir sweep \
+        --alpha-up 0.1,0.3,0.5,1 --alpha-down 0.5,1,2 --rank-weights flat=flat.json
+"""
+
+import argparse
+import json
+import math
+import multiprocessing as mp
+import os
+import sys
+from collections import Counter
+from itertools import product
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from codec_io import open_binary
+from kraken_io import PredTaxidParser, iter_kraken_blocks
+from lca_index import LCAIndex
+from taxonomy_cache import index_of, load_taxonomy_arrays
+from truth_keys import TruthJoin, key_path_for
+from weighted_entropy import (
+    DEFAULT_ALPHA_DOWN,
+    DEFAULT_ALPHA_UP,
+    DEFAULT_FALLBACK_RANK_WEIGHT,
+    DEFAULT_RANK_WEIGHTS,
+    count_quantile,
+    local_branch_entropy,
+    rank_weight,
+)
+from weighted_entropy_batch import QUANTILES, discover_jobs, load_key, read_jobs_tsv
+
+# As in weighted_entropy_batch.process_one
+UNCLASSIFIED_SENTINELS = {"0", "", "NA", "None"}
+
+PAIR_COUNTS_HEADER = "path\tdataset\tfilename\tdb\ttrue_taxid\tpair_true_taxid\tpred_taxid\tn_reads\n"
+JOB_FIELDS = ("path", "dataset", "filename", "db", "true_taxid")
+
+
+# ----------------------------
+# Ingest: per-file (true, pred) read counts
+# ----------------------------
+
+def count_pairs(job) -> Counter:
+    """Read counts per b"true\\tpred" of one Kraken output (truth from the job or its key)."""
+    parse_pred = PredTaxidParser()
+    counts: Counter = Counter()
+    truth = TruthJoin(job["key_path"]) if job.get("key_path") else None
+    fin, _ = open_binary(job["path"], "rb")
+    with fin:
+        for records in iter_kraken_blocks(fin):
+            preds = [parse_pred(f3, st) for st, _, f3 in records]
+            if truth is not None:
+                trues = truth.lookup([r[1] for r in records])
+                counts.update(t + b"\t" + p for t, p in zip(trues, preds))
+            else:
+                counts.update(preds)
+    if truth is not None:
+        truth.close()
+        return counts
+    true_b = str(job["true_taxid"]).strip().encode()
+    return Counter({true_b + b"\t" + p: n for p, n in counts.items()})
+
+
+def _count_job(item):
+    i, job = item
+    try:
+        return i, count_pairs(job), None
+    except Exception as e:
+        return i, None, str(e)
+
+
+def ingest(jobs: List[dict], n_workers: int) -> List[Optional[Counter]]:
+    """Pair counts per job (None where the file could not be read), largest files first."""
+    sizes = [os.path.getsize(j["path"]) if os.path.exists(j["path"]) else 0 for j in jobs]
+    order = sorted(range(len(jobs)), key=lambda i: sizes[i], reverse=True)
+    results: List[Optional[Counter]] = [None] * len(jobs)
+    items = [(i, jobs[i]) for i in order]
+    if n_workers <= 1:
+        done = map(_count_job, items)
+    else:
+        ctx = mp.get_context("fork") if "fork" in mp.get_all_start_methods() else mp.get_context("spawn")
+        pool = ctx.Pool(n_workers)
+        done = pool.imap_unordered(_count_job, items)
+    for n, (i, counts, error) in enumerate(done, 1):
+        if error:
+            print(f"WARNING: {jobs[i]['path']}: {error}", file=sys.stderr)
+        results[i] = counts
+        print(f"\rIngested {n}/{len(jobs)} files", end="", file=sys.stderr)
+    print(file=sys.stderr)
+    if n_workers > 1:
+        pool.close()
+        pool.join()
+    return results
+
+
+def write_pair_counts(path: str, jobs: List[dict], counts: List[Optional[Counter]]):
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        f.write(PAIR_COUNTS_HEADER)
+        for job, c in zip(jobs, counts):
+            if c is None:
+                continue
+            prefix = "\t".join(str(job.get(k, "")) for k in JOB_FIELDS)
+            for pair, n in sorted(c.items()):
+                f.write(f"{prefix}\t{pair.decode()}\t{n}\n")
+    os.replace(tmp, path)
+
+
+def read_pair_counts(path: str) -> Tuple[List[dict], List[Counter]]:
+    jobs: Dict[tuple, dict] = {}
+    counts: Dict[tuple, Counter] = {}
+    with open(path) as f:
+        if f.readline() != PAIR_COUNTS_HEADER:
+            raise ValueError(f"{path} is not an entropy_sweep pair-count table")
+        for line in f:
+            fields = line.rstrip("\n").split("\t")
+            key = tuple(fields[:5])
+            if key not in jobs:
+                jobs[key] = dict(zip(JOB_FIELDS, key))
+                counts[key] = Counter()
+            counts[key][f"{fields[5]}\t{fields[6]}".encode()] += int(fields[7])
+    return list(jobs.values()), [counts[k] for k in jobs]
+
+
+# ----------------------------
+# Parameter-free pair features
+# ----------------------------
+
+class PairFeatures(NamedTuple):
+    fixed: np.ndarray        # bool: entropy does not depend on the parameters
+    fixed_value: np.ndarray  # float64: that entropy (NaN = none)
+    rank_code: np.ndarray    # int64, LCA rank (scored pairs)
+    branch_H: np.ndarray     # float64, log2(1 + k_L) with 0 -> 1
+    up: np.ndarray           # int64
+    down: np.ndarray         # int64
+
+
+def pair_features(arrays, lca_index: LCAIndex, trues: List[str], preds: List[str],
+                  unclassified_entropy: Optional[float]) -> PairFeatures:
+    """Features of distinct (true, pred) string pairs, with compute_cached_for_pred's rules."""
+    n = len(trues)
+    index: Dict[str, int] = {}
+    for t in set(trues) | set(preds):
+        index[t] = index_of(arrays, t)
+    ti = np.array([index[t] for t in trues], dtype=np.int64)
+    pi = np.array([index[p] for p in preds], dtype=np.int64)
+    unclassified = np.array([p in UNCLASSIFIED_SENTINELS for p in preds], dtype=bool)
+    same = np.array([t == p for t, p in zip(trues, preds)], dtype=bool)
+
+    fixed = np.ones(n, dtype=bool)
+    fixed_value = np.full(n, np.nan)
+    if unclassified_entropy is not None:
+        fixed_value[unclassified] = unclassified_entropy
+    known = ~unclassified & (ti >= 0) & (pi >= 0)
+    fixed_value[known & same] = 0.0
+    scored = known & ~same
+    fixed[scored] = False
+
+    up = np.zeros(n, dtype=np.int64)
+    down = np.zeros(n, dtype=np.int64)
+    L = np.zeros(n, dtype=np.int64)
+    if scored.any():
+        a_idx, b_idx = ti[scored], pi[scored]
+        L_s, up_s, down_s = lca_index.distances_many(a_idx, b_idx)
+        orphan = L_s < 0
+        L[scored] = np.where(orphan, a_idx, L_s)
+        up[scored] = np.where(orphan, 0, up_s)
+        down[scored] = np.where(orphan, np.maximum(arrays.depth[b_idx] - arrays.depth[a_idx], 0), down_s)
+
+    k = arrays.branch_size[L].astype(np.int64)
+    k_uniq, k_inv = np.unique(k, return_inverse=True)
+    branch_H = np.array([local_branch_entropy(int(x)) for x in k_uniq], dtype=np.float64)[k_inv]
+    branch_H[branch_H == 0.0] = 1.0
+    return PairFeatures(fixed, fixed_value, arrays.rank_code[L].astype(np.int64), branch_H, up, down)
+
+
+# ----------------------------
+# Grid evaluation
+# ----------------------------
+
+class Config(NamedTuple):
+    config_id: str
+    alpha_up: float
+    alpha_down: float
+    rank_weights_name: str
+    rank_weights: Dict[str, float]
+
+
+def evaluate(features: PairFeatures, configs: List[Config], rank_names) -> np.ndarray:
+    """Entropy of every distinct pair under every config: (n_configs, n_pairs), NaN = none."""
+    weights = np.array(
+        [[rank_weight(name, c.rank_weights, DEFAULT_FALLBACK_RANK_WEIGHT) for name in rank_names] for c in configs],
+        dtype=np.float64,
+    )
+    alpha_up = np.array([c.alpha_up for c in configs])[:, None]
+    alpha_down = np.array([c.alpha_down for c in configs])[:, None]
+    R = weights[:, features.rank_code]
+    # Same operation order as compute_cached_for_pred, so values are bit-identical
+    H = R * features.branch_H * (alpha_up * features.up + alpha_down * features.down)
+    return np.where(features.fixed, features.fixed_value, H)
+
+
+def summarize(entropy: np.ndarray, counts: np.ndarray) -> Dict[str, object]:
+    """Per-file summary as in weighted_entropy_batch (exact fsum mean and quantiles)."""
+    valid = ~np.isnan(entropy)
+    n_valid = int(counts[valid].sum())
+    out = {"n_reads": int(counts.sum()), "n_valid": n_valid}
+    if n_valid == 0:
+        out["mean_entropy"] = ""
+        out.update({name: "" for name, _ in QUANTILES})
+        return out
+    values, weights = entropy[valid], counts[valid]
+    out["mean_entropy"] = str(math.fsum((values * weights).tolist()) / n_valid)
+    out.update({name: str(count_quantile(values, weights, q)) for name, q in QUANTILES})
+    return out
+
+
+def parse_floats(text: str) -> List[float]:
+    return [float(x) for x in text.split(",") if x.strip()]
+
+
+def load_rank_weights(specs: Optional[List[str]]) -> List[Tuple[str, Dict[str, float]]]:
+    """NAME=weights.json (a {rank: weight} object) per spec; 'default' is DEFAULT_RANK_WEIGHTS."""
+    if not specs:
+        return [("default", DEFAULT_RANK_WEIGHTS)]
+    out = []
+    for spec in specs:
+        if spec == "default":
+            out.append(("default", DEFAULT_RANK_WEIGHTS))
+            continue
+        name, sep, path = spec.partition("=")
+        if not sep:
+            name, path = Path(spec).stem, spec
+        with open(path) as f:
+            out.append((name, {str(k): float(v) for k, v in json.load(f).items()}))
+    return out
+
+
+SUMMARY_HEADER = (
+    "path\tdataset\tfilename\tdb\ttrue_taxid\tn_reads\tn_valid_entropy\tmean_entropy\t"
+    "q25_entropy\tmedian_entropy\tq75_entropy\n"
+)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Evaluate a grid of entropy hyperparameters from one ingest.")
+    ap.add_argument("--nodes-dmp", required=True)
+    ap.add_argument("--taxonomy-cache", default=None, help="Compiled taxonomy cache directory (see taxonomy_cache.py)")
+    ap.add_argument("--jobs-tsv", default=None, help="Jobs TSV as for weighted_entropy_batch.py")
+    ap.add_argument("--key-file", default=None, help="taxid2filename.txt (with --kraken-dir)")
+    ap.add_argument("--kraken-dir", default=None, help="Directory containing *_dbN.out files")
+    ap.add_argument("--recursive", action="store_true")
+    ap.add_argument("--truth-key-dir", default=None, help="Per-read truth keys for mixed samples (see truth_keys.py)")
+    ap.add_argument(
+        "--pair-counts",
+        default=None,
+        help="Per-file (true, pred) read-count table: read instead of the Kraken files if it exists, "
+        "written after ingest otherwise, so later sweeps skip the ingest entirely",
+    )
+    ap.add_argument("--outdir", required=True)
+    ap.add_argument("--jobs", type=int, default=min(8, os.cpu_count() or 1), help="Ingest workers")
+
+    ap.add_argument("--alpha-up", default=str(DEFAULT_ALPHA_UP), help="Comma-separated alpha_up values")
+    ap.add_argument("--alpha-down", default=str(DEFAULT_ALPHA_DOWN), help="Comma-separated alpha_down values")
+    ap.add_argument(
+        "--rank-weights",
+        action="append",
+        default=None,
+        metavar="NAME=FILE",
+        help="Rank-weight set as a JSON {rank: weight} file; repeatable. 'default' is DEFAULT_RANK_WEIGHTS "
+        "(used when none is given). Ranks not listed get the fallback weight.",
+    )
+    ap.add_argument("--unclassified-entropy", type=float, default=None)
+    args = ap.parse_args()
+
+    if args.pair_counts and os.path.exists(args.pair_counts):
+        print(f"Reading pair counts from {args.pair_counts}", file=sys.stderr)
+        jobs, counts = read_pair_counts(args.pair_counts)
+    else:
+        if args.jobs_tsv:
+            jobs = read_jobs_tsv(args.jobs_tsv)
+        elif args.key_file and args.kraken_dir:
+            jobs, _ = discover_jobs(args.kraken_dir, load_key(args.key_file), recursive=args.recursive)
+        else:
+            raise SystemExit("Provide --jobs-tsv, --key-file with --kraken-dir, or an existing --pair-counts.")
+        if not jobs:
+            raise SystemExit("No Kraken outputs to sweep.")
+        if args.truth_key_dir:
+            for j in jobs:
+                key_path = j.get("key_path") or key_path_for(j["path"], args.truth_key_dir)
+                if key_path:
+                    j["key_path"] = key_path
+        counts = ingest(jobs, max(1, args.jobs))
+        if args.pair_counts:
+            write_pair_counts(args.pair_counts, jobs, counts)
+
+    # Distinct pairs over all files, and per-file (pair index, read count)
+    pair_ids: Dict[bytes, int] = {}
+    per_file = []
+    for c in counts:
+        if c is None:
+            per_file.append(None)
+            continue
+        idx = np.array([pair_ids.setdefault(p, len(pair_ids)) for p in c], dtype=np.int64)
+        per_file.append((idx, np.array(list(c.values()), dtype=np.int64)))
+    pairs = [p.decode().split("\t") for p in pair_ids]
+
+    arrays = load_taxonomy_arrays(args.nodes_dmp, args.taxonomy_cache)
+    lca_index = LCAIndex.load_or_build(arrays, args.taxonomy_cache)
+    features = pair_features(arrays, lca_index, [t for t, _ in pairs], [p for _, p in pairs],
+                             args.unclassified_entropy)
+
+    configs = [
+        Config(f"c{i:03d}", au, ad, name, weights)
+        for i, (au, ad, (name, weights)) in enumerate(
+            product(parse_floats(args.alpha_up), parse_floats(args.alpha_down), load_rank_weights(args.rank_weights))
+        )
+    ]
+    print(f"{len(pairs)} distinct pairs in {len(jobs)} files; evaluating {len(configs)} configs", file=sys.stderr)
+    entropy = evaluate(features, configs, arrays.rank_names)
+
+    outdir = Path(args.outdir)
+    outdir.mkdir(parents=True, exist_ok=True)
+    with open(outdir / "configs.tsv", "w") as f:
+        f.write("config_id\talpha_up\talpha_down\trank_weights\n")
+        for c in configs:
+            f.write(f"{c.config_id}\t{c.alpha_up}\t{c.alpha_down}\t{c.rank_weights_name}\n")
+
+    all_idx = np.concatenate([pf[0] for pf in per_file if pf is not None] or [np.empty(0, np.int64)])
+    all_counts = np.concatenate([pf[1] for pf in per_file if pf is not None] or [np.empty(0, np.int64)])
+    with open(outdir / "sweep_overview.tsv", "w") as overview:
+        overview.write("config_id\talpha_up\talpha_down\trank_weights\tn_files\tn_reads\tn_valid_entropy\t"
+                       "mean_entropy\tq25_entropy\tmedian_entropy\tq75_entropy\n")
+        for c, H in zip(configs, entropy):
+            with open(outdir / f"summary_{c.config_id}.tsv", "w") as f:
+                f.write(SUMMARY_HEADER)
+                for job, pf in zip(jobs, per_file):
+                    meta = "\t".join(str(job.get(k, "")) for k in JOB_FIELDS)
+                    if pf is None:
+                        f.write(meta + "\t\t\t\t\t\t\n")
+                        continue
+                    s = summarize(H[pf[0]], pf[1])
+                    f.write(f"{meta}\t{s['n_reads']}\t{s['n_valid']}\t{s['mean_entropy']}\t"
+                            f"{s['q25_entropy']}\t{s['median_entropy']}\t{s['q75_entropy']}\n")
+            s = summarize(H[all_idx], all_counts)
+            overview.write(f"{c.config_id}\t{c.alpha_up}\t{c.alpha_down}\t{c.rank_weights_name}\t"
+                           f"{sum(pf is not None for pf in per_file)}\t{s['n_reads']}\t{s['n_valid']}\t"
+                           f"{s['mean_entropy']}\t{s['q25_entropy']}\t{s['median_entropy']}\t{s['q75_entropy']}\n")
+    print(f"Wrote {len(configs)} summaries to {outdir}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+
+"""
+external_join.py
+
+Memory-bounded join of a key file with N Kraken outputs on SequenceID, for inputs whose
+read order differs (the slow path of lockstep_merge.merge_sample).
+
+    1. The key (ID, position, true taxid) and each output (ID, taxid) are sorted by ID
+       with an external sort: records are buffered up to a memory budget, then sorted and
+       spilled as runs to local disk, and the runs are k-way merged (at most MAX_FAN_IN
+       at a time, so only a bounded number of files is open).
+    2. The sorted streams are merge-joined in one pass, counting (and sampling) key IDs
+       missing from each output and output IDs not in the key.
+    3. Joined rows are sorted back into key order (again externally) and written.
+
+Peak memory is about --max-memory whatever the sample size; the rest lives in temporary
+run files under tmp_dir (default: the system temp directory).
+"""
+
+import heapq
+import os
+import re
+import tempfile
+from typing import BinaryIO, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+DEFAULT_MAX_MEMORY = "4G"
+
+# Rough per-line cost of a bytes object held in a list, on top of its length
+LINE_OVERHEAD = 80
+
+SAMPLE_SIZE = 10
+
+# Most runs merged (and files open) at once per sorter; more runs are first merged in
+# groups into longer runs
+MAX_FAN_IN = 32
+
+# taxid column value for "no taxid" (distinct from an empty field)
+NO_TAXID = b"-"
+
+SIZE_RE = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*([KMGT]?)i?B?\s*$", re.I)
+
+
+def parse_size(text: str) -> int:
+    """'512M', '4G', '1.5GiB' or a plain byte count -> bytes."""
+    m = SIZE_RE.match(str(text))
+    if not m:
+        raise ValueError(f"Invalid size: {text!r} (use e.g. 512M or 4G)")
+    scale = {"": 1, "K": 1 << 10, "M": 1 << 20, "G": 1 << 30, "T": 1 << 40}[m.group(2).upper()]
+    return int(float(m.group(1)) * scale)
+
+
+class ExternalSorter:
+    """
+    Sort newline-terminated byte lines under a memory budget.
+
+    Lines are buffered until max_bytes, then sorted and spilled as a run file. Iterating
+    yields all lines in sorted order: straight from memory if nothing was spilled,
+    otherwise by k-way merging the runs, with at most fan_in run files open.
+    """
+
+    def __init__(self, max_bytes: int, tmp_dir: Optional[str] = None, fan_in: int = MAX_FAN_IN):
+        self.max_bytes = max(max_bytes, 1 << 20)
+        self.tmp_dir = tmp_dir
+        self.fan_in = max(fan_in, 2)
+        self.lines: List[bytes] = []
+        self.size = 0
+        self.runs: List[str] = []
+        self.files: List[BinaryIO] = []
+
+    def add(self, line: bytes):
+        self.lines.append(line)
+        self.size += len(line) + LINE_OVERHEAD
+        if self.size >= self.max_bytes:
+            self._spill()
+
+    def _new_run(self) -> BinaryIO:
+        fd, path = tempfile.mkstemp(prefix="extjoin_", suffix=".run", dir=self.tmp_dir)
+        self.runs.append(path)
+        return os.fdopen(fd, "wb", buffering=1 << 20)
+
+    def _spill(self):
+        if not self.lines:
+            return
+        self.lines.sort()
+        with self._new_run() as f:
+            f.writelines(self.lines)
+        self.lines = []
+        self.size = 0
+
+    def _open_runs(self, paths: List[str]) -> List[BinaryIO]:
+        self.files = [open(path, "rb", buffering=1 << 16) for path in paths]
+        return self.files
+
+    def _close_files(self):
+        for f in self.files:
+            f.close()
+        self.files = []
+
+    def __iter__(self) -> Iterator[bytes]:
+        if not self.runs:
+            self.lines.sort()
+            return iter(self.lines)
+        self._spill()
+        self._close_files()
+        # Merge the oldest fan_in runs into one new run until few enough remain
+        while len(self.runs) > self.fan_in:
+            group = self.runs[:self.fan_in]
+            with self._new_run() as f:
+                f.writelines(heapq.merge(*self._open_runs(group)))
+            self._close_files()
+            for path in group:
+                os.remove(path)
+            del self.runs[:self.fan_in]
+        return heapq.merge(*self._open_runs(self.runs))
+
+    def close(self):
+        self.lines = []
+        self._close_files()
+        for path in self.runs:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        self.runs = []
+
+
+class JoinMismatch(NamedTuple):
+    n_missing: int
+    n_extra: int
+    missing_sample: Tuple[str, ...]
+    extra_sample: Tuple[str, ...]
+
+
+def _split_id(line: bytes) -> Tuple[bytes, bytes]:
+    seq_id, rest = line.split(b"\t", 1)
+    return seq_id, rest[:-1]
+
+
+def external_join(key_blocks: Iterator[Tuple[List[bytes], List[bytes]]],
+                  out_blocks: Sequence[Iterator[Tuple[List[bytes], List[Optional[bytes]]]]],
+                  max_memory: int,
+                  tmp_dir: Optional[str] = None):
+    """
+    Join key records with each output's records by SequenceID.
+
+    key_blocks yields (ids, true_taxids) and each of out_blocks yields (ids, taxids) in any
+    order (taxid None = no taxid). Returns (rows, mismatches, cleanup): mismatches has one
+    JoinMismatch per output, and rows, if every output matches the key exactly, is an
+    iterator of blocks (ids, trues, [column per output]) in key order; else None.
+    Call cleanup() when done with rows to remove the run files.
+    """
+    n_out = len(out_blocks)
+    budget = max_memory // (n_out + 2)
+    sorters: List[ExternalSorter] = []
+
+    def new_sorter() -> ExternalSorter:
+        s = ExternalSorter(budget, tmp_dir)
+        sorters.append(s)
+        return s
+
+    def cleanup():
+        for s in sorters:
+            s.close()
+
+    try:
+        # 1. Sort the key and every output by ID
+        key_sorted = new_sorter()
+        pos = 0
+        for ids, trues in key_blocks:
+            for seq_id, true_taxid in zip(ids, trues):
+                key_sorted.add(b"%s\t%012d\t%s\n" % (seq_id, pos, true_taxid))
+                pos += 1
+
+        outs_sorted = []
+        for blocks in out_blocks:
+            s = new_sorter()
+            for ids, taxids in blocks:
+                for seq_id, taxid in zip(ids, taxids):
+                    s.add(seq_id + b"\t" + (NO_TAXID if taxid is None else taxid) + b"\n")
+            outs_sorted.append(s)
+
+        # 2. Merge-join, emitting rows keyed by key position
+        by_pos = new_sorter()
+        cursors = [iter(s) for s in outs_sorted]
+        heads = [next(c, None) for c in cursors]
+        heads = [None if h is None else _split_id(h) for h in heads]
+        last = [(None, None)] * n_out
+        missing = [0] * n_out
+        extra = [0] * n_out
+        missing_sample: List[List[str]] = [[] for _ in range(n_out)]
+        extra_sample: List[List[str]] = [[] for _ in range(n_out)]
+
+        def note(counts, samples, j, seq_id):
+            counts[j] += 1
+            if len(samples[j]) < SAMPLE_SIZE:
+                samples[j].append(seq_id.decode(errors="replace"))
+
+        for line in key_sorted:
+            seq_id, rest = _split_id(line)
+            taxids = []
+            for j in range(n_out):
+                head = heads[j]
+                while head is not None and head[0] < seq_id:
+                    if head[0] != last[j][0]:
+                        note(extra, extra_sample, j, head[0])
+                    last[j] = head
+                    head = next(cursors[j], None)
+                    head = None if head is None else _split_id(head)
+                if head is not None and head[0] == seq_id:
+                    last[j] = head
+                    # Duplicated output IDs: the first one joins, the rest are skipped
+                    while head is not None and head[0] == seq_id:
+                        head = next(cursors[j], None)
+                        head = None if head is None else _split_id(head)
+                heads[j] = head
+                if last[j][0] == seq_id:
+                    taxids.append(last[j][1])
+                else:
+                    note(missing, missing_sample, j, seq_id)
+                    taxids.append(NO_TAXID)
+            pos_b, true_taxid = rest.split(b"\t", 1)
+            by_pos.add(b"\t".join([pos_b, seq_id, true_taxid] + taxids) + b"\n")
+
+        for j in range(n_out):
+            head = heads[j]
+            while head is not None:
+                if head[0] != last[j][0]:
+                    note(extra, extra_sample, j, head[0])
+                last[j] = head
+                head = next(cursors[j], None)
+                head = None if head is None else _split_id(head)
+
+        mismatches = [
+            JoinMismatch(missing[j], extra[j], tuple(missing_sample[j]), tuple(extra_sample[j])) for j in range(n_out)
+        ]
+        for s in [key_sorted] + outs_sorted:
+            s.close()
+
+        if any(m.n_missing or m.n_extra for m in mismatches):
+            cleanup()
+            return None, mismatches, cleanup
+
+        # 3. Back to key order
+        def rows(block_size: int = 1 << 16):
+            ids: List[bytes] = []
+            trues: List[bytes] = []
+            columns: List[List[Optional[bytes]]] = [[] for _ in range(n_out)]
+            for line in by_pos:
+                fields = line[:-1].split(b"\t")
+                ids.append(fields[1])
+                trues.append(fields[2])
+                for j in range(n_out):
+                    v = fields[3 + j]
+                    columns[j].append(None if v == NO_TAXID else v)
+                if len(ids) >= block_size:
+                    yield ids, trues, columns
+                    ids, trues, columns = [], [], [[] for _ in range(n_out)]
+            if ids:
+                yield ids, trues, columns
+
+        return rows(), mismatches, cleanup
+    except BaseException:
+        cleanup()
+        raise
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+
+"""
+kraken_io.py
+
+Fast, bytes-level reading of Kraken2 per-read output (*.out).
+
+Kraken lines look like:
+
+    C <TAB> read_id <TAB> Name (taxid N) <TAB> 150|150 <TAB> 562:13 561:4 ...
+
+Only the first three fields are needed for scoring. The reader pulls large binary blocks,
+extracts status / read_id / taxid field with one regex pass per block (never decoding or
+splitting the long k-mer field), and the taxid parse is memoized per distinct name field,
+of which there are only a few thousand per file.
+"""
+
+import os
+import re
+from itertools import compress
+from operator import itemgetter
+from typing import BinaryIO, Dict, Iterator, List, Tuple
+
+DEFAULT_BLOCK_SIZE = 1 << 22  # 4 MiB
+
+# First three tab-delimited fields of each non-empty line
+KRAKEN_FIELDS_RE = re.compile(rb"^([^\t\n]*)\t([^\t\n]*)\t([^\t\n]*)", re.M)
+TAXID_BYTES_RE = re.compile(rb"taxid\s+(\d+)")
+
+
+def iter_line_blocks(fin: BinaryIO, block_size: int = DEFAULT_BLOCK_SIZE) -> Iterator[bytes]:
+    """Yield blocks of whole lines; every block but possibly the last ends with a newline."""
+    tail = b""
+    while True:
+        chunk = fin.read(block_size)
+        if not chunk:
+            break
+        block = tail + chunk
+        cut = block.rfind(b"\n")
+        if cut < 0:
+            tail = block
+            continue
+        tail = block[cut + 1:]
+        yield block[:cut + 1]
+    if tail:
+        yield tail
+
+
+def iter_kraken_blocks(fin: BinaryIO,
+                       block_size: int = DEFAULT_BLOCK_SIZE,
+                       pattern=KRAKEN_FIELDS_RE) -> Iterator[List[Tuple[bytes, ...]]]:
+    """
+    Yield lists of (status, read_id, taxid_field) tuples, one list per block of input.
+
+    Blocks are cut at the last newline so no line is split; lines with fewer than three
+    fields are skipped. Other line-oriented TSVs can be read by passing their own
+    multiline `pattern`.
+    """
+    for block in iter_line_blocks(fin, block_size):
+        yield pattern.findall(block)
+
+
+def parse_pred_taxid_bytes(field3: bytes, status: bytes) -> bytes:
+    """
+    Predicted taxid from Kraken's status and taxid field (bytes in, bytes out).
+
+    Unclassified reads (status U), blank fields and fields without a taxid give b"0". A
+    numeric field is the taxid itself; with --use-names ("Name (taxid N)") it is the N
+    after "taxid".
+    """
+    if status == b"U":
+        return b"0"
+    s = field3.strip()
+    if not s:
+        return b"0"
+    if s.isdigit():
+        return s
+    m = TAXID_BYTES_RE.search(s)
+    if m:
+        return m.group(1)
+    return b"0"
+
+
+class PredTaxidParser:
+    """Memoized parse_pred_taxid_bytes, keyed by the raw taxid field."""
+
+    def __init__(self):
+        self.memo: Dict[bytes, bytes] = {}
+
+    def __call__(self, field3: bytes, status: bytes) -> bytes:
+        if status == b"U":
+            return b"0"
+        pred = self.memo.get(field3)
+        if pred is None:
+            pred = parse_pred_taxid_bytes(field3, status)
+            self.memo[field3] = pred
+        return pred
+
+    def parse_block(self, records: List[Tuple[bytes, ...]]) -> List[bytes]:
+        """Pred taxid of every (status, read_id, taxid_field) record, without a call per record."""
+        fields = list(map(itemgetter(2), records))
+        preds = list(map(self.memo.get, fields))
+        if None in preds:
+            # Memoize the field as if classified, so U lines are not re-parsed every block
+            for i, field3 in enumerate(fields):
+                if preds[i] is None:
+                    pred = self.memo.get(field3)
+                    if pred is None:
+                        pred = self.memo[field3] = parse_pred_taxid_bytes(field3, b"C")
+                    preds[i] = pred
+        # Unclassified reads are 0 whatever their taxid field says; only matters if a field
+        # seen on a U line parses to a real taxid
+        is_u = list(map(b"U".__eq__, map(itemgetter(0), records)))
+        if any(self.memo[f] != b"0" for f in set(compress(fields, is_u))):
+            preds = [b"0" if u else p for p, u in zip(preds, is_u)]
+        return preds
+
+
+def newline_aligned_ranges(path: str, part_size: int) -> List[Tuple[int, int]]:
+    """
+    Split an uncompressed file into [start, end) byte ranges of about part_size bytes,
+    each starting at the beginning of a line.
+    """
+    size = os.path.getsize(path)
+    bounds = [0]
+    with open(path, "rb") as f:
+        while bounds[-1] + part_size < size:
+            f.seek(bounds[-1] + part_size)
+            nxt = f.tell() + len(f.readline())
+            if nxt >= size:
+                break
+            bounds.append(nxt)
+    bounds.append(size)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+class RangeReader:
+    """Read-only view of bytes [start, end) of an open binary file."""
+
+    def __init__(self, fin: BinaryIO, start: int, end: int):
+        self._fin = fin
+        fin.seek(start)
+        self._remaining = end - start
+
+    def read(self, size: int = -1) -> bytes:
+        if self._remaining <= 0:
+            return b""
+        if size < 0 or size > self._remaining:
+            size = self._remaining
+        data = self._fin.read(size)
+        self._remaining -= len(data)
+        return data
+
+    def close(self):
+        self._fin.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
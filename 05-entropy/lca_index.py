@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+
+"""
+lca_index.py
+
+Binary-lifting LCA index over an array-backed taxonomy (see taxonomy_cache.py).
+
+ancestors[k][i] is the 2**k-th ancestor of node i (roots are their own ancestors). The NCBI
+tree is shallow (depth < 64), so only a handful of levels are needed and every query costs
+O(log depth) array lookups instead of building two lineages and walking them node by node.
+
+All queries take and return node indices, not taxids; -1 means "no common ancestor"
+(the two nodes sit in different components of a malformed taxonomy).
+"""
+
+import os
+from typing import Optional, Tuple
+
+import numpy as np
+
+from taxonomy_cache import NodeColumns, TaxonomyArrays
+
+ANCESTORS_FILE = "ancestors.npy"
+
+
+def build_ancestor_table(parent: np.ndarray, depth: np.ndarray) -> np.ndarray:
+    """Return an int32 array of shape (levels, n) with ancestors[k] = 2**k-th ancestor."""
+    max_depth = int(depth.max()) if len(depth) else 0
+    levels = max(1, max_depth.bit_length())
+    ancestors = np.empty((levels, len(parent)), dtype=np.int32)
+    ancestors[0] = parent
+    for k in range(1, levels):
+        ancestors[k] = ancestors[k - 1][ancestors[k - 1]]
+    return ancestors
+
+
+class LCAIndex:
+    """O(log depth) LCA, up and down distance queries on node indices."""
+
+    def __init__(self, arrays: TaxonomyArrays, ancestors: Optional[np.ndarray] = None):
+        self.arrays = arrays
+        if ancestors is None:
+            ancestors = build_ancestor_table(arrays.parent, arrays.depth)
+        self.ancestors = ancestors
+        self.levels = ancestors.shape[0]
+
+        # memoryviews give plain-int element access, much faster than numpy scalars
+        self.nodes = NodeColumns(arrays)
+        self._depth = self.nodes.depth
+        self._anc = [memoryview(np.ascontiguousarray(ancestors[k])) for k in range(self.levels)]
+
+    @classmethod
+    def load_or_build(cls, arrays: TaxonomyArrays, cache_dir: Optional[str] = None) -> "LCAIndex":
+        """
+        Build the index, persisting the ancestor table inside the taxonomy cache directory
+        so later runs (and spawned workers) memory-map it. Recompiling the taxonomy cache
+        replaces the directory, which discards a stale table along with it.
+        """
+        if cache_dir is None:
+            return cls(arrays)
+
+        path = os.path.join(cache_dir, ANCESTORS_FILE)
+        if os.path.exists(path):
+            ancestors = np.load(path, mmap_mode="r")
+            if ancestors.ndim == 2 and ancestors.shape[1] == len(arrays.parent):
+                return cls(arrays, ancestors)
+
+        ancestors = build_ancestor_table(arrays.parent, arrays.depth)
+        tmp_path = f"{path}.tmp-{os.getpid()}.npy"
+        np.save(tmp_path, ancestors)
+        os.replace(tmp_path, path)
+        return cls(arrays, np.load(path, mmap_mode="r"))
+
+    # ----------------------------
+    # Scalar queries
+    # ----------------------------
+
+    def lca(self, a: int, b: int) -> int:
+        """LCA node index of nodes a and b, or -1 if they share no ancestor."""
+        if a == b:
+            return a
+        depth = self._depth
+        anc = self._anc
+
+        if depth[a] < depth[b]:
+            a, b = b, a
+        diff = depth[a] - depth[b]
+        k = 0
+        while diff:
+            if diff & 1:
+                a = anc[k][a]
+            diff >>= 1
+            k += 1
+        if a == b:
+            return a
+
+        for k in range(self.levels - 1, -1, -1):
+            ak = anc[k][a]
+            bk = anc[k][b]
+            if ak != bk:
+                a = ak
+                b = bk
+
+        pa = anc[0][a]
+        return pa if pa == anc[0][b] else -1
+
+    def distances(self, a: int, b: int) -> Tuple[int, int, int]:
+        """Return (L, up, down): LCA index, edges up from a to L, edges down from L to b."""
+        L = self.lca(a, b)
+        if L < 0:
+            return -1, 0, 0
+        depth = self._depth
+        return L, depth[a] - depth[L], depth[b] - depth[L]
+
+    # ----------------------------
+    # Vectorized queries
+    # ----------------------------
+
+    def lca_many(self, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+        """Vectorized lca() over equal-length arrays of valid node indices."""
+        a = np.asarray(a, dtype=np.int64).copy()
+        b = np.asarray(b, dtype=np.int64).copy()
+        depth = self.arrays.depth
+        ancestors = self.ancestors
+
+        swap = depth[a] < depth[b]
+        a[swap], b[swap] = b[swap], a[swap].copy()
+
+        diff = depth[a] - depth[b]
+        for k in range(self.levels):
+            move = (diff >> k) & 1 == 1
+            if move.any():
+                a[move] = ancestors[k][a[move]]
+
+        for k in range(self.levels - 1, -1, -1):
+            ak = ancestors[k][a]
+            bk = ancestors[k][b]
+            move = ak != bk
+            a[move] = ak[move]
+            b[move] = bk[move]
+
+        same = a == b
+        pa = ancestors[0][a]
+        pb = ancestors[0][b]
+        return np.where(same, a, np.where(pa == pb, pa, -1))
+
+    def distances_many(self, a: np.ndarray, b: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Vectorized distances(); up/down are 0 where L is -1."""
+        a = np.asarray(a, dtype=np.int64)
+        b = np.asarray(b, dtype=np.int64)
+        L = self.lca_many(a, b)
+        ok = L >= 0
+        depth = self.arrays.depth
+        depth_L = depth[np.where(ok, L, 0)]
+        up = np.where(ok, depth[a] - depth_L, 0)
+        down = np.where(ok, depth[b] - depth_L, 0)
+        return L, up, down
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+
+"""
+lockstep_merge.py
+
+Single-pass merge of one sample's key file with its N Kraken outputs (*_viridN.out) into
+the wide summary written by summaries.py / summaries_extra.py:
+
+    SequenceID  true_taxid  virid1 ... viridN  [entropy_virid1 ... entropy_viridN]
+
+Kraken writes reads in input order, so the key and every output are walked together in
+blocks: read IDs are compared run by run (validating alignment as we go) and rows are
+written immediately, in constant memory. Only if the orders diverge, or a file ends early,
+is the merge redone on the slow path: a memory-bounded external merge-join by SequenceID
+(external_join.py) that reports missing / unexpected IDs as the pandas version did, plus
+a sample of each.
+
+Entropy columns are added when an EntropyScorer is passed (see weighted_entropy.py).
+"""
+
+import os
+import re
+from typing import Dict, Iterator, List, NamedTuple, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from codec_io import open_binary
+from external_join import DEFAULT_MAX_MEMORY, external_join, parse_size
+from kraken_io import iter_kraken_blocks
+from truth_keys import iter_key_records
+
+# As in the original pandas summaries: only "Name (taxid N)" fields give a taxid
+NAMED_TAXID_RE = re.compile(rb" \(taxid (\d+)\)$")
+
+
+class MergeReport(NamedTuple):
+    ok: bool
+    n_rows: int
+    lockstep: bool                 # False if the slow (external join) path was needed
+    failed_label: Optional[str]    # first output whose IDs do not match the key
+    n_missing: int                 # key IDs missing from failed_label
+    n_extra: int                   # IDs in failed_label not in the key
+    missing_sample: Tuple[str, ...] = ()
+    extra_sample: Tuple[str, ...] = ()
+
+
+class NamedTaxidParser:
+    """Memoized NAMED_TAXID_RE extraction; None where the field has no "(taxid N)"."""
+
+    def __init__(self):
+        self.memo: Dict[bytes, Optional[bytes]] = {}
+
+    def __call__(self, field3: bytes) -> Optional[bytes]:
+        try:
+            return self.memo[field3]
+        except KeyError:
+            m = NAMED_TAXID_RE.search(field3)
+            taxid = m.group(1) if m else None
+            self.memo[field3] = taxid
+            return taxid
+
+
+class RecordBuffer:
+    """Pull (ids, values) lists out of a block iterator in arbitrary-sized runs."""
+
+    def __init__(self, blocks: Iterator[Tuple[List[bytes], List]]):
+        self._blocks = blocks
+        self.ids: List[bytes] = []
+        self.values: List = []
+        self.pos = 0
+
+    def available(self) -> int:
+        """Records left in the current block, reading the next block if needed (0 at EOF)."""
+        while self.pos >= len(self.ids):
+            try:
+                self.ids, self.values = next(self._blocks)
+            except StopIteration:
+                return 0
+            self.pos = 0
+        return len(self.ids) - self.pos
+
+    def take(self, m: int) -> Tuple[List[bytes], List]:
+        a, b = self.pos, self.pos + m
+        self.pos = b
+        return self.ids[a:b], self.values[a:b]
+
+    def close(self):
+        self._blocks.close()
+
+
+def iter_out_records(path: str) -> Iterator[Tuple[List[bytes], List[Optional[bytes]]]]:
+    """Blocks of (SequenceIDs, taxids) from a Kraken output."""
+    parse = NamedTaxidParser()
+    fin, _ = open_binary(path, "rb")
+    with fin:
+        for records in iter_kraken_blocks(fin):
+            yield [r[1] for r in records], [parse(r[2]) for r in records]
+
+
+def _entropy_strings(scorer, trues: List[bytes], preds: List[Optional[bytes]]) -> List[bytes]:
+    t = np.array([x.decode() for x in trues], dtype=object)
+    p = np.array([None if x is None else x.decode() for x in preds], dtype=object)
+    entropy = scorer.score(t, p).entropy
+    return [b"" if np.isnan(h) else str(float(h)).encode() for h in entropy]
+
+
+def _format_rows(ids, trues, columns, scorer) -> bytes:
+    cols = [ids, trues] + [[b"" if v is None else v for v in c] for c in columns]
+    if scorer is not None:
+        cols += [_entropy_strings(scorer, trues, c) for c in columns]
+    return b"".join(b"\t".join(row) + b"\n" for row in zip(*cols))
+
+
+def _header(labels: Sequence[str], scorer) -> bytes:
+    names = ["SequenceID", "true_taxid"] + list(labels)
+    if scorer is not None:
+        names += [f"entropy_{label}" for label in labels]
+    return ("\t".join(names) + "\n").encode()
+
+
+def _merge_lockstep(key_path, out_paths, fout, scorer) -> Optional[int]:
+    """Stream the merge; returns rows written, or None as soon as the inputs diverge."""
+    key = RecordBuffer(iter_key_records(key_path))
+    outs = [RecordBuffer(iter_out_records(p)) for p in out_paths]
+    n = 0
+    try:
+        while True:
+            m = key.available()
+            avail = [o.available() for o in outs]
+            if m == 0:
+                return n if not any(avail) else None
+            m = min([m] + avail)
+            if m == 0:
+                return None  # an output ended before the key
+
+            ids, trues = key.take(m)
+            columns = []
+            for o in outs:
+                out_ids, taxids = o.take(m)
+                if out_ids != ids:
+                    return None
+                columns.append(taxids)
+            fout.write(_format_rows(ids, trues, columns, scorer))
+            n += m
+    finally:
+        key.close()
+        for o in outs:
+            o.close()
+
+
+def _merge_by_id(key_path, out_paths, labels, fout, scorer, max_memory, tmp_dir) -> MergeReport:
+    """Slow path for outputs whose order differs from the key: external merge-join by SequenceID."""
+    rows, mismatches, cleanup = external_join(
+        iter_key_records(key_path), [iter_out_records(p) for p in out_paths], max_memory, tmp_dir
+    )
+    try:
+        for label, m in zip(labels, mismatches):
+            if m.n_missing or m.n_extra:
+                return MergeReport(False, 0, False, label, m.n_missing, m.n_extra, m.missing_sample, m.extra_sample)
+        n = 0
+        for ids, trues, columns in rows:
+            fout.write(_format_rows(ids, trues, columns, scorer))
+            n += len(ids)
+        return MergeReport(True, n, False, None, 0, 0)
+    finally:
+        cleanup()
+
+
+def merge_sample(key_path: str,
+                 out_paths: Sequence[str],
+                 labels: Sequence[str],
+                 output_path: str,
+                 scorer=None,
+                 max_memory: Union[int, str] = DEFAULT_MAX_MEMORY,
+                 tmp_dir: Optional[str] = None) -> MergeReport:
+    """
+    Merge a key file and its Kraken outputs (labelled e.g. virid1..virid6) into
+    output_path. Nothing is written under output_path unless the merge succeeds.
+
+    max_memory ('4G', bytes) bounds the slow path; its sorted runs spill to tmp_dir.
+    """
+    if isinstance(max_memory, str):
+        max_memory = parse_size(max_memory)
+    tmp_path = f"{output_path}.tmp"
+    try:
+        with open(tmp_path, "wb") as fout:
+            fout.write(_header(labels, scorer))
+            n = _merge_lockstep(key_path, out_paths, fout, scorer)
+            if n is not None:
+                report = MergeReport(True, n, True, None, 0, 0)
+            else:
+                fout.seek(0)
+                fout.truncate()
+                fout.write(_header(labels, scorer))
+                report = _merge_by_id(key_path, out_paths, labels, fout, scorer, max_memory, tmp_dir)
+        if report.ok:
+            os.replace(tmp_path, output_path)
+        return report
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+
+"""
+parquet_io.py
+
+Columnar (Parquet) per-read entropy outputs and a reader shared by downstream scripts.
+
+Columns are typed instead of repeated as text on every row: taxids and edge counts are
+int32, entropy is float32 and lca_rank is dictionary-encoded (read back as a pandas
+categorical). Rows are written in row groups so readers can select columns and stream.
+
+pyarrow is an optional dependency; it is only imported when Parquet is actually used.
+"""
+
+import importlib
+from typing import Dict, Iterable, List, Optional, Sequence
+
+DEFAULT_ROW_GROUP_SIZE = 1 << 20  # rows
+
+# Parquet page compression for each output codec name used by codec_io
+PARQUET_COMPRESSION = {"plain": "none", "gzip": "gzip", "zstd": "zstd"}
+
+INT_COLUMNS = ("true_taxid", "pred_taxid", "lca_taxid", "up_from_true", "down_to_pred", "branch_size_LCA")
+FLOAT_COLUMNS = ("entropy",)
+CATEGORY_COLUMNS = ("lca_rank",)
+
+PLAIN_COLUMNS = ("read_id", "true_taxid", "pred_taxid", "entropy")
+DIAG_COLUMNS = PLAIN_COLUMNS + ("lca_taxid", "lca_rank", "up_from_true", "down_to_pred", "branch_size_LCA")
+
+
+def require_pyarrow():
+    """Return (pyarrow, pyarrow.parquet), with a clear error if pyarrow is missing."""
+    try:
+        pa = importlib.import_module("pyarrow")
+        pq = importlib.import_module("pyarrow.parquet")
+    except ImportError:
+        raise RuntimeError("Parquet output requires pyarrow (pip install pyarrow)") from None
+    return pa, pq
+
+
+def column_type(pa, name: str):
+    if name in INT_COLUMNS:
+        return pa.int32()
+    if name in FLOAT_COLUMNS:
+        return pa.float32()
+    if name in CATEGORY_COLUMNS:
+        return pa.dictionary(pa.int32(), pa.string())
+    return pa.string()
+
+
+def entropy_schema(columns: Sequence[str]):
+    pa, _ = require_pyarrow()
+    return pa.schema([(name, column_type(pa, name)) for name in columns])
+
+
+def as_int(value) -> Optional[int]:
+    """Taxid / count field as int, or None if blank or non-numeric."""
+    if value is None:
+        return None
+    s = str(value).strip()
+    return int(s) if s.isdigit() else None
+
+
+# ----------------------------
+# Writing
+# ----------------------------
+class EntropyParquetWriter:
+    """
+    Streaming writer for batch per-read outputs.
+
+    Each distinct prediction is registered once with add_pred(), which returns a code;
+    rows are then given as (read_id, code) and expanded with Arrow take() when a row group
+    is flushed, so per-read work stays a list append.
+    """
+
+    def __init__(self,
+                 path: str,
+                 write_diag: bool,
+                 codec: str = "zstd",
+                 level: Optional[int] = None,
+                 row_group_size: int = DEFAULT_ROW_GROUP_SIZE):
+        self.pa, pq = require_pyarrow()
+        self.columns = DIAG_COLUMNS if write_diag else PLAIN_COLUMNS
+        self.schema = entropy_schema(self.columns)
+        compression = PARQUET_COMPRESSION[codec]
+        self.label = f"parquet:{compression}"
+        self._writer = pq.ParquetWriter(
+            path,
+            self.schema,
+            compression=compression,
+            compression_level=level if compression != "none" else None,
+        )
+        self.row_group_size = row_group_size
+        self._preds: Dict[str, List] = {name: [] for name in self.columns[1:]}
+        self._pred_arrays = None
+        self._read_ids: List[bytes] = []
+        self._codes: List[int] = []
+
+    def add_pred(self, true_taxid, pred_taxid, entropy, lca_taxid=None, lca_rank=None, up=None, down=None,
+                 branch_size=None) -> int:
+        values = (as_int(true_taxid), as_int(pred_taxid), entropy, as_int(lca_taxid), lca_rank or None,
+                  up, down, branch_size)
+        for name, value in zip(self.columns[1:], values):
+            self._preds[name].append(value)
+        self._pred_arrays = None
+        return len(self._preds["pred_taxid"]) - 1
+
+    def write_rows(self, read_ids: Iterable[bytes], codes: Iterable[int]):
+        self._read_ids.extend(read_ids)
+        self._codes.extend(codes)
+        while len(self._codes) >= self.row_group_size:
+            self._flush(self.row_group_size)
+
+    def _flush(self, n: int):
+        pa = self.pa
+        if self._pred_arrays is None:
+            self._pred_arrays = [
+                pa.array(self._preds[name], type=column_type(pa, name)) for name in self.columns[1:]
+            ]
+        read_ids = pa.array([r.decode() for r in self._read_ids[:n]], type=pa.string())
+        codes = pa.array(self._codes[:n], type=pa.int32())
+        arrays = [read_ids] + [arr.take(codes) for arr in self._pred_arrays]
+        self._writer.write_table(pa.Table.from_arrays(arrays, schema=self.schema))
+        del self._read_ids[:n]
+        del self._codes[:n]
+
+    def close(self):
+        if self._writer is None:
+            return
+        try:
+            if self._codes:
+                self._flush(len(self._codes))
+        finally:
+            self._writer.close()
+            self._writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+def concat_parquet(parts: Sequence[str], out_path: str, codec: str = "zstd", level: Optional[int] = None) -> str:
+    """Append the row groups of parts (same schema), in order, into one file. Returns a codec label."""
+    _, pq = require_pyarrow()
+    compression = PARQUET_COMPRESSION[codec]
+    schema = pq.read_schema(parts[0])
+    with pq.ParquetWriter(
+        out_path, schema, compression=compression, compression_level=level if compression != "none" else None
+    ) as writer:
+        for part in parts:
+            pf = pq.ParquetFile(part)
+            for i in range(pf.num_row_groups):
+                writer.write_table(pf.read_row_group(i))
+    return f"parquet:{compression}"
+
+
+def entropy_frame_table(df):
+    """
+    Arrow table of a weighted_entropy.py output DataFrame. Known columns get their compact
+    types (values that are not numeric become null); any other input columns are kept as
+    strings, so every chunk of one input gets the same schema.
+    """
+    pa, _ = require_pyarrow()
+    import pandas as pd
+
+    arrays = []
+    for name in df.columns:
+        col = df[name]
+        if name in INT_COLUMNS:
+            arr = pa.array(pd.to_numeric(col, errors="coerce").astype("Int32"), type=pa.int32())
+        elif name in FLOAT_COLUMNS:
+            arr = pa.array(pd.to_numeric(col, errors="coerce").astype("float32"), type=pa.float32(), from_pandas=True)
+        elif name in CATEGORY_COLUMNS:
+            arr = pa.array(col.astype(object), type=pa.string(), from_pandas=True).dictionary_encode()
+        else:
+            arr = pa.array(col.astype(object), type=pa.string(), from_pandas=True)
+        arrays.append(arr)
+    return pa.Table.from_arrays(arrays, names=[str(c) for c in df.columns])
+
+
+class EntropyFrameWriter:
+    """Append weighted_entropy.py output DataFrames (e.g. successive chunks) to one Parquet file."""
+
+    def __init__(self, path: str, codec: str = "zstd", level: Optional[int] = None,
+                 row_group_size: int = DEFAULT_ROW_GROUP_SIZE):
+        _, self._pq = require_pyarrow()
+        self.path = path
+        self.compression = PARQUET_COMPRESSION[codec]
+        self.level = level if self.compression != "none" else None
+        self.row_group_size = row_group_size
+        self._writer = None
+
+    def write(self, df):
+        table = entropy_frame_table(df)
+        if self._writer is None:
+            self._writer = self._pq.ParquetWriter(
+                self.path, table.schema, compression=self.compression, compression_level=self.level
+            )
+        self._writer.write_table(table, row_group_size=self.row_group_size)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+def write_entropy_frame(df, path: str, codec: str = "zstd", level: Optional[int] = None,
+                        row_group_size: int = DEFAULT_ROW_GROUP_SIZE):
+    """Write a weighted_entropy.py output DataFrame as Parquet (see entropy_frame_table)."""
+    with EntropyFrameWriter(path, codec, level, row_group_size) as writer:
+        writer.write(df)
+
+
+# ----------------------------
+# Reading
+# ----------------------------
+def read_entropy_table(path: str, columns: Optional[Sequence[str]] = None):
+    """
+    Read a per-read entropy output (.parquet, or TSV optionally .gz/.zst) into a DataFrame,
+    loading only `columns` if given. Parquet taxids come back as nullable Int32 and
+    lca_rank as a categorical; TSV columns are parsed by pandas as before.
+    """
+    import pandas as pd
+
+    if str(path).endswith(".parquet"):
+        pa, pq = require_pyarrow()
+        table = pq.read_table(path, columns=list(columns) if columns is not None else None)
+        return table.to_pandas(types_mapper={pa.int32(): pd.Int32Dtype()}.get)
+
+    from codec_io import open_binary
+
+    fin, _ = open_binary(str(path), "rb")
+    with fin:
+        return pd.read_csv(fin, sep="\t", usecols=list(columns) if columns is not None else None)
+
+
+def iter_entropy_batches(path: str, columns: Optional[Sequence[str]] = None, batch_size: int = 1 << 16):
+    """Stream a Parquet output as DataFrames of up to batch_size rows."""
+    _, pq = require_pyarrow()
+    pf = pq.ParquetFile(path)
+    for batch in pf.iter_batches(batch_size=batch_size, columns=list(columns) if columns is not None else None):
+        yield batch.to_pandas()
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+
+"""
+stage_timing.py
+
+Per-stage instrumentation for weighted_entropy_batch.process_one.
+
+A StageTimer charges wall and CPU time to whichever stage is current; entering a stage
+pauses the enclosing one, so stage times are exclusive and add up to the task total:
+
+    setup     opening input / output, loading the truth key
+    read      reading + decompressing the input (time spent in fin.read)
+    parse     splitting blocks into fields, pred taxid parsing, cache lookups, row joins
+    score     LCA + entropy for cache misses (distinct preds / pairs)
+    write     formatting + compressing output rows
+    finalize  per-pred summaries, aggregated tables, rename into place
+
+CPU time is this process's (time.process_time); work done by external pigz / zstd
+processes shows up as write or read wall time only.
+"""
+
+import cProfile
+import contextlib
+import os
+import pstats
+import resource
+import time
+from typing import BinaryIO, Dict, Iterable, List
+
+STAGES = ("setup", "read", "parse", "score", "write", "finalize")
+
+# Result fields filled in by process_one / finalize_parts, in summary column order
+TIMING_KEYS = ["wall_s", "cpu_s"] + [f"{s}_{kind}_s" for s in STAGES for kind in ("wall", "cpu")]
+COUNTER_KEYS = ["cache_hit_rate", "n_distinct_pred", "bytes_in", "bytes_decoded", "bytes_out", "peak_rss_mb"]
+STATS_KEYS = TIMING_KEYS + COUNTER_KEYS
+
+PROFILE_TOP = 40
+
+
+class StageTimer:
+    def __init__(self, stage: str = "setup"):
+        self.wall: Dict[str, float] = dict.fromkeys(STAGES, 0.0)
+        self.cpu: Dict[str, float] = dict.fromkeys(STAGES, 0.0)
+        self.current = stage
+        self._wall0 = time.perf_counter()
+        self._cpu0 = time.process_time()
+
+    def switch(self, stage: str) -> str:
+        """Charge elapsed time to the current stage, make `stage` current; returns the previous one."""
+        wall, cpu = time.perf_counter(), time.process_time()
+        self.wall[self.current] += wall - self._wall0
+        self.cpu[self.current] += cpu - self._cpu0
+        self._wall0, self._cpu0 = wall, cpu
+        prev, self.current = self.current, stage
+        return prev
+
+    @contextlib.contextmanager
+    def stage(self, stage: str):
+        prev = self.switch(stage)
+        try:
+            yield
+        finally:
+            self.switch(prev)
+
+    def stats(self) -> Dict[str, float]:
+        """Stop the clock (charging the current stage) and return the TIMING_KEYS fields."""
+        self.switch(self.current)
+        out = {"wall_s": sum(self.wall.values()), "cpu_s": sum(self.cpu.values())}
+        for s in STAGES:
+            out[f"{s}_wall_s"] = self.wall[s]
+            out[f"{s}_cpu_s"] = self.cpu[s]
+        return out
+
+
+class TimedReader:
+    """File wrapper charging read() to the timer's read stage and counting the bytes returned."""
+
+    def __init__(self, fin: BinaryIO, timer: StageTimer):
+        self.fin = fin
+        self.timer = timer
+        self.n_bytes = 0
+
+    def read(self, size: int = -1) -> bytes:
+        prev = self.timer.switch("read")
+        try:
+            data = self.fin.read(size)
+        finally:
+            self.timer.switch(prev)
+        self.n_bytes += len(data)
+        return data
+
+
+def peak_rss_mb() -> float:
+    """Peak RSS of this process so far (ru_maxrss is KiB on Linux)."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def count_distinct_preds(keys: Iterable[str]) -> int:
+    """Distinct pred taxids among pred_stats keys ("pred" or "true\\tpred")."""
+    return len({k.rsplit("\t", 1)[-1] for k in keys})
+
+
+def merge_stats(results: List[dict]) -> Dict[str, object]:
+    """Combine the stats of a split task's parts: times, bytes and cache counts add up, RSS is the max."""
+    merged: Dict[str, object] = {}
+    for key in TIMING_KEYS + ["bytes_in", "bytes_decoded", "bytes_out", "cache_hits", "cache_lookups"]:
+        merged[key] = sum(r.get(key) or 0 for r in results)
+    merged["peak_rss_mb"] = max((r.get("peak_rss_mb") or 0 for r in results), default=0)
+    return merged
+
+
+def hit_rate(hits: int, lookups: int) -> str:
+    return f"{hits / lookups:.6f}" if lookups else ""
+
+
+def format_stats(r) -> List[str]:
+    """STATS_KEYS values of a result as summary TSV fields ('' when not measured, e.g. reused outputs)."""
+    fields = []
+    for key in STATS_KEYS:
+        v = r.get(key, "")
+        if key == "cache_hit_rate" and "cache_lookups" in r:
+            v = hit_rate(r.get("cache_hits", 0), r["cache_lookups"])
+        elif isinstance(v, float):
+            v = f"{v:.1f}" if key == "peak_rss_mb" else f"{v:.6f}"
+        fields.append(str(v))
+    return fields
+
+
+def trace_record(r) -> dict:
+    """One JSON-lines trace record for a finished task or part."""
+    rec = {k: r.get(k) for k in ("path", "out_path", "part_index", "byte_range", "pid", "status", "n_reads")}
+    rec.update({k: r.get(k) for k in STATS_KEYS + ["cache_hits", "cache_lookups"] if k in r})
+    if "cache_lookups" in r:
+        rec["cache_hit_rate"] = r["cache_hits"] / r["cache_lookups"] if r["cache_lookups"] else None
+    return {k: v for k, v in rec.items() if v is not None}
+
+
+def profile_call(fn, job, profile_dir: str):
+    """Run fn(job) under cProfile; stats go to <profile_dir>/<input>[.partN].<pid>.prof (+ .txt)."""
+    os.makedirs(profile_dir, exist_ok=True)
+    stem = os.path.basename(job["path"])
+    if "part_index" in job:
+        stem += f".part{job['part_index']:05d}"
+    path = os.path.join(profile_dir, f"{stem}.{os.getpid()}.prof")
+
+    prof = cProfile.Profile()
+    result = prof.runcall(fn, job)
+    prof.dump_stats(path)
+    with open(path[:-len(".prof")] + ".txt", "w") as f:
+        pstats.Stats(prof, stream=f).sort_stats("cumulative").print_stats(PROFILE_TOP)
+    return {**result, "profile_path": path}
@@ -1,26 +1,16 @@
-import pandas as pd
-import re
 from pathlib import Path
 
+from lockstep_merge import merge_sample
+
 # Configure directory paths 
 KEY_DIR = Path("$MYPATH/entropy/keys/final_keys")           # Directory with *_key_final.txt files
 OUT_DIR = Path("$MYPATH/entropy/kraken2_analysis/out")           # Directory with *.out files
 SUMMARY_DIR = Path("$MYPATH/entropy/kraken2_analysis/summaries")       # Output directory for merged files
-
-# Clean up sequence IDs
-def clean_sequence_id(seq):
-    seq = seq.lstrip('@')
-    seq = re.sub(r'/\d+$', '', seq)
-    return seq
-
-# Parse .out file and extract SequenceID + NCBI taxid
-def parse_out_file(file_path):
-    cols = ["CoU", "SequenceID", "taxid_raw", "read_length", "lca2kmer"]
-    df = pd.read_csv(file_path, sep="\t", header=None, names=cols, dtype=str)
-    df[['taxa', 'taxid']] = df['taxid_raw'].str.extract(r'^(.*?) \(taxid (\d+)\)$')
-    return df[['SequenceID', 'taxid']]
+MAX_MEMORY = "4G"           # Memory bound when .out files must be joined by SequenceID
+TMP_DIR = None              # Local scratch for the join's sorted runs (None = system temp dir)
 
 # Merge each set of experiments into single dataset with validation
+# The key and all .out files are streamed together in read order (see lockstep_merge.py)
 def merge_dataset(base_filename):
     print(f"\n[START] Processing: {base_filename}")
 
@@ -40,35 +30,25 @@ def merge_dataset(base_filename):
         return
 
     try:
-        key_df = pd.read_csv(key_file, sep="\t", header=None, names=["SequenceID", "assembly", "true_taxid"], dtype=str)
-        key_df["SequenceID"] = key_df["SequenceID"].apply(clean_sequence_id)
-        result_df = key_df[["SequenceID", "true_taxid"]].copy()
-        key_ids = set(result_df["SequenceID"])
-
-        for i, virid_file in enumerate(virid_files, 1):
-            virid_df = parse_out_file(virid_file)
-
-            # Check row count match
-            out_ids = set(virid_df["SequenceID"])
-            missing_in_out = key_ids - out_ids
-            extra_in_out = out_ids - key_ids
-
-            if missing_in_out:
-                print(f"[FAIL] virid{i}.out missing {len(missing_in_out)} SequenceIDs from key file")
-            if extra_in_out:
-                print(f"[FAIL] virid{i}.out has {len(extra_in_out)} unexpected SequenceIDs not in key file")
-
-            if missing_in_out or extra_in_out:
-                print(f"[!] Skipping {base_filename} due to row mismatch in virid{i}.out")
-                return
-
-            virid_df.rename(columns={"taxid": f"virid{i}"}, inplace=True)
-            result_df = result_df.merge(virid_df, on="SequenceID", how="left")
-            print(f"[CORRECT] Merged virid{i}.out — all SequenceIDs accounted for")
-
         SUMMARY_DIR.mkdir(parents=True, exist_ok=True)
         output_file = SUMMARY_DIR / f"{base_filename}_virid_summary.txt"
-        result_df.to_csv(output_file, sep="\t", index=False)
+        labels = [f"virid{i}" for i in range(1, 7)]
+        report = merge_sample(str(key_file), [str(f) for f in virid_files], labels, str(output_file),
+                              max_memory=MAX_MEMORY, tmp_dir=TMP_DIR)
+
+        # Check row count match
+        for label in labels:
+            if label == report.failed_label:
+                if report.n_missing:
+                    print(f"[FAIL] {label}.out missing {report.n_missing} SequenceIDs from key file"
+                          f" (e.g. {', '.join(report.missing_sample)})")
+                if report.n_extra:
+                    print(f"[FAIL] {label}.out has {report.n_extra} unexpected SequenceIDs not in key file"
+                          f" (e.g. {', '.join(report.extra_sample)})")
+                print(f"[!] Skipping {base_filename} due to row mismatch in {label}.out")
+                return
+            print(f"[CORRECT] Merged {label}.out — all SequenceIDs accounted for")
+
         print(f"[SAVED] Saved: {output_file}")
 
     except Exception as e:
@@ -1,28 +1,17 @@
-import pandas as pd
-import re
 from pathlib import Path
 import argparse
 
+from lockstep_merge import merge_sample
+
 # === 🔧 CONFIGURE THESE DIRECTORIES ===
 KEY_DIR = Path("/hpc/scratch/Elizabeth.Hunter/entropy/keys/final_keys")
 OUT_DIR = Path("/hpc/scratch/Elizabeth.Hunter/entropy/kraken2_analysis/out")
 SUMMARY_DIR = Path("/hpc/scratch/Elizabeth.Hunter/entropy/kraken2_analysis/summaries2")
 
-# === 🚿 Clean sequence ID
-def clean_sequence_id(seq):
-    seq = seq.lstrip('@')
-    seq = re.sub(r'/\d+$', '', seq)
-    return seq
-
-# === 📖 Parse .out file and extract SequenceID + numeric taxid
-def parse_out_file(file_path):
-    cols = ["CoU", "SequenceID", "taxid_raw", "read_length", "lca2kmer"]
-    df = pd.read_csv(file_path, sep="\t", header=None, names=cols, dtype=str)
-    df[['taxa', 'taxid']] = df['taxid_raw'].str.extract(r'^(.*?) \(taxid (\d+)\)$')
-    return df[['SequenceID', 'taxid']]
-
 # === 🔍 Merge a single dataset with validation
-def merge_dataset(base_filename, start, end, prefix):
+# The key and all outfiles are streamed together in read order (see lockstep_merge.py);
+# SequenceIDs are validated on the fly and the summary is written in one pass.
+def merge_dataset(base_filename, start, end, prefix, scorer=None, max_memory="4G", tmp_dir=None):
     print(f"\n[▶] Processing: {base_filename} ({prefix}{start} to {prefix}{end})")
 
     key_file = KEY_DIR / f"{base_filename}_key_final.txt"
@@ -33,41 +22,34 @@ def merge_dataset(base_filename, start, end, prefix):
         return
 
     try:
-        key_df = pd.read_csv(key_file, sep="\t", header=None, names=["SequenceID", "assembly", "true_taxid"], dtype=str)
-        key_df["SequenceID"] = key_df["SequenceID"].apply(clean_sequence_id)
-        result_df = key_df[["SequenceID", "true_taxid"]].copy()
-        key_ids = set(result_df["SequenceID"])
-
-        # === Process specified prefixN range
-        for i in range(start, end + 1):
-            out_file = OUT_DIR / f"{base_filename}_{prefix}{i}.out"
+        # === Check specified prefixN range
+        labels = [f"{prefix}{i}" for i in range(start, end + 1)]
+        out_files = [OUT_DIR / f"{base_filename}_{label}.out" for label in labels]
+        for label, out_file in zip(labels, out_files):
             if not out_file.exists():
-                print(f"[✗] Skipping {base_filename} — missing {prefix}{i} outfile")
+                print(f"[✗] Skipping {base_filename} — missing {label} outfile")
                 return
 
-            df = parse_out_file(out_file)
-
-            out_ids = set(df["SequenceID"])
-            missing_in_out = key_ids - out_ids
-            extra_in_out = out_ids - key_ids
-
-            if missing_in_out:
-                print(f"[✗] {prefix}{i}.out missing {len(missing_in_out)} SequenceIDs from key file")
-            if extra_in_out:
-                print(f"[✗] {prefix}{i}.out has {len(extra_in_out)} unexpected SequenceIDs not in key file")
-
-            if missing_in_out or extra_in_out:
-                print(f"[!] Skipping {base_filename} due to row mismatch in {prefix}{i}.out")
-                return
-
-            df.rename(columns={"taxid": f"{prefix}{i}"}, inplace=True)
-            result_df = result_df.merge(df, on="SequenceID", how="left")
-            print(f"[✓] Merged {prefix}{i}.out — all SequenceIDs accounted for")
-
-        # === Write result
+        # === Merge and write result
         SUMMARY_DIR.mkdir(parents=True, exist_ok=True)
         output_file = SUMMARY_DIR / f"{base_filename}_{prefix}{start}-{end}_summary.txt"
-        result_df.to_csv(output_file, sep="\t", index=False)
+        report = merge_sample(str(key_file), [str(f) for f in out_files], labels, str(output_file), scorer,
+                              max_memory=max_memory, tmp_dir=tmp_dir)
+
+        for label in labels:
+            if label == report.failed_label:
+                if report.n_missing:
+                    print(f"[✗] {label}.out missing {report.n_missing} SequenceIDs from key file"
+                          f" (e.g. {', '.join(report.missing_sample)})")
+                if report.n_extra:
+                    print(f"[✗] {label}.out has {report.n_extra} unexpected SequenceIDs not in key file"
+                          f" (e.g. {', '.join(report.extra_sample)})")
+                print(f"[!] Skipping {base_filename} due to row mismatch in {label}.out")
+                return
+            print(f"[✓] Merged {label}.out — all SequenceIDs accounted for")
+
+        if not report.lockstep:
+            print("[ℹ] Read order differed from the key file; joined by SequenceID")
         print(f"[💾] Saved: {output_file}")
 
     except Exception as e:
@@ -85,10 +67,19 @@ if __name__ == "__main__":
     parser.add_argument("--start", type=int, required=True, help="Start index of prefixN files (inclusive)")
     parser.add_argument("--end", type=int, required=True, help="End index of prefixN files (inclusive)")
     parser.add_argument("--prefix", type=str, default="virid", help="Prefix used in file names (default: virid)")
+    parser.add_argument("--nodes-dmp", default=None, help="Optional: add entropy_<prefix>N columns scored against this taxonomy")
+    parser.add_argument("--taxonomy-cache", default=None, help="Compiled taxonomy cache directory (see taxonomy_cache.py)")
+    parser.add_argument("--max-memory", default="4G", help="Memory bound when outfiles must be joined by SequenceID (default: 4G)")
+    parser.add_argument("--tmp-dir", default=None, help="Local scratch for the join's sorted runs (default: system temp dir)")
     args = parser.parse_args()
 
+    scorer = None
+    if args.nodes_dmp:
+        from weighted_entropy import EntropyScorer
+        scorer = EntropyScorer.from_nodes_dmp(args.nodes_dmp, args.taxonomy_cache)
+
     base_files = auto_detect_base_filenames_from_out_dir(args.start, args.prefix)
     print(f"[ℹ] Found {len(base_files)} datasets with _{args.prefix}{args.start}.out")
 
     for base in base_files:
-        merge_dataset(base, args.start, args.end, args.prefix)
+        merge_dataset(base, args.start, args.end, args.prefix, scorer, args.max_memory, args.tmp_dir)
@@ -0,0 +1,433 @@
+#!/usr/bin/env python3
+
+"""
+taxonomy_cache.py
+
+Compile NCBI nodes.dmp into an integer-indexed, array-backed taxonomy cache.
+
+The cache is a directory of .npy arrays with one entry per taxonomy node (sorted by taxid),
+plus a meta.json recording the size and mtime of the source nodes.dmp. Loading memory-maps
+the arrays, so startup takes milliseconds and every pool worker shares the same physical
+pages instead of holding its own copy of the taxonomy as Python dicts. The cache is
+recompiled automatically whenever the source nodes.dmp changes.
+
+One-time compile:
+
+    python taxonomy_cache.py --nodes-dmp nodes.dmp --cache-dir nodes.cache
+"""
+
+import argparse
+import json
+import os
+import shutil
+from bisect import bisect_left
+from collections.abc import Mapping
+from typing import Dict, Iterable, Iterator, NamedTuple, Optional, Set, Tuple
+
+import numpy as np
+
+
+CACHE_VERSION = 1
+META_FILE = "meta.json"
+ARRAY_FIELDS = ("taxid", "parent", "rank_code", "depth", "branch_size")
+# Taxid strings whose node index NodeColumns remembers
+INDEX_MEMO_SIZE = 1 << 20
+
+
+class TaxonomyArrays(NamedTuple):
+    """
+    Array-backed taxonomy. Node i has taxid taxid[i]; all other arrays are indexed by node.
+
+    taxid:       int32, sorted ascending
+    parent:      int32 node index of the parent (roots point to themselves)
+    rank_code:   uint8 index into rank_names
+    depth:       int32 edges from root
+    branch_size: int32 number of children (as counted by load_taxonomy)
+    rank_names:  tuple of rank strings
+    """
+    taxid: np.ndarray
+    parent: np.ndarray
+    rank_code: np.ndarray
+    depth: np.ndarray
+    branch_size: np.ndarray
+    rank_names: Tuple[str, ...]
+
+
+# ----------------------------
+# Compile
+# ----------------------------
+
+def parse_nodes_dmp(nodes_path: str) -> TaxonomyArrays:
+    """
+    Parse nodes.dmp into TaxonomyArrays (in memory, nothing written to disk).
+
+    Depth and branch size follow weighted_entropy.load_taxonomy exactly: a node whose
+    parent is itself or missing from the file has depth 0, and the root's self-edge
+    counts towards its own branch size.
+    """
+    taxids = []
+    parent_taxids = []
+    rank_strs = []
+
+    with open(nodes_path, "r") as f:
+        for line in f:
+            parts = line.split("|", 3)
+            if len(parts) < 3:
+                continue
+            taxids.append(int(parts[0]))
+            parent_taxids.append(int(parts[1]))
+            rank_strs.append(parts[2].strip())
+
+    taxid_raw = np.asarray(taxids, dtype=np.int64)
+    parent_raw = np.asarray(parent_taxids, dtype=np.int64)
+    del taxids, parent_taxids
+
+    # Last occurrence wins for duplicated taxids, as with dict assignment
+    order = np.argsort(taxid_raw, kind="stable")
+    taxid_sorted = taxid_raw[order]
+    keep = np.ones(len(order), dtype=bool)
+    keep[:-1] = taxid_sorted[:-1] != taxid_sorted[1:]
+    order = order[keep]
+
+    taxid = taxid_raw[order].astype(np.int32)
+    parent_taxid = parent_raw[order]
+
+    rank_names: Dict[str, int] = {}
+    rank_code = np.empty(len(order), dtype=np.uint8)
+    for i, j in enumerate(order.tolist()):
+        code = rank_names.setdefault(rank_strs[j], len(rank_names))
+        if code > np.iinfo(np.uint8).max:
+            raise ValueError(f"Too many distinct ranks in {nodes_path}")
+        rank_code[i] = code
+    del rank_strs
+
+    n = len(taxid)
+    pos = np.searchsorted(taxid, parent_taxid)
+    pos_clipped = np.minimum(pos, max(n - 1, 0))
+    has_parent = (pos < n) & (taxid[pos_clipped] == parent_taxid)
+
+    # Children are counted only under parents present in the file (root self-edge included)
+    branch_size = np.bincount(pos_clipped[has_parent], minlength=n).astype(np.int32)
+
+    self_idx = np.arange(n, dtype=np.int32)
+    parent = np.where(has_parent, pos_clipped, self_idx).astype(np.int32)
+
+    # Depth by levels: roots are 0, then repeatedly settle nodes whose parent is settled
+    depth = np.full(n, -1, dtype=np.int32)
+    depth[parent == self_idx] = 0
+    pending = np.flatnonzero(depth < 0)
+    while len(pending):
+        parent_depth = depth[parent[pending]]
+        ready = parent_depth >= 0
+        if not ready.any():
+            # Parent cycle: no path to a root, mirror the dict loader's fallback
+            depth[pending] = 0
+            break
+        depth[pending[ready]] = parent_depth[ready] + 1
+        pending = pending[~ready]
+
+    return TaxonomyArrays(
+        taxid=taxid,
+        parent=parent,
+        rank_code=rank_code,
+        depth=depth,
+        branch_size=branch_size,
+        rank_names=tuple(rank_names),
+    )
+
+
+def source_signature(nodes_path: str) -> Dict[str, int]:
+    st = os.stat(nodes_path)
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+
+def read_cache_meta(cache_dir: str) -> Optional[dict]:
+    try:
+        with open(os.path.join(cache_dir, META_FILE), "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def cache_is_fresh(nodes_path: str, cache_dir: str) -> bool:
+    """True if cache_dir holds a complete cache compiled from the current nodes.dmp."""
+    meta = read_cache_meta(cache_dir)
+    if meta is None or meta.get("version") != CACHE_VERSION:
+        return False
+    if meta.get("source") != source_signature(nodes_path):
+        return False
+    return all(os.path.exists(os.path.join(cache_dir, f"{name}.npy")) for name in ARRAY_FIELDS)
+
+
+def compile_taxonomy_cache(nodes_path: str, cache_dir: str) -> TaxonomyArrays:
+    """
+    Parse nodes.dmp and write the cache to cache_dir.
+
+    The cache is written to a temporary sibling directory and swapped into place, so
+    concurrent jobs never observe a half-written cache.
+    """
+    signature = source_signature(nodes_path)
+    arrays = parse_nodes_dmp(nodes_path)
+
+    cache_dir = os.path.abspath(cache_dir)
+    tmp_dir = f"{cache_dir}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    for name in ARRAY_FIELDS:
+        np.save(os.path.join(tmp_dir, f"{name}.npy"), getattr(arrays, name))
+
+    meta = {
+        "version": CACHE_VERSION,
+        "nodes_dmp": os.path.abspath(nodes_path),
+        "source": signature,
+        "n_nodes": int(len(arrays.taxid)),
+        "rank_names": list(arrays.rank_names),
+    }
+    with open(os.path.join(tmp_dir, META_FILE), "w") as f:
+        json.dump(meta, f, indent=2)
+
+    if os.path.exists(cache_dir):
+        stale_dir = f"{cache_dir}.stale-{os.getpid()}"
+        os.rename(cache_dir, stale_dir)
+        shutil.rmtree(stale_dir, ignore_errors=True)
+    try:
+        os.rename(tmp_dir, cache_dir)
+    except OSError:
+        # Another job installed a cache first; keep theirs
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    return arrays
+
+
+def load_taxonomy_arrays(nodes_path: str, cache_dir: Optional[str] = None) -> TaxonomyArrays:
+    """
+    Load the taxonomy as arrays.
+
+    With cache_dir, memory-map the compiled cache (compiling it first if missing or stale).
+    Without cache_dir, parse nodes.dmp in memory.
+    """
+    if cache_dir is None:
+        return parse_nodes_dmp(nodes_path)
+
+    if not cache_is_fresh(nodes_path, cache_dir):
+        compile_taxonomy_cache(nodes_path, cache_dir)
+
+    meta = read_cache_meta(cache_dir)
+    loaded = {name: np.load(os.path.join(cache_dir, f"{name}.npy"), mmap_mode="r") for name in ARRAY_FIELDS}
+    return TaxonomyArrays(rank_names=tuple(meta["rank_names"]), **loaded)
+
+
+# ----------------------------
+# Pruning
+# ----------------------------
+
+def prune_taxonomy(arrays: TaxonomyArrays, keep_taxids: Iterable[int]) -> TaxonomyArrays:
+    """
+    Restrict the taxonomy to the subtree induced by keep_taxids and all their ancestors.
+
+    Depth and branch size are copied from the full tree, so LCAs (which are always
+    ancestors of a kept taxid) and entropy values are unchanged for any pair of kept
+    taxids. Taxids absent from the taxonomy are ignored.
+    """
+    keep_idx = lookup_indices(arrays, np.fromiter(keep_taxids, dtype=np.int64))
+    keep_idx = keep_idx[keep_idx >= 0]
+
+    mask = np.zeros(len(arrays.taxid), dtype=bool)
+    frontier = np.unique(keep_idx)
+    while len(frontier):
+        mask[frontier] = True
+        parents = np.unique(arrays.parent[frontier])
+        frontier = parents[~mask[parents]]
+
+    kept = np.flatnonzero(mask)
+    remap = np.full(len(arrays.taxid), -1, dtype=np.int32)
+    remap[kept] = np.arange(len(kept), dtype=np.int32)
+
+    return TaxonomyArrays(
+        taxid=np.ascontiguousarray(arrays.taxid[kept]),
+        parent=remap[arrays.parent[kept]],
+        rank_code=np.ascontiguousarray(arrays.rank_code[kept]),
+        depth=np.ascontiguousarray(arrays.depth[kept]),
+        branch_size=np.ascontiguousarray(arrays.branch_size[kept]),
+        rank_names=arrays.rank_names,
+    )
+
+
+def read_taxid_file(path: str) -> Set[int]:
+    """
+    Read taxids to keep when pruning.
+
+    The format is taken from the column count of the first non-empty line:
+      - accession2taxid.map (accession, accession.version, taxid, gi): taxid in column 3
+      - seqid2taxid.map (seqid, taxid): taxid in column 2
+      - plain list: taxid in column 1
+    Header and non-numeric lines are skipped.
+    """
+    taxids: Set[int] = set()
+    col = None
+    with open(path, "r") as f:
+        for line in f:
+            parts = line.rstrip("\r\n").split("\t")
+            if col is None:
+                if not line.strip():
+                    continue
+                col = 2 if len(parts) >= 3 else len(parts) - 1
+            field = parts[col].strip() if col < len(parts) else ""
+            if field.isdigit():
+                taxids.add(int(field))
+    return taxids
+
+
+# ----------------------------
+# Lookups
+# ----------------------------
+
+def lookup_indices(arrays: TaxonomyArrays, taxids) -> np.ndarray:
+    """Map an array of integer taxids to node indices (-1 where absent)."""
+    q = np.asarray(taxids, dtype=np.int64)
+    n = len(arrays.taxid)
+    if n == 0:
+        return np.full(q.shape, -1, dtype=np.int64)
+    pos = np.searchsorted(arrays.taxid, q)
+    pos_clipped = np.minimum(pos, n - 1)
+    found = (pos < n) & (arrays.taxid[pos_clipped] == q)
+    return np.where(found, pos_clipped, -1)
+
+
+def _taxid_int(taxid) -> Optional[int]:
+    """taxid as a Python int, or None if it cannot be a key."""
+    if isinstance(taxid, str):
+        # Only canonical digit strings are keys, as in the dict-based taxonomy
+        if not taxid.isdigit() or (len(taxid) > 1 and taxid[0] == "0"):
+            return None
+        return int(taxid)
+    if isinstance(taxid, bool) or not isinstance(taxid, (int, np.integer)):
+        return None
+    return int(taxid)
+
+
+def _bisect_index(taxids, taxid) -> int:
+    t = _taxid_int(taxid)
+    if t is None:
+        return -1
+    pos = bisect_left(taxids, t)
+    return pos if pos < len(taxids) and taxids[pos] == t else -1
+
+
+def index_of(arrays: TaxonomyArrays, taxid) -> int:
+    """
+    Node index for a single taxid (int or digit string), or -1 if absent. For many
+    lookups, NodeColumns.index_of skips the per-call memoryview.
+    """
+    return _bisect_index(memoryview(np.ascontiguousarray(arrays.taxid)), taxid)
+
+
+class NodeColumns:
+    """
+    Per-node columns of a TaxonomyArrays as memoryviews, for scalar lookups in Python
+    loops: element access gives plain ints (much faster than numpy scalars), and
+    memory-mapped pages stay shared. Taxid strings already looked up are remembered
+    (up to INDEX_MEMO_SIZE), since a bisect costs several dict lookups.
+    """
+
+    def __init__(self, arrays: TaxonomyArrays):
+        self.arrays = arrays
+        self.rank_names = arrays.rank_names
+        self.taxid, self.parent, self.rank_code, self.depth, self.branch_size = (
+            memoryview(np.ascontiguousarray(getattr(arrays, f))) for f in ARRAY_FIELDS
+        )
+        self._memo: Dict[str, int] = {}
+
+    def index_of(self, taxid) -> int:
+        """Node index for a taxid (int or digit string), or -1 if absent."""
+        if type(taxid) is not str:
+            return _bisect_index(self.taxid, taxid)
+        i = self._memo.get(taxid)
+        if i is None:
+            i = _bisect_index(self.taxid, taxid)
+            if len(self._memo) < INDEX_MEMO_SIZE:
+                self._memo[taxid] = i
+        return i
+
+
+class TaxidView(Mapping):
+    """
+    Read-only, dict-like view of one taxonomy attribute keyed by taxid string.
+
+    Lets code written against load_taxonomy's dicts (membership tests, .get, lineage
+    walks) run unchanged on top of memory-mapped arrays. Lookups bisect the shared taxid
+    column (see NodeColumns), so each costs a few dict lookups' worth: per-pair scoring
+    in a loop is faster with EntropyScorer or LCAIndex, which work on node indices.
+    """
+
+    def __init__(self, arrays: TaxonomyArrays, field: str, nodes: Optional[NodeColumns] = None):
+        self._arrays = arrays
+        self._field = field
+        self._nodes = nodes = nodes if nodes is not None else NodeColumns(arrays)
+        self._index_of = nodes.index_of
+        self._memo = nodes._memo
+        if field == "parent":
+            taxid, parent = nodes.taxid, nodes.parent
+            self._value = lambda i: str(taxid[parent[i]])
+        elif field == "rank":
+            rank_names, rank_code = nodes.rank_names, nodes.rank_code
+            self._value = lambda i: rank_names[rank_code[i]]
+        else:
+            self._value = getattr(nodes, field).__getitem__
+
+    def __getitem__(self, key):
+        i = self._index_of(key)
+        if i < 0:
+            raise KeyError(key)
+        return self._value(i)
+
+    def get(self, key, default=None):
+        # Memo hit inline: lineage walks call this once per node
+        i = self._memo.get(key) if type(key) is str else None
+        if i is None:
+            i = self._index_of(key)
+        return default if i < 0 else self._value(i)
+
+    def __contains__(self, key) -> bool:
+        return self._index_of(key) >= 0
+
+    def __iter__(self) -> Iterator[str]:
+        return (str(t) for t in self._arrays.taxid.tolist())
+
+    def __len__(self) -> int:
+        return len(self._arrays.taxid)
+
+
+def taxonomy_views(arrays: TaxonomyArrays) -> Tuple[TaxidView, TaxidView, TaxidView, TaxidView]:
+    """Return (parent, rank, depth, branch_size) views, in load_taxonomy's order."""
+    nodes = NodeColumns(arrays)
+    return (
+        TaxidView(arrays, "parent", nodes),
+        TaxidView(arrays, "rank", nodes),
+        TaxidView(arrays, "depth", nodes),
+        TaxidView(arrays, "branch_size", nodes),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compile NCBI nodes.dmp into a memory-mappable taxonomy cache.")
+    parser.add_argument("--nodes-dmp", required=True,
+                        help="Path to NCBI nodes.dmp file.")
+    parser.add_argument("--cache-dir", required=True,
+                        help="Directory to write the compiled cache to.")
+    parser.add_argument("--force", action="store_true",
+                        help="Recompile even if the cache is up to date.")
+    args = parser.parse_args()
+
+    if not args.force and cache_is_fresh(args.nodes_dmp, args.cache_dir):
+        print(f"Cache is up to date: {args.cache_dir}")
+        return
+
+    print(f"Compiling taxonomy from: {args.nodes_dmp}")
+    arrays = compile_taxonomy_cache(args.nodes_dmp, args.cache_dir)
+    print(f"Wrote {len(arrays.taxid)} taxonomy nodes to: {args.cache_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+
+"""
+truth_keys.py
+
+Per-read truth for mixed samples: stream a *_key_final.txt file alongside a Kraken output.
+
+Key files are headerless TSVs (as read by summaries.py):
+
+    SequenceID <TAB> assembly <TAB> true_taxid
+
+SequenceIDs are normalized with clean_sequence_id (leading '@' and a trailing /1 or /2
+removed). Kraken writes reads in input order, so the key is usually in the same order as
+the .out file and the join is a lockstep walk over both streams. The first time the orders
+diverge, the rest of the key is indexed in a dict (ID -> taxid) and lookups continue from
+there, so out-of-order or filtered inputs still join correctly.
+"""
+
+import re
+from operator import itemgetter
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+from codec_io import open_binary
+from kraken_io import iter_line_blocks
+
+KEY_SUFFIX = "_key_final.txt"
+
+# <base>_<prefix>N.out[.gz|.zst] -> <base>, e.g. sample_virid3.out or sample_db1.out
+OUT_BASE_RE = re.compile(r"^(?P<base>.+)_[A-Za-z]+\d+\.out(?:\.gz|\.zst)?$")
+
+READ_SUFFIX_RE = re.compile(rb"/\d+$")
+
+# (SequenceID, true_taxid) of each key line
+KEY_FIELDS_RE = re.compile(rb"^([^\t\n]*)\t[^\t\n]*\t([^\t\n\r]*)", re.M)
+# Every non-whitespace byte, deleted to leave only the field layout of a block
+_NON_SPACE = bytes(c for c in range(256) if c not in b" \t\n\r\x0b\x0c")
+
+
+def clean_sequence_id(seq: bytes) -> bytes:
+    """Strip leading @ and a trailing /N read suffix, as summaries.py does for key IDs."""
+    if seq[:1] == b"@":
+        seq = seq.lstrip(b"@")
+    if b"/" in seq:
+        seq = READ_SUFFIX_RE.sub(b"", seq)
+    return seq
+
+
+def key_path_for(out_path: str, key_dir: str) -> Optional[str]:
+    """Key file in key_dir for a Kraken output named <base>_<prefix>N.out, if it exists."""
+    m = OUT_BASE_RE.match(Path(out_path).name)
+    if not m:
+        return None
+    p = Path(key_dir) / f"{m.group('base')}{KEY_SUFFIX}"
+    return str(p) if p.exists() else None
+
+
+def parse_key_block(block: bytes) -> Tuple[List[bytes], List[bytes]]:
+    """(SequenceIDs, true_taxids) of a block of whole key lines."""
+    # Fast path for plain 3-column keys: if every line is exactly field<TAB>field<TAB>field
+    # with no other whitespace, one split does it; anything else (spaces, CR, empty or
+    # extra fields, non-numeric taxids) goes through the regex instead
+    n = block.count(b"\n")
+    tail = bool(block) and not block.endswith(b"\n")
+    if block.translate(None, _NON_SPACE) == b"\t\t\n" * n + b"\t\t" * tail:
+        parts = block.split()
+        taxids = parts[2::3]
+        if len(parts) == 3 * (n + tail) and b"".join(taxids).isdigit():
+            return parts[0::3], taxids
+    records = KEY_FIELDS_RE.findall(block)
+    taxids = list(map(itemgetter(1), records))
+    if b" " in b"".join(taxids):
+        taxids = [t.strip() for t in taxids]
+    return list(map(itemgetter(0), records)), taxids
+
+
+def iter_key_records(path: str) -> Iterator[Tuple[List[bytes], List[bytes]]]:
+    """Blocks of (cleaned SequenceIDs, true_taxids) of a key file (any codec_io codec)."""
+    fin, _ = open_binary(path, "rb")
+    with fin:
+        for block in iter_line_blocks(fin):
+            ids, taxids = parse_key_block(block)
+            # Most keys need no cleaning; check the whole block at once
+            joined = b"".join(ids)
+            if b"/" in joined or b"@" in joined:
+                ids = [clean_sequence_id(i) for i in ids]
+            yield ids, taxids
+
+
+def key_taxids(path: str) -> Set[int]:
+    """All true taxids in a key file (for taxonomy pruning)."""
+    taxids: Set[bytes] = set()
+    for _, block_taxids in iter_key_records(path):
+        taxids.update(block_taxids)
+    return {int(t) for t in taxids if t.isdigit()}
+
+
+class TruthJoin:
+    """
+    Look up the true taxid of each read, in Kraken output order.
+
+    lookup() returns one taxid (bytes; b"" if the read is not in the key) per read ID.
+    After the last lookup, close() counts key records never matched.
+    """
+
+    def __init__(self, key_path: str):
+        self.key_path = key_path
+        self._blocks = iter_key_records(key_path)
+        self._ids: List[bytes] = []
+        self._taxids: List[bytes] = []
+        self._pos = 0
+        self.index: Optional[Dict[bytes, bytes]] = None
+        self.n_missing = 0
+        self.n_unmatched_key = 0
+
+    def _fill(self) -> bool:
+        for ids, taxids in self._blocks:
+            if ids:
+                self._ids, self._taxids = ids, taxids
+                self._pos = 0
+                return True
+        return False
+
+    def _build_index(self):
+        """Order diverged: index the remaining key records."""
+        index = dict(zip(self._ids[self._pos:], self._taxids[self._pos:]))
+        for ids, taxids in self._blocks:
+            index.update(zip(ids, taxids))
+        self._ids, self._taxids, self._pos = [], [], 0
+        self.index = index
+
+    def lookup(self, read_ids: List[bytes]) -> List[bytes]:
+        out: List[bytes] = []
+        i = 0
+        n = len(read_ids)
+        # Lockstep fast path: compare whole runs of IDs at once
+        while i < n and self.index is None:
+            if self._pos >= len(self._ids) and not self._fill():
+                break
+            m = min(n - i, len(self._ids) - self._pos)
+            if self._ids[self._pos:self._pos + m] != read_ids[i:i + m]:
+                break
+            out.extend(self._taxids[self._pos:self._pos + m])
+            self._pos += m
+            i += m
+        for rid in read_ids[i:]:
+            if self.index is None:
+                if self._pos >= len(self._ids) and not self._fill():
+                    self.index = {}
+                else:
+                    kid = self._ids[self._pos]
+                    if kid == rid or kid == clean_sequence_id(rid):
+                        out.append(self._taxids[self._pos])
+                        self._pos += 1
+                        continue
+                    self._build_index()
+            taxid = self.index.pop(clean_sequence_id(rid), None)
+            if taxid is None:
+                self.n_missing += 1
+                taxid = b""
+            out.append(taxid)
+        return out
+
+    def close(self):
+        if self.index is not None:
+            self.n_unmatched_key = len(self.index)
+        else:
+            self.n_unmatched_key = len(self._ids) - self._pos
+            for ids, _ in self._blocks:
+                self.n_unmatched_key += len(ids)
+        self._blocks.close()
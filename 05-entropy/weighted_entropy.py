@@ -20,10 +20,21 @@ where:
 import argparse
 import math
 from collections import defaultdict
-from typing import Dict, Tuple, Optional
+from typing import Dict, Iterable, List, NamedTuple, Tuple, Optional
 
+import numpy as np
 import pandas as pd
 
+from lca_index import LCAIndex
+from parquet_io import EntropyFrameWriter, require_pyarrow
+from taxonomy_cache import (
+    TaxonomyArrays,
+    load_taxonomy_arrays,
+    lookup_indices,
+    prune_taxonomy,
+    taxonomy_views,
+)
+
 
 # ----------------------------
 # Default hyperparameters
@@ -57,16 +68,28 @@ DEFAULT_FALLBACK_RANK_WEIGHT = 0.50  # for unranked/odd ranks
 # Taxonomy loading & helpers
 # ----------------------------
 
-def load_taxonomy(nodes_path: str) -> Tuple[Dict[str, str], Dict[str, str], Dict[str, int], Dict[str, int]]:
+def load_taxonomy(nodes_path: str,
+                  cache_dir: Optional[str] = None,
+                  keep_taxids: Optional[Iterable[int]] = None) -> Tuple[Dict[str, str], Dict[str, str], Dict[str, int], Dict[str, int]]:
     """
     Load NCBI taxonomy from nodes.dmp.
 
+    If cache_dir is given, the taxonomy is served from a memory-mapped array cache
+    (see taxonomy_cache.py) and the returned objects are read-only dict-like views.
+    If keep_taxids is given, the taxonomy is pruned to the subtree induced by those taxids
+    and their ancestors; depths and branch sizes still come from the full tree.
+
     Returns:
         parent: taxid -> parent taxid
         rank:   taxid -> rank string
         depth:  taxid -> depth (edges from root)
         branch_size: taxid -> number of children
     """
+    if keep_taxids is not None:
+        return taxonomy_views(prune_taxonomy(load_taxonomy_arrays(nodes_path, cache_dir), keep_taxids))
+    if cache_dir is not None:
+        return taxonomy_views(load_taxonomy_arrays(nodes_path, cache_dir))
+
     parent: Dict[str, str] = {}
     rank: Dict[str, str] = {}
     children: Dict[str, list] = defaultdict(list)
@@ -129,10 +152,13 @@ def lca_features(t1: str,
                  parent: Dict[str, str],
                  depth: Dict[str, int],
                  branch_size: Dict[str, int],
-                 rank: Dict[str, str]) -> Tuple[str, int, int, int, str]:
+                 rank: Dict[str, str],
+                 lca_index: Optional[LCAIndex] = None) -> Tuple[str, int, int, int, str]:
     """
     Compute LCA and geometric features for (t1, t2).
 
+    If lca_index is given, the LCA is answered from the index instead of walking lineages.
+
     Returns:
         L:          LCA taxid
         up:         edges up from t1 to L
@@ -144,6 +170,18 @@ def lca_features(t1: str,
         L = t1
         up = 0
         down = 0
+    elif lca_index is not None:
+        nodes = lca_index.nodes
+        i1 = nodes.index_of(t1)
+        i2 = nodes.index_of(t2)
+        L_idx, up, down = lca_index.distances(i1, i2) if (i1 >= 0 and i2 >= 0) else (-1, 0, 0)
+        if L_idx >= 0:
+            return (str(nodes.taxid[L_idx]), up, down, nodes.branch_size[L_idx],
+                    nodes.rank_names[nodes.rank_code[L_idx]])
+        # Same fallback as the lineage walk: treat t1 as LCA
+        L = t1
+        up = 0
+        down = max(depth.get(t2, 0) - depth.get(L, 0), 0)
     else:
         path1 = lineage_to_root(t1, parent)
         path2 = lineage_to_root(t2, parent)
@@ -199,10 +237,13 @@ def entropy_for_pair(true_taxid: str,
                      rank_weights: Optional[Dict[str, float]] = None,
                      fallback_rank_weight: float = DEFAULT_FALLBACK_RANK_WEIGHT,
                      unclassified_sentinels=None,
-                     unclassified_entropy: Optional[float] = None) -> Optional[float]:
+                     unclassified_entropy: Optional[float] = None,
+                     lca_index: Optional[LCAIndex] = None) -> Optional[float]:
     """
     Compute entropy H(true_taxid, pred_taxid) for a single read.
 
+    Pass lca_index (built from the same taxonomy) to answer the LCA in O(log depth).
+
     Returns:
         H (float) or None if cannot be computed.
     """
@@ -233,7 +274,7 @@ def entropy_for_pair(true_taxid: str,
     if t1 == t2:
         return 0.0
 
-    L, u, d, k, rank_L = lca_features(t1, t2, parent, depth, branch_size, rank)
+    L, u, d, k, rank_L = lca_features(t1, t2, parent, depth, branch_size, rank, lca_index)
 
     branch_H = local_branch_entropy(k)
     if branch_H == 0.0:
@@ -247,6 +288,265 @@ def entropy_for_pair(true_taxid: str,
     return H
 
 
+# ----------------------------
+# Vectorized scoring
+# ----------------------------
+
+MISSING_TAXID = -1   # NaN / None input: entropy is always NA
+INVALID_TAXID = -2   # non-taxid string: never in the taxonomy
+
+
+def taxid_array(values, blank: int = INVALID_TAXID) -> np.ndarray:
+    """
+    Convert taxids (ints, digit strings, or a mix with NaN/None) to an int64 array.
+
+    Mirrors how entropy_for_pair treats its string inputs: NaN/None become MISSING_TAXID,
+    strings that are not canonical taxids become INVALID_TAXID, and the empty string
+    becomes `blank` (pass 0 for predictions, where a blank call means unclassified).
+    """
+    arr = np.asarray(values)
+    if arr.dtype.kind in "iu":
+        return arr.astype(np.int64)
+    if arr.dtype.kind == "f":
+        out = np.full(arr.shape, INVALID_TAXID, dtype=np.int64)
+        finite = np.isfinite(arr)
+        whole = finite & (arr == np.floor(np.where(finite, arr, 0)))
+        out[whole] = arr[whole].astype(np.int64)
+        out[np.isnan(arr)] = MISSING_TAXID
+        return out
+
+    s = pd.Series(arr.ravel(), dtype=object)
+    missing = s.isna().to_numpy()
+    strs = s.where(missing, s.astype(str))
+    canonical = strs.str.fullmatch(r"0|[1-9][0-9]*").fillna(False).to_numpy(dtype=bool)
+
+    out = np.full(len(s), INVALID_TAXID, dtype=np.int64)
+    out[canonical] = strs[canonical].astype(np.int64).to_numpy()
+    out[(strs == "").fillna(False).to_numpy(dtype=bool)] = blank
+    out[missing] = MISSING_TAXID
+    return out.reshape(arr.shape)
+
+
+class PairScores(NamedTuple):
+    """
+    Per-pair results from EntropyScorer.score. Integer diagnostics use -1 and lca_rank
+    uses None where `valid` is False (one of the taxids is not in the taxonomy).
+    """
+    entropy: np.ndarray       # float64, NaN where entropy_for_pair returns None
+    lca_taxid: np.ndarray     # int64
+    lca_rank: np.ndarray      # object (str or None)
+    up: np.ndarray            # int64
+    down: np.ndarray          # int64
+    branch_size: np.ndarray   # int64
+    valid: np.ndarray         # bool
+
+
+class EntropyScorer:
+    """
+    Score arrays of (true, pred) taxid pairs in-process, with the taxonomy loaded once.
+
+    Pairs are deduplicated, each distinct pair is resolved through the LCA index, and
+    rank weight x log2(1 + k) x path penalty is evaluated vectorized. Results match
+    entropy_for_pair / lca_features value for value.
+
+        scorer = EntropyScorer.from_nodes_dmp("nodes.dmp", taxonomy_cache="nodes.cache")
+        scores = scorer.score(df["true_taxid"], df["pred_taxid"])
+    """
+
+    def __init__(self,
+                 arrays: TaxonomyArrays,
+                 lca_index: Optional[LCAIndex] = None,
+                 alpha_up: float = DEFAULT_ALPHA_UP,
+                 alpha_down: float = DEFAULT_ALPHA_DOWN,
+                 rank_weights: Optional[Dict[str, float]] = None,
+                 fallback_rank_weight: float = DEFAULT_FALLBACK_RANK_WEIGHT,
+                 unclassified_entropy: Optional[float] = None):
+        if rank_weights is None:
+            rank_weights = DEFAULT_RANK_WEIGHTS
+
+        self.arrays = arrays
+        self.lca_index = lca_index if lca_index is not None else LCAIndex(arrays)
+        self.alpha_up = alpha_up
+        self.alpha_down = alpha_down
+        self.unclassified_entropy = unclassified_entropy
+        # One extra slot (weight 0, rank None) for pairs with no LCA
+        self.rank_weight_by_code = np.array(
+            [rank_weight(name, rank_weights, fallback_rank_weight) for name in arrays.rank_names] + [0.0],
+            dtype=np.float64,
+        )
+        self._rank_names = np.array(list(arrays.rank_names) + [None], dtype=object)
+
+    @classmethod
+    def from_nodes_dmp(cls, nodes_path: str, taxonomy_cache: Optional[str] = None, **kwargs) -> "EntropyScorer":
+        arrays = load_taxonomy_arrays(nodes_path, taxonomy_cache)
+        return cls(arrays, LCAIndex.load_or_build(arrays, taxonomy_cache), **kwargs)
+
+    def score(self, true_taxids, pred_taxids, memo: Optional["PairMemo"] = None) -> PairScores:
+        """
+        Score equal-length arrays of true and predicted taxids (see taxid_array). With a
+        PairMemo, pairs already scored in earlier calls are looked up instead of recomputed.
+        """
+        t = taxid_array(true_taxids)
+        p = taxid_array(pred_taxids, blank=0)
+        if t.shape != p.shape:
+            raise ValueError(f"true and pred taxid arrays differ in shape: {t.shape} vs {p.shape}")
+
+        # Deduplicate: taxids fit in 31 bits, sentinels are shifted to stay non-negative
+        key = ((t + 2) << 32) | (p + 2)
+        uniq, inverse = np.unique(key, return_inverse=True)
+        if memo is None:
+            res = self.score_unique((uniq >> 32) - 2, (uniq & 0xFFFFFFFF) - 2)
+        else:
+            res = memo.lookup(self, uniq)
+        return PairScores(*(col[inverse.reshape(t.shape)] for col in res))
+
+    def score_unique(self, t: np.ndarray, p: np.ndarray) -> PairScores:
+        """Score already-converted int64 taxid arrays without deduplication."""
+        a = self.arrays
+        n = len(t)
+
+        ti = lookup_indices(a, np.maximum(t, 0))
+        pi = lookup_indices(a, np.maximum(p, 0))
+        ti[t < 0] = -1
+        pi[p < 0] = -1
+
+        missing = (t == MISSING_TAXID) | (p == MISSING_TAXID)
+        unclassified = ~missing & (p == 0)
+        valid = (ti >= 0) & (pi >= 0)
+        scored = valid & ~missing & ~unclassified
+
+        L = np.where(valid, ti, -1)
+        up = np.zeros(n, dtype=np.int64)
+        down = np.zeros(n, dtype=np.int64)
+
+        differ = valid & (t != p)
+        if differ.any():
+            a_idx = ti[differ]
+            b_idx = pi[differ]
+            L_d, up_d, down_d = self.lca_index.distances_many(a_idx, b_idx)
+            # Same fallback as lca_features: no common ancestor -> treat true taxid as LCA
+            orphan = L_d < 0
+            L_d = np.where(orphan, a_idx, L_d)
+            up_d = np.where(orphan, 0, up_d)
+            down_d = np.where(orphan, np.maximum(a.depth[b_idx] - a.depth[a_idx], 0), down_d)
+            L[differ] = L_d
+            up[differ] = up_d
+            down[differ] = down_d
+
+        L_safe = np.where(valid, L, 0)
+        k = np.where(valid, a.branch_size[L_safe], -1).astype(np.int64)
+        rank_code = np.where(valid, a.rank_code[L_safe].astype(np.int64), len(a.rank_names))
+
+        # log2(1 + k) through math.log2 on distinct k keeps results bit-identical
+        k_uniq, k_inv = np.unique(np.maximum(k, 0), return_inverse=True)
+        branch_H = np.array([local_branch_entropy(int(x)) for x in k_uniq], dtype=np.float64)[k_inv]
+        branch_H[branch_H == 0.0] = 1.0
+
+        R = self.rank_weight_by_code[rank_code]
+        path_penalty = self.alpha_up * up + self.alpha_down * down
+        H = R * branch_H * path_penalty
+        H = np.where(differ, H, 0.0)
+
+        entropy = np.full(n, np.nan, dtype=np.float64)
+        entropy[scored] = H[scored]
+        if self.unclassified_entropy is not None:
+            entropy[unclassified] = self.unclassified_entropy
+
+        return PairScores(
+            entropy=entropy,
+            lca_taxid=np.where(valid, a.taxid[L_safe], -1).astype(np.int64),
+            lca_rank=self._rank_names[rank_code],
+            up=np.where(valid, up, -1),
+            down=np.where(valid, down, -1),
+            branch_size=k,
+            valid=valid,
+        )
+
+
+class PairMemo:
+    """
+    Scores of every distinct pair seen so far, keyed like EntropyScorer.score, so a file
+    scored in chunks resolves each (true, pred) LCA once.
+
+    Scores are appended to columns grown by doubling; only the sorted key index (keys and
+    the row of each key) is rebuilt per chunk, by inserting the new keys in place.
+    """
+
+    def __init__(self):
+        self.keys = np.empty(0, dtype=np.int64)   # sorted, distinct
+        self.rows = np.empty(0, dtype=np.int64)   # row of each key in self.columns
+        self.columns: Optional[List[np.ndarray]] = None
+        self.n_rows = 0
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def _append(self, fresh: PairScores) -> np.ndarray:
+        """Append scores to the columns; returns their rows."""
+        n = len(fresh.entropy)
+        if self.columns is None:
+            self.columns = [np.empty(max(n, 1024), dtype=col.dtype) for col in fresh]
+        elif self.n_rows + n > len(self.columns[0]):
+            capacity = max(2 * len(self.columns[0]), self.n_rows + n)
+            grown = [np.empty(capacity, dtype=col.dtype) for col in self.columns]
+            for old, col in zip(self.columns, grown):
+                col[:self.n_rows] = old[:self.n_rows]
+            self.columns = grown
+        for col, f in zip(self.columns, fresh):
+            col[self.n_rows:self.n_rows + n] = f
+        self.n_rows += n
+        return np.arange(self.n_rows - n, self.n_rows, dtype=np.int64)
+
+    def lookup(self, scorer: "EntropyScorer", keys: np.ndarray) -> PairScores:
+        """Scores for sorted, distinct pair keys, scoring only the ones not seen before."""
+        pos = np.searchsorted(self.keys, keys)
+        if len(self.keys):
+            known = (pos < len(self.keys)) & (self.keys[np.minimum(pos, len(self.keys) - 1)] == keys)
+        else:
+            known = np.zeros(len(keys), bool)
+        if self.columns is None or not known.all():
+            new = keys[~known]
+            rows = self._append(scorer.score_unique((new >> 32) - 2, (new & 0xFFFFFFFF) - 2))
+            # new is sorted, so inserting at its positions in the old index keeps it sorted
+            self.keys = np.insert(self.keys, pos[~known], new)
+            self.rows = np.insert(self.rows, pos[~known], rows)
+            pos = np.searchsorted(self.keys, keys)
+        rows = self.rows[pos]
+        return PairScores(*(col[rows] for col in self.columns))
+
+
+# ----------------------------
+# Summaries from (value, count) tables
+# ----------------------------
+
+def count_quantile(values, counts, q: float) -> float:
+    """
+    q-quantile of `values` each repeated `counts` times, without expanding them.
+
+    Uses the same linear interpolation as numpy.quantile / pandas Series.quantile on the
+    expanded values, so results agree with the per-read computation.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    counts = np.asarray(counts, dtype=np.int64)
+    order = np.argsort(values, kind="stable")
+    values = values[order]
+    cum = np.cumsum(counts[order])
+    n = int(cum[-1]) if len(cum) else 0
+    if n == 0:
+        return float("nan")
+
+    pos = q * (n - 1)
+    lo = math.floor(pos)
+    hi = min(lo + 1, n - 1)
+    a, b = np.searchsorted(cum, [lo, hi], side="right")
+    a, b = values[a], values[b]
+    t = pos - lo
+    diff = b - a
+    if t >= 0.5:
+        return float(b - diff * (1 - t))
+    return float(a + diff * t)
+
+
 # ----------------------------
 # I/O and main driver
 # ----------------------------
@@ -264,6 +564,23 @@ def pick_column(df: pd.DataFrame, candidates) -> str:
                      f"Available columns: {list(df.columns)}")
 
 
+def nullable_int_column(values: np.ndarray, valid: np.ndarray) -> np.ndarray:
+    """Int column with NA where not valid, typed the way pandas types a list of ints/None."""
+    if valid.all():
+        return values
+    return np.where(valid, values, np.nan)
+
+
+def streamed_int_column(values: np.ndarray, valid: np.ndarray):
+    """
+    Nullable Int64 column for --chunk-size output: NA is written as a blank and valid
+    values as integers in every chunk, whatever its mix of valid pairs.
+    """
+    column = pd.array(values, dtype="Int64")
+    column[~valid] = pd.NA
+    return column
+
+
 def main():
     parser = argparse.ArgumentParser(description="Compute taxonomy entropy for true/predicted taxid pairs.")
     parser.add_argument("--nodes-dmp", required=True,
@@ -279,94 +596,95 @@ def main():
     parser.add_argument("--unclassified-entropy", type=float, default=None,
                         help="Entropy value to assign when prediction is unclassified (taxid 0/blank). "
                              "Default: None (leave entropy as NA).")
+    parser.add_argument("--taxonomy-cache", default=None,
+                        help="Directory of a compiled taxonomy cache (see taxonomy_cache.py). "
+                             "Compiled on first use and recompiled when nodes.dmp changes.")
+    parser.add_argument("--chunk-size", type=int, default=0,
+                        help="Stream the input in chunks of this many rows with bounded memory, appending "
+                             "each to the output; distinct pairs are scored once across chunks. Integer "
+                             "diagnostics of invalid pairs are written as blanks. Default 0: read it whole.")
+    parser.add_argument("--format", choices=("tsv", "parquet"), default="tsv",
+                        help="Output format. parquet (needs pyarrow) writes typed, zstd-compressed columns; "
+                             "read it back with parquet_io.read_entropy_table.")
 
     args = parser.parse_args()
+    if args.format == "parquet":
+        try:
+            require_pyarrow()
+        except RuntimeError as e:
+            raise SystemExit(str(e))
 
     print(f"Loading taxonomy from: {args.nodes_dmp}")
-    parent, rank, depth, branch_size = load_taxonomy(args.nodes_dmp)
-    print(f"Loaded {len(parent)} taxonomy nodes.")
+    arrays = load_taxonomy_arrays(args.nodes_dmp, args.taxonomy_cache)
+    lca_index = LCAIndex.load_or_build(arrays, args.taxonomy_cache)
+    print(f"Loaded {len(arrays.taxid)} taxonomy nodes.")
+
+    scorer = EntropyScorer(
+        arrays,
+        lca_index,
+        alpha_up=args.alpha_up,
+        alpha_down=args.alpha_down,
+        unclassified_entropy=args.unclassified_entropy,
+    )
 
     print(f"Reading input TSV: {args.input_tsv}")
-    df = pd.read_csv(args.input_tsv, sep="\t", dtype=str)
-
-    read_col = pick_column(df, READID_CANDIDATES)
-    true_col = pick_column(df, TRUE_TAXID_CANDIDATES)
-    pred_col = pick_column(df, PRED_TAXID_CANDIDATES)
-
-    print(f"Using columns: read_id={read_col}, true_taxid={true_col}, pred_taxid={pred_col}")
-
-    entropies = []
-    lca_taxids = []
-    ups = []
-    downs = []
-    lca_ranks = []
-    branch_sizes = []
-
-    for idx, row in df.iterrows():
-        t1 = row[true_col]
-        t2 = row[pred_col]
-
-        # Compute entropy
-        H = entropy_for_pair(
-            true_taxid=t1,
-            pred_taxid=t2,
-            parent=parent,
-            rank=rank,
-            depth=depth,
-            branch_size=branch_size,
-            alpha_up=args.alpha_up,
-            alpha_down=args.alpha_down,
-            unclassified_entropy=args.unclassified_entropy,
-        )
-        entropies.append(H)
+    if args.chunk_size > 0:
+        chunks = pd.read_csv(args.input_tsv, sep="\t", dtype=str, chunksize=args.chunk_size)
+    else:
+        chunks = iter([pd.read_csv(args.input_tsv, sep="\t", dtype=str)])
 
-        # Compute LCA-related diagnostics only when both taxids are in taxonomy
-        L = None
-        u = None
-        d = None
-        k = None
-        rank_L = None
-
-        if isinstance(t1, str) and isinstance(t2, str) and (t1 in parent) and (t2 in parent):
-            if t1 == t2:
-                L = t1
-                u = 0
-                d = 0
-                k = branch_size.get(t1, 0)
-                rank_L = rank.get(t1, "no_rank")
-            else:
-                L, u, d, k, rank_L = lca_features(t1, t2, parent, depth, branch_size, rank)
-
-        lca_taxids.append(L)
-        ups.append(u)
-        downs.append(d)
-        lca_ranks.append(rank_L)
-        branch_sizes.append(k)
-
-    df_out = df.copy()
-    df_out["entropy"] = entropies
-    df_out["lca_taxid"] = lca_taxids
-    df_out["lca_rank"] = lca_ranks
-    df_out["up_from_true"] = ups
-    df_out["down_to_pred"] = downs
-    df_out["branch_size_LCA"] = branch_sizes
-
-    print(f"Writing per-read entropy to: {args.output_tsv}")
-    df_out.to_csv(args.output_tsv, sep="\t", index=False)
-
-    # Simple summary
+    memo = PairMemo()
+    entropy_counts: Dict[float, int] = defaultdict(int)
+    int_column = nullable_int_column if args.chunk_size <= 0 else streamed_int_column
+    writer = None
+    n_chunks = 0
     try:
-        valid = df_out["entropy"].dropna().astype(float)
-    except Exception:
-        valid = pd.Series([], dtype=float)
-
-    if len(valid) > 0:
+        for df in chunks:
+            if n_chunks == 0:
+                read_col = pick_column(df, READID_CANDIDATES)
+                true_col = pick_column(df, TRUE_TAXID_CANDIDATES)
+                pred_col = pick_column(df, PRED_TAXID_CANDIDATES)
+                print(f"Using columns: read_id={read_col}, true_taxid={true_col}, pred_taxid={pred_col}")
+                print(f"Writing per-read entropy to: {args.output_tsv}")
+                if args.format == "parquet":
+                    writer = EntropyFrameWriter(args.output_tsv)
+
+            scores = scorer.score(df[true_col].to_numpy(dtype=object), df[pred_col].to_numpy(dtype=object), memo)
+
+            df_out = df.copy()
+            df_out["entropy"] = scores.entropy
+            df_out["lca_taxid"] = np.where(scores.valid, scores.lca_taxid.astype(str), None)
+            df_out["lca_rank"] = scores.lca_rank
+            df_out["up_from_true"] = int_column(scores.up, scores.valid)
+            df_out["down_to_pred"] = int_column(scores.down, scores.valid)
+            df_out["branch_size_LCA"] = int_column(scores.branch_size, scores.valid)
+
+            if writer is not None:
+                writer.write(df_out)
+            else:
+                df_out.to_csv(args.output_tsv, sep="\t", index=False, mode="a" if n_chunks else "w",
+                              header=not n_chunks)
+            n_chunks += 1
+
+            entropy = scores.entropy[~np.isnan(scores.entropy)]
+            values, counts = np.unique(entropy, return_counts=True)
+            for v, c in zip(values.tolist(), counts.tolist()):
+                entropy_counts[v] += c
+    finally:
+        if writer is not None:
+            writer.close()
+
+    # Simple summary, from (value, count) so it does not depend on chunking
+    if entropy_counts:
+        values = list(entropy_counts)
+        counts = [entropy_counts[v] for v in values]
+        n = sum(counts)
         print("Entropy summary (valid pairs only):")
-        print(f"  n = {len(valid)}")
-        print(f"  mean = {valid.mean():.4f}")
-        print(f"  median = {valid.median():.4f}")
-        print(f"  min = {valid.min():.4f}")
-        print(f"  max = {valid.max():.4f}")
+        print(f"  n = {n}")
+        print(f"  mean = {math.fsum(v * c for v, c in zip(values, counts)) / n:.4f}")
+        print(f"  median = {count_quantile(values, counts, 0.5):.4f}")
+        print(f"  min = {min(values):.4f}")
+        print(f"  max = {max(values):.4f}")
     else:
         print("No valid entropy values computed (check taxids and input columns).")
 
@@ -2,70 +2,93 @@
 from __future__ import annotations
 
 import argparse
-import gzip
+import contextlib
+import itertools
+import json
+import math
 import multiprocessing as mp
 import os
 import re
+import shutil
+import sys
+import time
+from collections import Counter
+from operator import itemgetter
 from pathlib import Path
 from typing import Dict, Tuple, Optional, List
 
 # Import your existing code (file must be named weighted_entropy.py)
 from weighted_entropy import (
-    load_taxonomy,
-    lineage_to_root,
+    count_quantile,
     local_branch_entropy,
     rank_weight,
     DEFAULT_RANK_WEIGHTS,
     DEFAULT_FALLBACK_RANK_WEIGHT,
 )
+from batch_manifest import (
+    MANIFEST_NAME,
+    append_manifest,
+    input_signature,
+    is_up_to_date,
+    load_manifest,
+    taxids_digest,
+    tmp_path_for,
+)
+from batch_shards import MISSING_KEY_NAME, parse_shard, reduce_main, select_shard, write_shard_plan
+from entropy_counts import counts_header, format_counts_rows
+from entropy_sketch import ValueSketch, sketch_path_for, write_sketches
+from codec_io import BACKENDS, CODECS, ISAL_MAX_LEVEL, SUFFIX_FOR_CODEC, codec_for_path, open_binary, resolve_backend
+from kraken_io import PredTaxidParser, RangeReader, iter_kraken_blocks, newline_aligned_ranges
+from lca_index import LCAIndex
+from parquet_io import EntropyParquetWriter, concat_parquet, require_pyarrow
+from stage_timing import (
+    STATS_KEYS,
+    StageTimer,
+    TimedReader,
+    count_distinct_preds,
+    format_stats,
+    merge_stats,
+    peak_rss_mb,
+    profile_call,
+    trace_record,
+)
+from taxonomy_cache import load_taxonomy_arrays, prune_taxonomy, read_taxid_file
+from truth_keys import TruthJoin, key_path_for, key_taxids
 
 # ----------------------------
 # Globals for worker processes
 # ----------------------------
-PARENT = None
-RANK = None
-DEPTH = None
-BRANCH_SIZE = None
-
-FNAME_RE = re.compile(r"^(?P<dataset>[^_]+)_(?P<filename>.+)_db(?P<db>\d+)\.out(?:\.gz)?$")
-TAXID_RE = re.compile(r"taxid\s+(\d+)")
-
+TAXONOMY = None
+LCA_INDEX = None
 
-def open_text(path: str, mode: str, compresslevel: int = 3):
-    if path.endswith(".gz"):
-        return gzip.open(path, mode, compresslevel=compresslevel)
-    return open(path, mode)
+# Distinct (true, pred) rows kept per file when truth comes from a per-read key
+PAIR_CACHE_SIZE = 1 << 16
 
+FNAME_RE = re.compile(r"^(?P<dataset>[^_]+)_(?P<filename>.+)_db(?P<db>\d+)\.out(?:\.gz|\.zst)?$")
+DB_RE = re.compile(r"_db(?P<db>\d+)\.out(?:\.gz|\.zst)?$")
 
-def init_worker(nodes_dmp: str):
-    """Load taxonomy once per worker (fork shares memory on Linux; spawn loads per worker)."""
-    global PARENT, RANK, DEPTH, BRANCH_SIZE
-    if PARENT is None:
-        PARENT, RANK, DEPTH, BRANCH_SIZE = load_taxonomy(nodes_dmp)
 
-
-def parse_pred_taxid(field3: str, status: str) -> str:
-    """Extract predicted taxid from Kraken field 3 (which may be numeric or 'Name (taxid N)')."""
-    if status == "U":
-        return "0"
-    s = (field3 or "").strip()
-    if not s:
-        return "0"
-    if s.isdigit():
-        return s
-    m = TAXID_RE.search(s)
-    if m:
-        return m.group(1)
-    # If you truly used --use-names without taxid in the field, you won't be able to recover taxid here.
-    return "0"
+def init_worker(nodes_dmp: str, taxonomy_cache: Optional[str] = None, keep_taxids: Optional[List[int]] = None):
+    """
+    Load taxonomy once per worker (fork shares memory on Linux; spawn loads per worker).
+    With a taxonomy cache, spawned workers memory-map the same pages instead of re-parsing.
+    With keep_taxids, only the subtree induced by those taxids (plus ancestors) is kept.
+    """
+    global TAXONOMY, LCA_INDEX
+    if TAXONOMY is None:
+        TAXONOMY = load_taxonomy_arrays(nodes_dmp, taxonomy_cache)
+        if keep_taxids is not None:
+            TAXONOMY = prune_taxonomy(TAXONOMY, keep_taxids)
+            LCA_INDEX = LCAIndex(TAXONOMY)
+        else:
+            LCA_INDEX = LCAIndex.load_or_build(TAXONOMY, taxonomy_cache)
 
 
 def compute_cached_for_pred(
     true_taxid: str,
     pred_taxid: str,
     cache: Dict[str, Tuple[Optional[float], str, str, Optional[int], Optional[int], Optional[int]]],
-    true_lineage_set: set,
-    true_depth: int,
+    true_idx: int,
     alpha_up: float,
     alpha_down: float,
     unclassified_entropy: Optional[float],
@@ -73,12 +96,11 @@ def compute_cached_for_pred(
 ):
     """
     Cache results by pred_taxid (true_taxid constant for the file).
+    true_idx is the taxonomy node index of true_taxid (-1 if absent).
 
     Returns:
       (entropy, lca_taxid, lca_rank, up_from_true, down_to_pred, branch_size_LCA)
     """
-    global PARENT, RANK, DEPTH, BRANCH_SIZE
-
     if pred_taxid in cache:
         return cache[pred_taxid]
 
@@ -87,35 +109,30 @@ def compute_cached_for_pred(
         cache[pred_taxid] = res
         return res
 
-    if (true_taxid not in PARENT) or (pred_taxid not in PARENT):
+    nodes = LCA_INDEX.nodes
+    pred_idx = nodes.index_of(pred_taxid)
+    if true_idx < 0 or pred_idx < 0:
         res = (None, "", "", None, None, None)
         cache[pred_taxid] = res
         return res
 
     if true_taxid == pred_taxid:
-        k = BRANCH_SIZE.get(true_taxid, 0)
-        rank_L = RANK.get(true_taxid, "no_rank")
+        k = nodes.branch_size[true_idx]
+        rank_L = nodes.rank_names[nodes.rank_code[true_idx]]
         res = (0.0, true_taxid, rank_L, 0, 0, k)
         cache[pred_taxid] = res
         return res
 
-    # LCA: walk pred lineage until it hits true lineage set
-    L = ""
-    for node in lineage_to_root(pred_taxid, PARENT):
-        if node in true_lineage_set:
-            L = node
-            break
-    if not L:
-        L = true_taxid
+    L_idx, u, d = LCA_INDEX.distances(true_idx, pred_idx)
+    if L_idx < 0:
+        # No common ancestor: treat true taxid as LCA
+        L_idx = true_idx
+        u = 0
+        d = max(nodes.depth[pred_idx] - nodes.depth[true_idx], 0)
 
-    depth_L = DEPTH.get(L, 0)
-    depth_pred = DEPTH.get(pred_taxid, 0)
-
-    u = max(true_depth - depth_L, 0)
-    d = max(depth_pred - depth_L, 0)
-
-    k = BRANCH_SIZE.get(L, 0)
-    rank_L = RANK.get(L, "no_rank")
+    L = str(nodes.taxid[L_idx])
+    k = nodes.branch_size[L_idx]
+    rank_L = nodes.rank_names[nodes.rank_code[L_idx]]
 
     branch_H = local_branch_entropy(k)
     if branch_H == 0.0:
@@ -156,9 +173,12 @@ def load_key(key_path: str) -> Dict[Tuple[str, str], str]:
     return mapping
 
 
-def discover_jobs(kraken_dir: str, key_map: Dict[Tuple[str, str], str], recursive: bool):
+def discover_jobs(kraken_dir: str, key_map: Dict[Tuple[str, str], str], recursive: bool,
+                  truth_key_dir: Optional[str] = None):
     """
-    Scan kraken_dir for *_dbN.out(.gz), parse dataset+filename, look up true taxid in key_map.
+    Scan kraken_dir for *_dbN.out(.gz|.zst), parse dataset+filename, look up true taxid in key_map.
+    With truth_key_dir, files missing from key_map (e.g. mixtures with no single true taxid)
+    are still scored if they have a per-read key there; their true_taxid is blank.
     Returns list of dict jobs and list of missing_key filenames.
     """
     p = Path(kraken_dir)
@@ -171,28 +191,35 @@ def discover_jobs(kraken_dir: str, key_map: Dict[Tuple[str, str], str], recursiv
         if not fp.is_file():
             continue
         name = fp.name
-        if not (name.endswith(".out") or name.endswith(".out.gz")):
+        if not name.endswith((".out", ".out.gz", ".out.zst")):
             continue
 
         m = FNAME_RE.match(name)
-        if not m:
-            continue
-
-        dataset = m.group("dataset")
-        filename = m.group("filename")
-        db = m.group("db")
-
-        taxid = key_map.get((dataset, filename))
+        taxid = key_map.get((m.group("dataset"), m.group("filename"))) if m else None
         if taxid is None:
-            missing_key.append(str(fp))
+            m_db = DB_RE.search(name)
+            key_path = key_path_for(str(fp), truth_key_dir) if truth_key_dir and m_db else None
+            if key_path:
+                jobs.append(
+                    {
+                        "path": str(fp),
+                        "dataset": m.group("dataset") if m else "",
+                        "filename": m.group("filename") if m else name[:m_db.start()],
+                        "db": m_db.group("db"),
+                        "true_taxid": "",
+                        "key_path": key_path,
+                    }
+                )
+            elif m:
+                missing_key.append(str(fp))
             continue
 
         jobs.append(
             {
                 "path": str(fp),
-                "dataset": dataset,
-                "filename": filename,
-                "db": db,
+                "dataset": m.group("dataset"),
+                "filename": m.group("filename"),
+                "db": m.group("db"),
                 "true_taxid": taxid,
             }
         )
@@ -203,13 +230,15 @@ def discover_jobs(kraken_dir: str, key_map: Dict[Tuple[str, str], str], recursiv
 def read_jobs_tsv(path: str) -> List[Dict[str, str]]:
     """
     Read a 2-column TSV: kraken_out_path<TAB>true_taxid
+    An optional 3rd column gives a per-read truth key (*_key_final.txt) for mixed samples;
+    true_taxid is then ignored and may be left blank.
     Returns list of job dicts compatible with process_one().
     """
     jobs: List[Dict[str, str]] = []
     with open(path, "r") as f:
         for line in f:
-            line = line.strip()
-            if not line or line.startswith("#"):
+            line = line.rstrip("\r\n")
+            if not line.strip() or line.startswith("#"):
                 continue
             parts = line.split("\t")
             if len(parts) < 2:
@@ -217,6 +246,7 @@ def read_jobs_tsv(path: str) -> List[Dict[str, str]]:
 
             kraken_path = parts[0].strip()
             true_taxid = parts[1].strip()
+            key_path = parts[2].strip() if len(parts) > 2 else ""
 
             name = Path(kraken_path).name
             m = FNAME_RE.match(name)
@@ -240,106 +270,530 @@ def read_jobs_tsv(path: str) -> List[Dict[str, str]]:
                         "true_taxid": true_taxid,
                     }
                 )
+            if key_path:
+                jobs[-1]["key_path"] = key_path
     return jobs
 
 
+DIAG_HEADER = (
+    b"read_id\ttrue_taxid\tpred_taxid\tentropy\tlca_taxid\tlca_rank\tup_from_true\tdown_to_pred\tbranch_size_LCA\n"
+)
+PLAIN_HEADER = b"read_id\ttrue_taxid\tpred_taxid\tentropy\n"
+
+
+def summarize_pred_stats(pred_stats: Dict[str, Tuple[int, Optional[float]]]) -> Tuple[int, int, str]:
+    """
+    (n_reads, n_valid, mean_entropy) from per-pred (read count, entropy).
+
+    The mean is an exactly rounded sum over distinct preds, so it does not depend on
+    read order or on how a file was split across workers.
+    """
+    n_reads = 0
+    n_valid = 0
+    weighted = []
+    for count, H in pred_stats.values():
+        n_reads += count
+        if H is not None:
+            n_valid += count
+            weighted.append(H * count)
+    mean_entropy = "" if n_valid == 0 else str(math.fsum(weighted) / n_valid)
+    return n_reads, n_valid, mean_entropy
+
+
+QUANTILES = (("q25_entropy", 0.25), ("median_entropy", 0.5), ("q75_entropy", 0.75))
+
+
+def entropy_quantiles(pred_stats: Dict[str, Tuple[int, Optional[float]]]) -> Dict[str, str]:
+    """Exact per-read entropy quantiles (valid reads only) from per-pred (read count, entropy)."""
+    valid = [(H, count) for count, H in pred_stats.values() if H is not None]
+    if not valid:
+        return {name: "" for name, _ in QUANTILES}
+    values, counts = zip(*valid)
+    return {name: str(count_quantile(values, counts, q)) for name, q in QUANTILES}
+
+
 def process_one(job):
     """
     job contains: path, dataset, filename, db, true_taxid, out_path, params...
-    """
-    global PARENT, RANK, DEPTH, BRANCH_SIZE
 
+    If job has a byte_range, only that slice of the (uncompressed) input is scored and the
+    rows are written, without header, to job["part_path"]; see split_task / finalize_parts.
+    Otherwise the output is written to a temp file and renamed into place on success.
+
+    The result carries per-stage wall/CPU times, pred-cache hits, byte counts and peak RSS
+    (see stage_timing.py).
+    """
+    timer = StageTimer()
     path = job["path"]
     true_taxid = str(job["true_taxid"]).strip()
     out_path = job["out_path"]
+    byte_range = job.get("byte_range")
+    dest_path = job["part_path"] if byte_range else tmp_path_for(out_path)
 
     alpha_up = job["alpha_up"]
     alpha_down = job["alpha_down"]
     unclassified_entropy = job["unclassified_entropy"]
     write_diag = job["write_diag"]
     compresslevel = job["compresslevel"]
-    skip_existing = job["skip_existing"]
+    codec = job["codec"]
+    codec_backend = job["codec_backend"]
+    compress_threads = job["compress_threads"]
+    parquet = job.get("format") == "parquet"
+    aggregate = job.get("aggregate", False)
 
-    if skip_existing and os.path.exists(out_path) and os.path.getsize(out_path) > 0:
-        return {**job, "status": "skipped_existing", "n_reads": 0, "n_valid": 0, "mean_entropy": ""}
-
-    # Precompute true lineage
-    if true_taxid in PARENT:
-        true_lineage_set = set(lineage_to_root(true_taxid, PARENT))
-        true_depth = DEPTH.get(true_taxid, 0)
-    else:
-        true_lineage_set = set()
-        true_depth = 0
+    true_idx = LCA_INDEX.nodes.index_of(true_taxid)
 
     unclassified_sentinels = {"0", "", "NA", "None", None}
 
     cache: Dict[str, Tuple[Optional[float], str, str, Optional[int], Optional[int], Optional[int]]] = {}
 
+    # pred_taxid bytes -> (encoded row after read_id, or Parquet pred code; entropy)
+    row_cache: Dict[bytes, Tuple[object, Optional[float]]] = {}
+    pred_counts: Counter = Counter()
+    parse_pred = PredTaxidParser()
+    truth = None
+    # Parquet pred code of each (true, pred), kept apart from the bounded row caches so a
+    # re-scored pair reuses its code instead of adding a pred row
+    pred_codes: Dict[Tuple[str, str], int] = {}
+
+    def score_row(true_taxid: str, true_idx: int, pred_b: bytes, cache) -> Tuple[object, Optional[float]]:
+        prev = timer.switch("score")
+        pred_taxid = pred_b.decode()
+        H, L, rank_L, u, d, k = compute_cached_for_pred(
+            true_taxid=true_taxid,
+            pred_taxid=pred_taxid,
+            cache=cache,
+            true_idx=true_idx,
+            alpha_up=alpha_up,
+            alpha_down=alpha_down,
+            unclassified_entropy=unclassified_entropy,
+            unclassified_sentinels=unclassified_sentinels,
+        )
+        ent_str = "" if H is None else str(H)
+        if parquet:
+            payload = pred_codes.get((true_taxid, pred_taxid))
+            if payload is None:
+                payload = pred_codes[true_taxid, pred_taxid] = fout.add_pred(
+                    true_taxid, pred_taxid, H, L, rank_L, u, d, k
+                )
+        elif write_diag:
+            payload = (
+                f"\t{true_taxid}\t{pred_taxid}\t{ent_str}\t{L}\t{rank_L}\t"
+                f"{'' if u is None else u}\t{'' if d is None else d}\t{'' if k is None else k}\n"
+            ).encode()
+        else:
+            payload = f"\t{true_taxid}\t{pred_taxid}\t{ent_str}\n".encode()
+        timer.switch(prev)
+        return payload, None if H is None else float(H)
+
+    # Per-read truth: rows are keyed by (true, pred) bytes in a bounded dict; when it is
+    # full, the older half is dropped
+    pair_cache_size = job.get("pair_cache_size") or PAIR_CACHE_SIZE
+    pair_rows: Dict[Tuple[bytes, bytes], Tuple[object, Optional[float]]] = {}
+    pair_misses = 0
+
+    def score_pair(pair: Tuple[bytes, bytes]) -> Tuple[object, Optional[float]]:
+        nonlocal pair_misses
+        row = pair_rows.get(pair)
+        if row is None:
+            pair_misses += 1
+            if len(pair_rows) >= pair_cache_size:
+                for old in list(itertools.islice(pair_rows, len(pair_rows) // 2 + 1)):
+                    del pair_rows[old]
+            t = pair[0].decode()
+            row = pair_rows[pair] = score_row(t, LCA_INDEX.nodes.index_of(t), pair[1], {})
+        return row
+
     n_reads = 0
-    n_valid = 0
-    sum_entropy = 0.0
+    codec_in = ""
+    codec_out = ""
+    cache_hits = 0
+    reader = None
 
     try:
-        with open_text(path, "rt") as fin, open_text(out_path, "wt", compresslevel=compresslevel) as fout:
-            if write_diag:
-                fout.write(
-                    "read_id\ttrue_taxid\tpred_taxid\tentropy\tlca_taxid\tlca_rank\tup_from_true\tdown_to_pred\tbranch_size_LCA\n"
-                )
+        with contextlib.ExitStack() as stack:
+            fin, codec_in = open_binary(path, "rb")
+            stack.enter_context(fin)
+            if byte_range:
+                fin = RangeReader(fin, *byte_range)
+            fin = reader = TimedReader(fin, timer)
+            if aggregate:
+                fout = None  # one row per pred, written at the end
+            elif parquet:
+                fout = EntropyParquetWriter(dest_path, write_diag, codec=codec, level=compresslevel)
+                codec_out = fout.label
             else:
-                fout.write("read_id\ttrue_taxid\tpred_taxid\tentropy\n")
-
-            for line in fin:
-                if not line.strip():
-                    continue
-                # Split only first 3 fields; last field is huge and not needed
-                parts = line.rstrip("\n").split("\t", 3)
-                if len(parts) < 3:
+                fout, codec_out = open_binary(
+                    dest_path, "wb", codec=codec, backend=codec_backend, level=compresslevel, threads=compress_threads
+                )
+            if fout is not None:
+                stack.enter_context(fout)
+
+            if not byte_range and not parquet and not aggregate:
+                fout.write(DIAG_HEADER if write_diag else PLAIN_HEADER)
+
+            if job.get("key_path"):
+                truth = TruthJoin(job["key_path"])
+                stack.callback(truth.close)
+
+            timer.switch("parse")
+            for records in iter_kraken_blocks(fin):
+                out_rows = []
+                block_preds = []
+                if truth is not None:
+                    read_ids = list(map(itemgetter(1), records))
+                    trues = truth.lookup(read_ids)
+                    block_preds = list(zip(trues, parse_pred.parse_block(records)))
+                    rows = list(map(pair_rows.get, block_preds))
+                    if None in rows:
+                        rows = [r if r is not None else score_pair(p) for r, p in zip(rows, block_preds)]
+                    out_rows = [None] * (2 * len(records))
+                    out_rows[0::2] = read_ids
+                    out_rows[1::2] = list(map(itemgetter(0), rows))
+                else:
+                    for status, read_id, field3 in records:
+                        pred_b = parse_pred(field3, status)
+                        cached = row_cache.get(pred_b)
+                        if cached is None:
+                            cached = score_row(true_taxid, true_idx, pred_b, cache)
+                            row_cache[pred_b] = cached
+
+                        out_rows.append(read_id)
+                        out_rows.append(cached[0])
+                        block_preds.append(pred_b)
+
+                n_reads += len(records)
+                pred_counts.update(block_preds)
+                if aggregate:
                     continue
+                with timer.stage("write"):
+                    if parquet:
+                        fout.write_rows(out_rows[0::2], out_rows[1::2])
+                    else:
+                        fout.write(b"".join(out_rows))
+
+            # Closing the output flushes the compressor
+            timer.switch("write")
+
+        timer.switch("finalize")
+        if truth is None:
+            cache_hits = n_reads - len(row_cache)
+            row_of, key_str = row_cache.__getitem__, bytes.decode
+        else:
+            cache_hits = n_reads - pair_misses
+            row_of, key_str = score_pair, lambda key: (key[0] + b"\t" + key[1]).decode()
+        pred_stats = {key_str(key): (count, row_of(key)[1]) for key, count in pred_counts.items()}
+        pred_rows = {key_str(key): row_of(key)[0] for key in pred_counts} if aggregate else None
+
+        if not byte_range:
+            if aggregate:
+                codec_out = write_counts_table(dest_path, job, pred_stats, pred_rows)
+            os.replace(dest_path, out_path)
+
+        n_reads, n_valid, mean_entropy = summarize_pred_stats(pred_stats)
+        result = {
+            **job,
+            "status": "ok",
+            "n_reads": n_reads,
+            "n_valid": n_valid,
+            "mean_entropy": mean_entropy,
+            **entropy_quantiles(pred_stats),
+            "codec_in": codec_in,
+            "codec_out": codec_out,
+            "pred_stats": pred_stats,
+            "pred_rows": pred_rows,
+            "n_missing_truth": truth.n_missing if truth else 0,
+            "n_unmatched_key": truth.n_unmatched_key if truth else 0,
+            "n_distinct_pred": count_distinct_preds(pred_stats),
+            "bytes_out": output_size(dest_path if byte_range else out_path),
+        }
 
-                status = parts[0]
-                read_id = parts[1]
-                pred_taxid = parse_pred_taxid(parts[2], status=status)
-
-                n_reads += 1
-
-                H, L, rank_L, u, d, k = compute_cached_for_pred(
-                    true_taxid=true_taxid,
-                    pred_taxid=pred_taxid,
-                    cache=cache,
-                    true_lineage_set=true_lineage_set,
-                    true_depth=true_depth,
-                    alpha_up=alpha_up,
-                    alpha_down=alpha_down,
-                    unclassified_entropy=unclassified_entropy,
-                    unclassified_sentinels=unclassified_sentinels,
-                )
+    except Exception as e:
+        with contextlib.suppress(OSError):
+            os.remove(dest_path)
+        result = {
+            **job,
+            "status": f"error: {e}",
+            "n_reads": n_reads,
+            "n_valid": "",
+            "mean_entropy": "",
+            "codec_in": codec_in,
+            "codec_out": codec_out,
+        }
+
+    result.update(
+        timer.stats(),
+        cache_hits=cache_hits,
+        cache_lookups=n_reads,
+        bytes_in=task_size(job),
+        bytes_decoded=reader.n_bytes if reader is not None else 0,
+        peak_rss_mb=peak_rss_mb(),
+        pid=os.getpid(),
+    )
+    return result
 
-                ent_str = "" if H is None else str(H)
-                if H is not None:
-                    try:
-                        sum_entropy += float(H)
-                        n_valid += 1
-                    except Exception:
-                        pass
-
-                if write_diag:
-                    fout.write(
-                        f"{read_id}\t{true_taxid}\t{pred_taxid}\t{ent_str}\t{L}\t{rank_L}\t"
-                        f"{'' if u is None else u}\t{'' if d is None else d}\t{'' if k is None else k}\n"
-                    )
-                else:
-                    fout.write(f"{read_id}\t{true_taxid}\t{pred_taxid}\t{ent_str}\n")
 
-        mean_entropy = "" if n_valid == 0 else str(sum_entropy / n_valid)
-        return {**job, "status": "ok", "n_reads": n_reads, "n_valid": n_valid, "mean_entropy": mean_entropy}
+def output_size(path: str) -> int:
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def run_task(job):
+    """process_one, under cProfile if the job was selected with --profile."""
+    if job.get("profile_dir"):
+        return profile_call(process_one, job, job["profile_dir"])
+    return process_one(job)
+
+
+def write_counts_table(path: str, task, pred_stats, pred_rows) -> str:
+    """Write the aggregated (one row per pred_taxid) table of a task; returns the codec label."""
+    fout, codec_out = open_binary(
+        path,
+        "wb",
+        codec=task["codec"],
+        backend=task["codec_backend"],
+        level=task["compresslevel"],
+        threads=task["compress_threads"],
+    )
+    with fout:
+        fout.write(counts_header(DIAG_HEADER if task["write_diag"] else PLAIN_HEADER))
+        fout.write(format_counts_rows(pred_stats, pred_rows))
+    return codec_out
+
+
+def split_task(task, split_bytes: int) -> List[dict]:
+    """
+    Split a task on an oversized, uncompressed input into newline-aligned byte ranges that
+    workers score independently. Returns [task] when the input should not be split.
+    """
+    path = task["path"]
+    out_path = task["out_path"]
+    if split_bytes <= 0 or codec_for_path(path) != "plain" or task.get("key_path"):
+        return [task]
+    try:
+        if os.path.getsize(path) <= split_bytes:
+            return [task]
+        ranges = newline_aligned_ranges(path, split_bytes)
+    except OSError:
+        # Let process_one report the problem
+        return [task]
+    if len(ranges) < 2:
+        return [task]
+
+    return [
+        {**task, "byte_range": r, "part_index": i, "part_path": f"{out_path}.part{i:05d}"}
+        for i, r in enumerate(ranges)
+    ]
+
+
+def finalize_parts(task, part_results: List[dict]) -> dict:
+    """
+    Concatenate the partial outputs of a split task, in order, behind a single header and
+    merge their per-pred counts into one summary result.
 
+    Plain outputs are byte-identical to the serial path. Compressed parts are independent
+    gzip members / zstd frames, so the concatenation decompresses to the identical bytes.
+    Parquet parts are merged row group by row group; aggregated tasks write no parts and
+    only merge the per-pred counts.
+    """
+    timer = StageTimer("finalize")
+    part_results = sorted(part_results, key=lambda r: r["part_index"])
+    parts = [r["part_path"] for r in part_results]
+    codec_in = part_results[0].get("codec_in", "")
+    codec_out = part_results[0].get("codec_out", "")
+
+    errors = [r["status"] for r in part_results if r["status"] != "ok"]
+    tmp_path = tmp_path_for(task["out_path"])
+    try:
+        if errors:
+            raise RuntimeError(f"part {errors[0]}")
+
+        merged: Dict[str, Tuple[int, Optional[float]]] = {}
+        for r in part_results:
+            for pred, (count, H) in r["pred_stats"].items():
+                prev = merged.get(pred)
+                merged[pred] = (count + (prev[0] if prev else 0), H)
+
+        if task.get("aggregate"):
+            pred_rows = {}
+            for r in part_results:
+                pred_rows.update(r["pred_rows"])
+            codec_out = write_counts_table(tmp_path, task, merged, pred_rows)
+        elif task.get("format") == "parquet":
+            codec_out = concat_parquet(parts, tmp_path, codec=task["codec"], level=task["compresslevel"])
+        else:
+            fout, codec_out = open_binary(
+                tmp_path,
+                "wb",
+                codec=task["codec"],
+                backend=task["codec_backend"],
+                level=task["compresslevel"],
+                threads=task["compress_threads"],
+            )
+            with fout:
+                fout.write(DIAG_HEADER if task["write_diag"] else PLAIN_HEADER)
+            with open(tmp_path, "ab") as out:
+                for part in parts:
+                    with open(part, "rb") as f:
+                        shutil.copyfileobj(f, out, 1 << 22)
+        os.replace(tmp_path, task["out_path"])
+
+        n_reads, n_valid, mean_entropy = summarize_pred_stats(merged)
+        result = {**task, "status": "ok", "n_reads": n_reads, "n_valid": n_valid, "mean_entropy": mean_entropy,
+                  **entropy_quantiles(merged), "pred_stats": merged}
     except Exception as e:
-        return {**job, "status": f"error: {e}", "n_reads": n_reads, "n_valid": n_valid, "mean_entropy": ""}
+        with contextlib.suppress(OSError):
+            os.remove(tmp_path)
+        result = {**task, "status": f"error: {e}", "n_reads": sum(int(r["n_reads"] or 0) for r in part_results),
+                  "n_valid": "", "mean_entropy": ""}
+    finally:
+        for part in parts:
+            with contextlib.suppress(OSError):
+                os.remove(part)
+
+    result.update({"codec_in": codec_in, "codec_out": codec_out, "n_parts": len(parts)})
+
+    # Stats add up over the parts, plus the concatenation done here
+    result.update(merge_stats(part_results))
+    for key, value in timer.stats().items():
+        result[key] += value
+    result["n_distinct_pred"] = count_distinct_preds(result.get("pred_stats", {}))
+    result["bytes_out"] = output_size(task["out_path"])
+    return result
+
+
+def write_result_sketches(r):
+    """
+    Write the entropy sketch(es) of a finished task next to its output: one entry per true
+    taxid (several for mixed samples scored against a per-read truth key).
+    """
+    by_true: Dict[str, Tuple[List[float], List[int]]] = {}
+    for key, (count, H) in r["pred_stats"].items():
+        true_taxid = key.split("\t", 1)[0] if r.get("key_path") else str(r["true_taxid"])
+        values, counts = by_true.setdefault(true_taxid, ([], []))
+        values.append(math.nan if H is None else H)
+        counts.append(count)
+
+    meta = {k: r.get(k, "") for k in ("path", "dataset", "filename", "db")}
+    meta["output"] = r["out_path"]
+    entries = []
+    for true_taxid in sorted(by_true):
+        sketch = ValueSketch("entropy")
+        sketch.add(*by_true[true_taxid])
+        entries.append({"meta": {**meta, "true_taxid": true_taxid}, "sketch": sketch})
+    write_sketches(sketch_path_for(r["out_path"]), entries)
+
+
+# Timing / cache / byte / RSS columns (stage_timing.STATS_KEYS) are blank for reused outputs
+SUMMARY_HEADER = (
+    "path\tdataset\tfilename\tdb\ttrue_taxid\toutput\tstatus\tn_reads\tn_valid_entropy\tmean_entropy\t"
+    "codec_in\tcodec_out\tq25_entropy\tmedian_entropy\tq75_entropy\t" + "\t".join(STATS_KEYS) + "\n"
+)
+
+
+def format_summary_row(r) -> str:
+    return (
+        f"{r['path']}\t{r.get('dataset','')}\t{r.get('filename','')}\t{r.get('db','')}\t{r['true_taxid']}\t"
+        f"{r['out_path']}\t{r['status']}\t{r.get('n_reads','')}\t{r.get('n_valid','')}\t{r.get('mean_entropy','')}\t"
+        f"{r.get('codec_in','')}\t{r.get('codec_out','')}\t{r.get('q25_entropy','')}\t{r.get('median_entropy','')}\t"
+        f"{r.get('q75_entropy','')}\t" + "\t".join(format_stats(r)) + "\n"
+    )
+
+
+def task_size(task) -> int:
+    """Input bytes a (sub)task will read; used for LPT ordering and progress."""
+    if "byte_range" in task:
+        start, end = task["byte_range"]
+        return end - start
+    try:
+        return os.path.getsize(task["path"])
+    except OSError:
+        return 0
+
+
+def run_tasks(subtasks, n_workers: int, ctx, initargs):
+    """Yield process_one results in completion order."""
+    if n_workers == 1:
+        yield from map(run_task, subtasks)
+        return
+    with ctx.Pool(processes=n_workers, initializer=init_worker, initargs=initargs) as pool:
+        yield from pool.imap_unordered(run_task, subtasks, chunksize=1)
+
+
+class Progress:
+    """
+    Live progress on stderr: files done, read throughput and ETA (from input bytes).
+    Redraws in place on a terminal; prints one line per finished file otherwise (SLURM logs).
+    """
+
+    def __init__(self, n_files: int, total_bytes: int, stream=sys.stderr):
+        self.n_files = n_files
+        self.total_bytes = total_bytes
+        self.stream = stream
+        self.tty = stream.isatty()
+        self.start = time.monotonic()
+        self.files_done = 0
+        self.bytes_done = 0
+        self.reads_done = 0
+
+    def add_bytes(self, n: int):
+        self.bytes_done += n
+
+    def file_done(self, result):
+        self.files_done += 1
+        try:
+            self.reads_done += int(result.get("n_reads") or 0)
+        except (TypeError, ValueError):
+            pass
+        self.show(force=True)
+
+    def show(self, force: bool = False):
+        if not (self.tty or force):
+            return
+        elapsed = max(time.monotonic() - self.start, 1e-9)
+        rate = self.reads_done / elapsed
+        if 0 < self.bytes_done < self.total_bytes:
+            eta = f"{(self.total_bytes - self.bytes_done) * elapsed / self.bytes_done:.0f}s"
+        else:
+            eta = "0s" if self.bytes_done else "?"
+        line = f"[{self.files_done}/{self.n_files} files] {rate:,.0f} reads/s, ETA {eta}"
+        if self.tty:
+            self.stream.write("\r" + line + "\033[K")
+        else:
+            self.stream.write(line + "\n")
+        self.stream.flush()
+
+    def close(self):
+        if self.tty:
+            self.stream.write("\n")
+            self.stream.flush()
 
 
 def main():
-    ap = argparse.ArgumentParser()
+    if sys.argv[1:2] == ["reduce"]:
+        sys.exit(reduce_main(sys.argv[2:]))
+
+    ap = argparse.ArgumentParser(
+        epilog="Sharded runs (--shard i/N) are merged and checked with: weighted_entropy_batch.py reduce -h"
+    )
     ap.add_argument("--nodes-dmp", required=True)
+    ap.add_argument(
+        "--taxonomy-cache",
+        default=None,
+        help="Directory of a compiled taxonomy cache (see taxonomy_cache.py); memory-mapped and shared by workers.",
+    )
+
+    ap.add_argument(
+        "--prune-to",
+        action="append",
+        default=None,
+        metavar="FILE",
+        help="Prune the taxonomy to taxids in FILE (accession2taxid.map, seqid2taxid.map or one taxid per line) "
+        "plus all true taxids and their ancestors. Repeatable. Use the map the Kraken DB was built from, so every "
+        "predicted taxid (an ancestor of a DB taxid) is kept.",
+    )
 
     ap.add_argument(
         "--jobs-tsv",
@@ -347,6 +801,20 @@ def main():
         help="Optional: 2-column TSV (kraken_out_path<TAB>true_taxid). If set, --key-file/--kraken-dir are ignored.",
     )
 
+    ap.add_argument(
+        "--truth-key-dir",
+        default=None,
+        help="Directory of per-read truth keys for mixed samples: <base>_<prefix>N.out is joined by SequenceID "
+        "with <base>_key_final.txt (see truth_keys.py). Overrides the file's single true taxid; with --kraken-dir, "
+        "files not in --key-file are scored too if they have a key.",
+    )
+    ap.add_argument(
+        "--pair-cache-size",
+        type=int,
+        default=PAIR_CACHE_SIZE,
+        help=f"Distinct (true, pred) rows cached per file with per-read truth (default {PAIR_CACHE_SIZE})",
+    )
+
     ap.add_argument("--key-file", required=False, help="taxid2filename.txt (TSV with filename/dataset/taxid columns)")
     ap.add_argument("--kraken-dir", required=False, help="Directory containing *_dbN.out files")
 
@@ -360,12 +828,82 @@ def main():
     ap.add_argument("--alpha-down", type=float, default=1.0)
     ap.add_argument("--unclassified-entropy", type=float, default=None)
 
-    ap.add_argument("--gzip", action="store_true", help="Write outputs as .gz")
-    ap.add_argument("--compresslevel", type=int, default=3)
+    ap.add_argument("--gzip", action="store_true", help="Write outputs as .gz (same as --compression gzip)")
+    ap.add_argument(
+        "--compression",
+        choices=CODECS,
+        default=None,
+        help="Output codec: plain, gzip (.gz) or zstd (.zst). Inputs are decoded by extension.",
+    )
+    ap.add_argument(
+        "--compress-backend",
+        choices=BACKENDS,
+        default="auto",
+        help="Output codec implementation (auto picks the fastest available; see codec_io.py).",
+    )
+    ap.add_argument("--compress-threads", type=int, default=1, help="Threads for zstandard/pigz/zstd output backends")
+    ap.add_argument(
+        "--compresslevel",
+        type=int,
+        default=None,
+        help=f"Compression level (default 3; the isal gzip backend caps it at {ISAL_MAX_LEVEL})",
+    )
+    ap.add_argument(
+        "--format",
+        choices=("tsv", "parquet"),
+        default="tsv",
+        help="Per-read output format. parquet (needs pyarrow) writes typed, dictionary-encoded columns in "
+        "row groups, compressed with --compression (default zstd); read it with parquet_io.read_entropy_table",
+    )
+    ap.add_argument(
+        "--split-mb",
+        type=int,
+        default=1024,
+        help="Split uncompressed inputs larger than this many MiB into newline-aligned ranges scored by "
+        "several workers (0 disables; only used with --jobs > 1)",
+    )
     ap.add_argument("--no-diagnostics", action="store_true")
-    ap.add_argument("--skip-existing", action="store_true")
+    ap.add_argument(
+        "--aggregate",
+        action="store_true",
+        help="Write one row per distinct pred_taxid with its read count (*.entropy_counts.tsv) instead of one "
+        "row per read; expand back with entropy_counts.py",
+    )
+    ap.add_argument(
+        "--shard",
+        default=None,
+        metavar="i/N",
+        help="Process only shard i of N (1-based, e.g. $SLURM_ARRAY_TASK_ID/$SLURM_ARRAY_TASK_COUNT). Jobs are "
+        "split by input size, identically on every node; give each shard its own --summary-tsv and a "
+        "shared --outdir, then run 'reduce'",
+    )
+    ap.add_argument(
+        "--trace",
+        default=None,
+        metavar="JSONL",
+        help="Append one JSON line per finished file (and per part of split files) with its stage timings, "
+        "cache hits, byte counts and peak RSS",
+    )
+    ap.add_argument(
+        "--profile",
+        default=None,
+        metavar="INPUT",
+        help="Run cProfile in the worker(s) scoring this input (path or file name); stats are written to "
+        "outdir/profile/<input>[.partN].<pid>.prof with a text summary next to it",
+    )
+    ap.add_argument(
+        "--skip-existing",
+        action="store_true",
+        help="Resume: reuse outputs whose manifest record (outdir/manifest.jsonl) matches the current input "
+        "size/mtime and parameters, and recompute everything else",
+    )
 
     args = ap.parse_args()
+    if args.shard:
+        try:
+            shard_index, n_shards = parse_shard(args.shard)
+        except ValueError as e:
+            raise SystemExit(str(e))
 
     outdir = Path(args.outdir)
     outdir.mkdir(parents=True, exist_ok=True)
@@ -378,22 +916,80 @@ def main():
         if not jobs:
             raise SystemExit(f"No jobs found in {args.jobs_tsv}")
     else:
-        if not args.key_file or not args.kraken_dir:
-            raise SystemExit("Either provide --jobs-tsv OR provide both --key-file and --kraken-dir.")
-        key_map = load_key(args.key_file)
-        jobs, missing_key = discover_jobs(args.kraken_dir, key_map, recursive=args.recursive)
+        if not args.kraken_dir or not (args.key_file or args.truth_key_dir):
+            raise SystemExit("Either provide --jobs-tsv OR provide --kraken-dir with --key-file and/or --truth-key-dir.")
+        key_map = load_key(args.key_file) if args.key_file else {}
+        jobs, missing_key = discover_jobs(args.kraken_dir, key_map, recursive=args.recursive,
+                                          truth_key_dir=args.truth_key_dir)
         if not jobs:
-            raise SystemExit("No Kraken .out files discovered that match *_dbN.out and exist in key map.")
+            raise SystemExit("No Kraken .out files discovered that match *_dbN.out and exist in key map"
+                             + (" or have a truth key." if args.truth_key_dir else "."))
+
+    if args.truth_key_dir:
+        for j in jobs:
+            if "key_path" not in j:
+                key_path = key_path_for(j["path"], args.truth_key_dir)
+                if key_path:
+                    j["key_path"] = key_path
+                else:
+                    print(f"WARNING: no truth key in {args.truth_key_dir} for {j['path']}", file=sys.stderr)
+
+    if args.shard:
+        all_jobs = jobs
+        jobs, missing_key = select_shard(all_jobs, missing_key, shard_index, n_shards)
+        write_shard_plan(str(outdir), shard_index, n_shards, all_jobs, jobs, missing_key, args.summary_tsv)
+        print(f"Shard {shard_index}/{n_shards}: {len(jobs)} of {len(all_jobs)} jobs", file=sys.stderr)
+
+    keep_taxids = None
+    if args.prune_to:
+        keep = set()
+        for path in args.prune_to:
+            taxids = read_taxid_file(path)
+            if not taxids:
+                raise SystemExit(f"--prune-to {path}: no taxids found")
+            keep |= taxids
+        keep |= {int(j["true_taxid"]) for j in jobs if str(j["true_taxid"]).strip().isdigit()}
+        for key_path in {j["key_path"] for j in jobs if j.get("key_path")}:
+            keep |= key_taxids(key_path)
+        keep_taxids = sorted(keep)
 
     # Load taxonomy once in parent (helps fork); workers will load if needed
-    global PARENT, RANK, DEPTH, BRANCH_SIZE
-    PARENT, RANK, DEPTH, BRANCH_SIZE = load_taxonomy(args.nodes_dmp)
-
-    # Build task list
+    init_worker(args.nodes_dmp, args.taxonomy_cache, keep_taxids)
+
+    if args.aggregate and args.format == "parquet":
+        raise SystemExit("--aggregate writes TSV tables and cannot be combined with --format parquet")
+    codec = args.compression or ("gzip" if args.gzip else "plain")
+    if args.format == "parquet":
+        try:
+            require_pyarrow()
+        except RuntimeError as e:
+            raise SystemExit(str(e))
+        codec = args.compression or ("gzip" if args.gzip else "zstd")
+        if args.compress_backend != "auto":
+            raise SystemExit("--compress-backend applies to TSV outputs; parquet is compressed by pyarrow")
+    else:
+        try:
+            backend = resolve_backend(codec, args.compress_backend)
+        except (ValueError, RuntimeError) as e:
+            raise SystemExit(f"--compress-backend {args.compress_backend}: {e}")
+        if backend == "isal" and (args.compresslevel or 0) > ISAL_MAX_LEVEL:
+            print(f"WARNING: python-isal supports gzip levels 0-{ISAL_MAX_LEVEL}; "
+                  f"--compresslevel {args.compresslevel} is written as {ISAL_MAX_LEVEL}", file=sys.stderr)
+
+    # Build task list. The taxonomy and the keep set are hashed into the manifest params,
+    # so --skip-existing recomputes outputs when either changes
+    taxonomy_params = {"taxonomy_signature": input_signature(args.nodes_dmp)}
+    if keep_taxids is not None:
+        taxonomy_params["keep_taxids_digest"] = taxids_digest(keep_taxids)
     tasks = []
     for j in jobs:
         stem = Path(j["path"]).name
-        suffix = ".entropy.tsv.gz" if args.gzip else ".entropy.tsv"
+        if args.aggregate:
+            suffix = ".entropy_counts.tsv" + SUFFIX_FOR_CODEC[codec]
+        elif args.format == "parquet":
+            suffix = ".entropy.parquet"
+        else:
+            suffix = ".entropy.tsv" + SUFFIX_FOR_CODEC[codec]
         out_path = str(outdir / (stem + suffix))
 
         tasks.append(
@@ -405,33 +1001,101 @@ def main():
                 "unclassified_entropy": args.unclassified_entropy,
                 "write_diag": (not args.no_diagnostics),
                 "compresslevel": args.compresslevel,
-                "skip_existing": args.skip_existing,
+                "codec": codec,
+                "codec_backend": args.compress_backend,
+                "compress_threads": args.compress_threads,
+                "format": args.format,
+                "aggregate": args.aggregate,
+                "input_signature": input_signature(j["path"]),
+                "pair_cache_size": args.pair_cache_size,
+                **({"key_signature": input_signature(j["key_path"])} if j.get("key_path") else {}),
+                **taxonomy_params,
             }
         )
 
+    if args.profile:
+        profiled = [t for t in tasks if args.profile in (t["path"], Path(t["path"]).name)]
+        if not profiled:
+            raise SystemExit(f"--profile {args.profile} matches no input")
+        for t in profiled:
+            t["profile_dir"] = str(outdir / "profile")
+
     # Multiprocessing
     n_workers = max(1, int(args.jobs))
     start_methods = mp.get_all_start_methods()
     ctx = mp.get_context("fork") if "fork" in start_methods else mp.get_context("spawn")
 
-    if n_workers == 1:
-        results = [process_one(t) for t in tasks]
-    else:
-        with ctx.Pool(processes=n_workers, initializer=init_worker, initargs=(args.nodes_dmp,)) as pool:
-            results = pool.map(process_one, tasks)
-
-    # Write summary TSV
-    with open(args.summary_tsv, "w") as f:
-        f.write("path\tdataset\tfilename\tdb\ttrue_taxid\toutput\tstatus\tn_reads\tn_valid_entropy\tmean_entropy\n")
-        for r in results:
-            f.write(
-                f"{r['path']}\t{r.get('dataset','')}\t{r.get('filename','')}\t{r.get('db','')}\t{r['true_taxid']}\t"
-                f"{r['out_path']}\t{r['status']}\t{r.get('n_reads','')}\t{r.get('n_valid','')}\t{r.get('mean_entropy','')}\n"
-            )
-
-    # Optional: dump missing-key list (only applies in key/discover mode)
-    if missing_key:
-        miss_path = str(outdir / "missing_key_for_outputs.txt")
+    manifest_path = str(outdir / MANIFEST_NAME)
+    manifest = load_manifest(manifest_path) if args.skip_existing else {}
+    reused = []
+
+    split_bytes = args.split_mb * (1 << 20) if n_workers > 1 else 0
+    n_parts: Dict[int, int] = {}
+    subtasks = []
+    for i, t in enumerate(tasks):
+        t["task_index"] = i
+        record = manifest.get(t["out_path"])
+        if (is_up_to_date(t, record) and os.path.exists(sketch_path_for(t["out_path"]))
+                and not t.get("profile_dir")):
+            reused.append({**t, **record["summary"]})
+            continue
+        group = split_task(t, split_bytes)
+        n_parts[i] = len(group)
+        subtasks.extend(group)
+
+    # Longest processing time first: the biggest inputs must not start last
+    sizes = [task_size(st) for st in subtasks]
+    order = sorted(range(len(subtasks)), key=lambda i: sizes[i], reverse=True)
+    subtasks = [subtasks[i] for i in order]
+
+    progress = Progress(n_files=len(tasks) - len(reused), total_bytes=sum(sizes))
+    if reused:
+        print(f"Resuming: reusing {len(reused)} up-to-date outputs, computing {len(tasks) - len(reused)}", file=sys.stderr)
+    parts_done: Dict[int, List[dict]] = {}
+
+    # Write summary TSV, one row as soon as each file finishes
+    with open(args.summary_tsv, "w") as f, \
+            (open(args.trace, "a") if args.trace else contextlib.nullcontext()) as trace:
+        f.write(SUMMARY_HEADER)
+        for r in reused:
+            f.write(format_summary_row(r))
+        f.flush()
+        initargs = (args.nodes_dmp, args.taxonomy_cache, keep_taxids)
+        for r in run_tasks(subtasks, n_workers, ctx, initargs):
+            progress.add_bytes(task_size(r))
+            if trace is not None:
+                trace.write(json.dumps(trace_record(r)) + "\n")
+            if r.get("profile_path"):
+                print(f"Profile: {r['profile_path']}", file=sys.stderr)
+            if "byte_range" in r:
+                done = parts_done.setdefault(r["task_index"], [])
+                done.append(r)
+                if len(done) < n_parts[r["task_index"]]:
+                    progress.show()
+                    continue
+                r = finalize_parts(tasks[r["task_index"]], parts_done.pop(r["task_index"]))
+                if trace is not None:
+                    trace.write(json.dumps(trace_record(r)) + "\n")
+
+            if r["status"] == "ok":
+                write_result_sketches(r)
+                append_manifest(manifest_path, r)
+            if r.get("n_missing_truth") or r.get("n_unmatched_key"):
+                print(
+                    f"WARNING: {r['path']}: {r['n_missing_truth']} reads not in {r['key_path']}, "
+                    f"{r['n_unmatched_key']} key records not in the Kraken output",
+                    file=sys.stderr,
+                )
+            f.write(format_summary_row(r))
+            f.flush()
+            if trace is not None:
+                trace.flush()
+            progress.file_done(r)
+    progress.close()
+
+    # Optional: dump missing-key list (only applies in key/discover mode; shards wrote theirs with the plan)
+    if missing_key and not args.shard:
+        miss_path = str(outdir / MISSING_KEY_NAME)
         with open(miss_path, "w") as f:
             for p in missing_key:
                 f.write(p + "\n")
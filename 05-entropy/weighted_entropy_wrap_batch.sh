@@ -25,12 +25,13 @@ OUTDIR="$MYPATH/entropy_test"
 PERREAD_OUTDIR="$OUTDIR/per_read"
 mkdir -p "$OUTDIR" "$PERREAD_OUTDIR"
 
-# split files into chunks with awk prior to running
-CHUNKFILE="$WORKDIR/chunk_${SLURM_ARRAY_TASK_ID}.txt"
-if [[ ! -f "$CHUNKFILE" ]]; then
-  echo "ERROR: chunk file not found: $CHUNKFILE" >&2
+# full job list; each array task scores its own size-balanced shard of it
+JOBS_TSV="${JOBS_TSV:-$WORKDIR/jobs.tsv}"
+if [[ ! -f "$JOBS_TSV" ]]; then
+  echo "ERROR: jobs file not found: $JOBS_TSV" >&2
   exit 2
 fi
+SHARD="${SLURM_ARRAY_TASK_ID}/${SLURM_ARRAY_TASK_COUNT}"
 
 # Internal multiprocessing per array task (<= -c)
 PY_WORKERS="${PY_WORKERS:-8}"
@@ -39,13 +40,14 @@ ALPHA_UP="${ALPHA_UP:-0.3}" #default
 ALPHA_DOWN="${ALPHA_DOWN:-1.0}" #default
 COMPRESSLEVEL="${COMPRESSLEVEL:-3}"
 
-echo "Chunkfile: $CHUNKFILE"
+echo "Jobs: $JOBS_TSV (shard $SHARD)"
 echo "Python workers: $PY_WORKERS"
 echo "Outdir: $PERREAD_OUTDIR"
 
 python "$WORKDIR/weighted_entropy_batch.py" \
   --nodes-dmp "$NODES_DMP" \
-  --jobs-tsv "$CHUNKFILE" \
+  --jobs-tsv "$JOBS_TSV" \
+  --shard "$SHARD" \
   --outdir "$PERREAD_OUTDIR" \
   --summary-tsv "$OUTDIR/summary_chunk_${SLURM_ARRAY_TASK_ID}.tsv" \
   --jobs "$PY_WORKERS" \
@@ -56,6 +58,9 @@ python "$WORKDIR/weighted_entropy_batch.py" \
   --skip-existing \
   --no-diagnostics
 
+# once every array task has finished, merge and check the shards:
+#   python weighted_entropy_batch.py reduce --outdir "$PERREAD_OUTDIR" --summary-tsv "$OUTDIR/summary.tsv"
+
 echo "END"
 date
 
@@ -0,0 +1,404 @@
+#!/usr/bin/env python3
+
+"""
+bench.py
+
+Benchmark suite for the 05-entropy entry points, on synthetic data from synth_data.py.
+
+    run       generate (or reuse) a dataset, time every entry point and write results JSON
+    compare   compare two results files and fail on regressions beyond a threshold
+
+Both also fail if an entry in MUST_BEAT is not faster than the one it is meant to beat.
+    micro     one in-process microbenchmark (called by run in a fresh interpreter)
+
+Every benchmark runs in its own child process, so peak RSS (ru_maxrss from wait4, which
+includes reaped pool workers) and CPU time belong to that benchmark alone. Each is run
+--repeat times and the fastest run is kept. Entries:
+
+    startup:<script>         python <script> --help (interpreter + imports)
+    micro:<name>             load_taxonomy, parse_nodes_dmp, cache_load, lca_features,
+                             lca_features_indexed, scorer; throughput excludes setup
+    batch:<variant>          weighted_entropy_batch.py over jobs_<variant>.tsv
+                             (plain, gz, names, names_gz)
+    weighted_entropy         weighted_entropy.py on pairs.tsv
+    basic_entropy            basic_entropy.py on summaries/
+    summaries_extra          summaries_extra.merge_dataset on keys/ + out/
+
+Usage:
+    python bench.py run --data bench_data --reads 200000 --output results/$(git rev-parse --short HEAD).json
+    python bench.py compare results/base.json results/new.json --threshold 0.15
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import synth_data
+
+BENCH_DIR = Path(__file__).resolve().parent
+ENTROPY_DIR = BENCH_DIR.parent / "05-entropy"
+
+RESULTS_VERSION = 1
+DEFAULT_THRESHOLD = 0.15
+
+STARTUP_SCRIPTS = ("weighted_entropy.py", "weighted_entropy_batch.py", "basic_entropy.py", "summaries_extra.py")
+MICRO_BENCHES = ("load_taxonomy", "parse_nodes_dmp", "cache_load", "lca_features", "lca_features_indexed", "scorer")
+
+# Per-pair Python loops are slow; time them on a sample of pairs.tsv
+LCA_SAMPLE = 20_000
+
+# (faster, slower): entries whose throughput must keep this order, e.g. an index that is
+# only worth having if it beats the code path it replaces
+MUST_BEAT = (("micro:lca_features_indexed", "micro:lca_features"),)
+
+
+# ----------------------------
+# Measurement
+# ----------------------------
+
+def measure(cmd: List[str], cwd: Optional[str] = None) -> dict:
+    """Run cmd to completion; wall/CPU seconds, peak RSS and stdout of the child process tree."""
+    with tempfile.TemporaryFile() as out, tempfile.TemporaryFile() as err:
+        start = time.perf_counter()
+        proc = subprocess.Popen(cmd, cwd=cwd, stdout=out, stderr=err)
+        # Reap the child ourselves (not proc.wait) to get its rusage
+        _, status, usage = os.wait4(proc.pid, 0)
+        wall = time.perf_counter() - start
+        proc.returncode = code = os.waitstatus_to_exitcode(status)
+        out.seek(0)
+        err.seek(0)
+        stdout, stderr = out.read(), err.read()
+    if code != 0:
+        raise RuntimeError(f"{' '.join(cmd)} exited with {code}:\n{stderr.decode(errors='replace')[-2000:]}")
+    return {
+        "wall_s": wall,
+        "cpu_s": usage.ru_utime + usage.ru_stime,
+        # ru_maxrss is in KiB on Linux
+        "peak_rss_mb": usage.ru_maxrss / 1024,
+        "stdout": stdout.decode(errors="replace"),
+    }
+
+
+def best_of(cmd: List[str], repeat: int, cwd: Optional[str] = None) -> dict:
+    runs = [measure(cmd, cwd) for _ in range(repeat)]
+    best = min(runs, key=lambda r: r["wall_s"])
+    best["peak_rss_mb"] = max(r["peak_rss_mb"] for r in runs)
+    best["wall_s_runs"] = [round(r["wall_s"], 4) for r in runs]
+    return best
+
+
+# ----------------------------
+# Microbenchmarks (child side)
+# ----------------------------
+
+def read_pairs(data: Path, limit: Optional[int] = None):
+    trues, preds = [], []
+    with open(data / "pairs.tsv") as f:
+        next(f)
+        for line in f:
+            _, t, p = line.rstrip("\n").split("\t")
+            trues.append(t)
+            preds.append(p)
+            if limit is not None and len(trues) >= limit:
+                break
+    return trues, preds
+
+
+def micro(name: str, data: Path) -> dict:
+    """Run one microbenchmark in this process; returns {"items", "unit", "seconds"} for the timed part."""
+    sys.path.insert(0, str(ENTROPY_DIR))
+    from lca_index import LCAIndex
+    from taxonomy_cache import compile_taxonomy_cache, load_taxonomy_arrays, parse_nodes_dmp
+    from weighted_entropy import EntropyScorer, lca_features, load_taxonomy
+
+    nodes = str(data / "nodes.dmp")
+    if name == "load_taxonomy":
+        start = time.perf_counter()
+        parent, _, _, _ = load_taxonomy(nodes)
+        return {"items": len(parent), "unit": "nodes", "seconds": time.perf_counter() - start}
+
+    if name == "parse_nodes_dmp":
+        start = time.perf_counter()
+        arrays = parse_nodes_dmp(nodes)
+        return {"items": len(arrays.taxid), "unit": "nodes", "seconds": time.perf_counter() - start}
+
+    if name == "cache_load":
+        # What every worker pays at startup once the cache is compiled
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = os.path.join(tmp, "nodes.cache")
+            arrays = compile_taxonomy_cache(nodes, cache)
+            LCAIndex.load_or_build(arrays, cache)
+            start = time.perf_counter()
+            arrays = load_taxonomy_arrays(nodes, cache)
+            LCAIndex.load_or_build(arrays, cache)
+            return {"items": len(arrays.taxid), "unit": "nodes", "seconds": time.perf_counter() - start}
+
+    if name in ("lca_features", "lca_features_indexed"):
+        parent, rank, depth, branch_size = load_taxonomy(nodes)
+        index = LCAIndex(load_taxonomy_arrays(nodes)) if name == "lca_features_indexed" else None
+        trues, preds = read_pairs(data, LCA_SAMPLE)
+        pairs = [(t, p) for t, p in zip(trues, preds) if p != "0"]
+        start = time.perf_counter()
+        for t, p in pairs:
+            lca_features(t, p, parent, depth, branch_size, rank, index)
+        return {"items": len(pairs), "unit": "pairs", "seconds": time.perf_counter() - start}
+
+    if name == "scorer":
+        scorer = EntropyScorer.from_nodes_dmp(nodes)
+        trues, preds = read_pairs(data)
+        start = time.perf_counter()
+        scorer.score(trues, preds)
+        return {"items": len(trues), "unit": "reads", "seconds": time.perf_counter() - start}
+
+    raise SystemExit(f"Unknown microbenchmark: {name}")
+
+
+# ----------------------------
+# Entry points (parent side)
+# ----------------------------
+
+def script(name: str) -> str:
+    return str(ENTROPY_DIR / name)
+
+
+def summaries_extra_cmd(data: Path, out: Path, n_virid: int) -> List[str]:
+    # Directories are module constants in summaries_extra.py, so drive merge_dataset directly
+    code = (
+        "from pathlib import Path; import summaries_extra as s; "
+        f"s.KEY_DIR = Path({str(data / 'keys')!r}); s.OUT_DIR = Path({str(data / 'out')!r}); "
+        f"s.SUMMARY_DIR = Path({str(out)!r}); s.merge_dataset('mix', 1, {n_virid}, 'virid')"
+    )
+    return [sys.executable, "-c", code]
+
+
+def entries(data: Path, info: dict, work: Path, n_jobs: int) -> Dict[str, dict]:
+    """name -> {"cmd", "items", "unit"}; items None means throughput comes from the child (micro)."""
+    py = sys.executable
+    nodes = str(data / "nodes.dmp")
+    batch_reads = info["reads_per_file"] * info["files"]
+    todo: Dict[str, dict] = {}
+
+    for name in STARTUP_SCRIPTS:
+        todo[f"startup:{name[:-3]}"] = {"cmd": [py, script(name), "--help"], "items": None, "unit": None}
+
+    for name in MICRO_BENCHES:
+        todo[f"micro:{name}"] = {"cmd": [py, __file__, "micro", name, "--data", str(data)], "items": None,
+                                 "unit": None}
+
+    for variant in synth_data.VARIANTS:
+        out = work / f"batch_{variant}"
+        todo[f"batch:{variant}"] = {
+            "cmd": [py, script("weighted_entropy_batch.py"), "--nodes-dmp", nodes,
+                    "--jobs-tsv", str(data / f"jobs_{variant}.tsv"), "--outdir", str(out),
+                    "--summary-tsv", str(out / "summary.tsv"), "--jobs", str(n_jobs)],
+            "items": batch_reads,
+            "unit": "reads",
+        }
+
+    todo["weighted_entropy"] = {
+        "cmd": [py, script("weighted_entropy.py"), "--nodes-dmp", nodes, "--input-tsv", str(data / "pairs.tsv"),
+                "--output-tsv", str(work / "pairs_entropy.tsv")],
+        "items": info["reads_per_file"],
+        "unit": "reads",
+    }
+    todo["basic_entropy"] = {
+        "cmd": [py, script("basic_entropy.py"), "--nodes-dmp", nodes, "--summary-dir", str(data / "summaries"),
+                "--output-dir", str(work / "basic"), "--db-name", "virid"],
+        "items": info["summary_reads"],
+        "unit": "reads",
+    }
+    todo["summaries_extra"] = {
+        "cmd": summaries_extra_cmd(data, work / "summaries_extra", info["n_virid"]),
+        "items": info["summary_reads"],
+        "unit": "reads",
+    }
+    return todo
+
+
+def git_meta() -> dict:
+    def git(*args):
+        try:
+            return subprocess.run(["git", *args], cwd=BENCH_DIR, capture_output=True, text=True,
+                                  check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    status = git("status", "--porcelain", "--untracked-files=no")
+    return {"commit": git("rev-parse", "HEAD"), "dirty": bool(status) if status is not None else None}
+
+
+def run(args):
+    data = Path(args.data)
+    if args.regenerate or not (data / "dataset.json").exists():
+        print(f"[bench] Generating dataset in {data}", file=sys.stderr)
+        synth_data.generate(str(data), args.reads, args.files, args.seed, summary_reads=args.summary_reads)
+    with open(data / "dataset.json") as f:
+        info = json.load(f)
+
+    work = Path(tempfile.mkdtemp(prefix="bench_", dir=args.tmp_dir))
+    results = {}
+    try:
+        todo = entries(data, info, work, args.jobs)
+        selected = [k for k in todo if not args.only or any(k.startswith(o) for o in args.only.split(","))]
+        for name in selected:
+            e = todo[name]
+            # Fresh output directories so every repeat does the full work
+            for sub in work.iterdir():
+                shutil.rmtree(sub) if sub.is_dir() else sub.unlink()
+            r = best_of(e["cmd"], args.repeat, cwd=str(ENTROPY_DIR))
+            row = {"wall_s": round(r["wall_s"], 4), "cpu_s": round(r["cpu_s"], 4),
+                   "peak_rss_mb": round(r["peak_rss_mb"], 1), "wall_s_runs": r["wall_s_runs"]}
+            if name.startswith("micro:"):
+                m = json.loads(r["stdout"].strip().splitlines()[-1])
+                row.update(items=m["items"], unit=m["unit"], timed_s=round(m["seconds"], 4),
+                           items_per_s=round(m["items"] / m["seconds"], 1) if m["seconds"] > 0 else None)
+            elif e["items"] is not None:
+                row.update(items=e["items"], unit=e["unit"], items_per_s=round(e["items"] / r["wall_s"], 1))
+            results[name] = row
+            rate = f"{row['items_per_s']:>12,.0f} {row['unit']}/s" if row.get("items_per_s") else " " * 20
+            print(f"{name:32s} {row['wall_s']:9.3f}s {rate} {row['peak_rss_mb']:9.1f} MiB", file=sys.stderr)
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+    doc = {
+        "version": RESULTS_VERSION,
+        "meta": {
+            **git_meta(),
+            "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "jobs": args.jobs,
+            "repeat": args.repeat,
+            "dataset": info,
+        },
+        "results": results,
+    }
+    if args.output == "-":
+        json.dump(doc, sys.stdout, indent=2)
+        print()
+    else:
+        Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+        with open(args.output, "w") as f:
+            json.dump(doc, f, indent=2)
+        print(f"[bench] Wrote {args.output}", file=sys.stderr)
+    failures = check_must_beat(results)
+    for msg in failures:
+        print(f"[bench] FAILED: {msg}", file=sys.stderr)
+    if failures:
+        sys.exit(1)
+
+
+# ----------------------------
+# Regression check
+# ----------------------------
+
+def check_must_beat(results: dict) -> List[str]:
+    """Failures of MUST_BEAT among the entries present in results."""
+    failures = []
+    for fast, slow in MUST_BEAT:
+        f, s = results.get(fast, {}).get("items_per_s"), results.get(slow, {}).get("items_per_s")
+        if f and s and f <= s:
+            failures.append(f"{fast} ({f:,.0f}/s) is not faster than {slow} ({s:,.0f}/s)")
+    return failures
+
+
+def compare_results(base: dict, new: dict, threshold: float) -> List[dict]:
+    """
+    One row per (entry, metric) present in both: throughput must not drop, and peak RSS
+    and startup time must not grow, by more than threshold (relative).
+    """
+    rows = []
+    for name in sorted(set(base["results"]) & set(new["results"])):
+        b, n = base["results"][name], new["results"][name]
+        checks = [("peak_rss_mb", False)]
+        if b.get("items_per_s") and n.get("items_per_s"):
+            checks.insert(0, ("items_per_s", True))
+        elif name.startswith("startup:"):
+            checks.insert(0, ("wall_s", False))
+        for metric, higher_is_better in checks:
+            change = n[metric] / b[metric] - 1 if b[metric] else 0.0
+            worse = -change if higher_is_better else change
+            rows.append({"entry": name, "metric": metric, "base": b[metric], "new": n[metric],
+                         "change": change, "regressed": worse > threshold})
+    return rows
+
+
+def compare(args):
+    with open(args.base) as f:
+        base = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+
+    if base["meta"].get("dataset") != new["meta"].get("dataset"):
+        print("[bench] Warning: results were measured on different datasets", file=sys.stderr)
+    for key in ("cpu_count", "jobs", "python"):
+        if base["meta"].get(key) != new["meta"].get(key):
+            print(f"[bench] Warning: {key} differs ({base['meta'].get(key)} vs {new['meta'].get(key)})",
+                  file=sys.stderr)
+
+    rows = compare_results(base, new, args.threshold)
+    print("\t".join(["entry", "metric", "base", "new", "change", "status"]))
+    for r in rows:
+        status = "REGRESSION" if r["regressed"] else "ok"
+        print(f"{r['entry']}\t{r['metric']}\t{r['base']}\t{r['new']}\t{r['change']:+.1%}\t{status}")
+
+    only = sorted(set(base["results"]) ^ set(new["results"]))
+    if only:
+        print(f"[bench] Not in both files (skipped): {', '.join(only)}", file=sys.stderr)
+    n_bad = sum(r["regressed"] for r in rows)
+    failures = check_must_beat(new["results"])
+    for msg in failures:
+        print(f"[bench] FAILED: {msg}", file=sys.stderr)
+    if n_bad:
+        print(f"[bench] {n_bad} regression(s) beyond {args.threshold:.0%}", file=sys.stderr)
+    if n_bad or failures:
+        sys.exit(1)
+    print(f"[bench] No regressions beyond {args.threshold:.0%}", file=sys.stderr)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark the entropy entry points on synthetic data.")
+    sub = ap.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("run", help="Run the benchmarks and write results JSON")
+    p.add_argument("--data", default="bench_data", help="Dataset directory (generated if missing)")
+    p.add_argument("--regenerate", action="store_true", help="Regenerate the dataset even if present")
+    p.add_argument("--reads", type=int, default=200_000, help="Reads per Kraken output (default 200000)")
+    p.add_argument("--files", type=int, default=3, help="Kraken outputs per variant (default 3)")
+    p.add_argument("--summary-reads", type=int, default=50_000, help="Reads in the mixed summary sample")
+    p.add_argument("--seed", type=int, default=1)
+    p.add_argument("--jobs", type=int, default=1, help="--jobs for weighted_entropy_batch.py (default 1)")
+    p.add_argument("--repeat", type=int, default=3, help="Runs per entry; the fastest is kept (default 3)")
+    p.add_argument("--only", default=None, help="Comma-separated entry name prefixes, e.g. batch:,micro:scorer")
+    p.add_argument("--tmp-dir", default=None, help="Scratch directory for outputs (default: system temp dir)")
+    p.add_argument("--output", default="-", help="Results JSON (default: stdout)")
+    p.set_defaults(func=run)
+
+    p = sub.add_parser("compare", help="Compare two results files; exit 1 on regressions")
+    p.add_argument("base")
+    p.add_argument("new")
+    p.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                   help=f"Allowed relative slowdown / RSS growth (default {DEFAULT_THRESHOLD})")
+    p.set_defaults(func=compare)
+
+    p = sub.add_parser("micro", help="Run one microbenchmark in-process and print its JSON")
+    p.add_argument("name", choices=MICRO_BENCHES)
+    p.add_argument("--data", required=True)
+    p.set_defaults(func=lambda a: print(json.dumps(micro(a.name, Path(a.data)))))
+
+    args = ap.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+
+"""
+synth_data.py
+
+Deterministic synthetic inputs for the benchmark suite (bench.py):
+
+    nodes.dmp                     NCBI-style tree: root -> superkingdom -> ... -> species
+                                  -> strain, with per-rank fan-out and "no rank" clades
+                                  spliced in, so depth and branching look like RefSeq
+    kraken/ds_fileN_db1.out[.gz]  Kraken outputs, numeric taxids or --use-names style
+    jobs_<variant>.tsv            weighted_entropy_batch.py jobs for each output variant
+    pairs.tsv                     read_id / true_taxid / pred_taxid for weighted_entropy.py
+    keys/, out/                   *_key_final.txt and *_viridN.out for summaries_extra.py
+    summaries/                    *_virid_summary.txt for basic_entropy.py
+
+Predictions mimic Kraken: a read is unclassified, called at its true taxon, called at an
+ancestor (LCA-style), or misassigned to an unrelated node. The same --seed always gives
+byte-identical files.
+
+Usage:
+    python synth_data.py --outdir bench_data --reads 200000 --files 3
+"""
+
+import argparse
+import gzip
+import json
+from pathlib import Path
+from typing import List
+
+import numpy as np
+
+# (rank, mean children per parent) below the root; ~400k nodes, depth up to 14 with the defaults
+DEFAULT_LEVELS = (
+    ("superkingdom", 3),
+    ("phylum", 6),
+    ("class", 4),
+    ("order", 5),
+    ("family", 5),
+    ("genus", 6),
+    ("species", 8),
+    ("strain", 3),
+)
+
+# Share of reads by outcome, as (unclassified, exact, ancestor, unrelated)
+DEFAULT_OUTCOMES = (0.15, 0.45, 0.3, 0.1)
+
+NO_RANK_PROB = 0.15   # chance a parent gets an intermediate "no rank" clade above its children
+VARIANTS = ("plain", "gz", "names", "names_gz")
+
+
+def parse_levels(spec: str):
+    """'superkingdom:3,phylum:6,...' -> ((rank, fanout), ...)"""
+    levels = []
+    for item in spec.split(","):
+        rank, _, fanout = item.partition(":")
+        levels.append((rank.strip(), int(fanout)))
+    return tuple(levels)
+
+
+# ----------------------------
+# Taxonomy
+# ----------------------------
+
+def build_tree(levels, seed: int):
+    """
+    Returns (taxid, parent, rank, depth) arrays; node 0 is the root (taxid 1). Taxids are
+    a random permutation so that file order is unrelated to tree order, as in NCBI.
+    """
+    rng = np.random.default_rng(seed)
+    parents: List[int] = [0]
+    ranks: List[str] = ["no rank"]
+    depths: List[int] = [0]
+    frontier = [0]
+    for rank, fanout in levels:
+        nxt = []
+        for p in frontier:
+            anchor = p
+            if rng.random() < NO_RANK_PROB:
+                parents.append(p)
+                ranks.append("no rank")
+                depths.append(depths[p] + 1)
+                anchor = len(parents) - 1
+            # Fan-out varies around the mean, never below 1
+            n_children = max(1, int(rng.poisson(fanout)))
+            for _ in range(n_children):
+                parents.append(anchor)
+                ranks.append(rank)
+                depths.append(depths[anchor] + 1)
+                nxt.append(len(parents) - 1)
+        frontier = nxt
+
+    n = len(parents)
+    taxid = np.empty(n, dtype=np.int64)
+    taxid[0] = 1
+    taxid[1:] = rng.permutation(np.arange(2, 20 * n))[: n - 1]
+    return taxid, np.asarray(parents, dtype=np.int64), ranks, np.asarray(depths, dtype=np.int64)
+
+
+def write_nodes_dmp(path: str, taxid, parent, ranks):
+    with open(path, "w") as f:
+        for i in range(len(taxid)):
+            f.write(f"{taxid[i]}\t|\t{taxid[parent[i]]}\t|\t{ranks[i]}\t|\t\t|\t0\t|\t1\t|\t11\t|\n")
+
+
+# ----------------------------
+# Reads
+# ----------------------------
+
+def simulate_preds(rng, true_nodes: np.ndarray, parent: np.ndarray, n_nodes: int, outcomes) -> np.ndarray:
+    """Predicted node per read (-1 = unclassified) for reads from true_nodes."""
+    n = len(true_nodes)
+    outcome = rng.choice(4, size=n, p=np.asarray(outcomes) / sum(outcomes))
+    pred = true_nodes.copy()
+    pred[outcome == 0] = -1
+
+    # Ancestor calls: climb 1-4 levels
+    anc = np.flatnonzero(outcome == 2)
+    steps = rng.integers(1, 5, size=len(anc))
+    nodes = pred[anc]
+    for s in range(4):
+        climb = steps > s
+        nodes[climb] = parent[nodes[climb]]
+    pred[anc] = nodes
+
+    wrong = outcome == 3
+    pred[wrong] = rng.integers(1, n_nodes, size=int(wrong.sum()))
+    return pred
+
+
+def kraken_lines(read_ids, pred_taxids, names: bool) -> str:
+    out = []
+    for rid, t in zip(read_ids, pred_taxids):
+        if t == 0:
+            out.append(f"U\t{rid}\t0\t150|150\t0:116 |:| 0:116\n")
+        elif names:
+            out.append(f"C\t{rid}\tTaxon {t} (taxid {t})\t150|150\t{t}:116 |:| {t}:116\n")
+        else:
+            out.append(f"C\t{rid}\t{t}\t150|150\t{t}:116 |:| {t}:116\n")
+    return "".join(out)
+
+
+def write_text(path: str, text: str):
+    if path.endswith(".gz"):
+        # No file name or mtime in the header, so reruns are byte-identical
+        with open(path, "wb") as raw, gzip.GzipFile(filename="", mode="wb", compresslevel=6, fileobj=raw, mtime=0) as f:
+            f.write(text.encode())
+    else:
+        with open(path, "w") as f:
+            f.write(text)
+
+
+def generate(outdir: str, reads: int = 200_000, files: int = 3, seed: int = 1, levels=DEFAULT_LEVELS,
+             outcomes=DEFAULT_OUTCOMES, n_virid: int = 6, summary_reads: int = 50_000) -> dict:
+    """Write the whole benchmark dataset to outdir; returns its description (also saved as dataset.json)."""
+    out = Path(outdir)
+    (out / "kraken").mkdir(parents=True, exist_ok=True)
+    (out / "keys").mkdir(exist_ok=True)
+    (out / "out").mkdir(exist_ok=True)
+    (out / "summaries").mkdir(exist_ok=True)
+    rng = np.random.default_rng(seed)
+
+    taxid, parent, ranks, depth = build_tree(levels, seed)
+    n_nodes = len(taxid)
+    write_nodes_dmp(str(out / "nodes.dmp"), taxid, parent, ranks)
+    species = np.flatnonzero(np.asarray(ranks) == levels[-2][0]) if len(levels) > 1 else np.arange(1, n_nodes)
+
+    # One true species per file, as in the per-taxon Kraken runs
+    jobs = {v: [] for v in VARIANTS}
+    for i in range(files):
+        true_node = int(rng.choice(species))
+        # Reads come from the species or one of its strains
+        children = np.flatnonzero(parent == true_node)
+        sources = np.r_[true_node, children]
+        read_nodes = rng.choice(sources, size=reads)
+        pred_nodes = simulate_preds(rng, read_nodes, parent, n_nodes, outcomes)
+        pred_taxids = np.where(pred_nodes < 0, 0, taxid[np.maximum(pred_nodes, 0)])
+        read_ids = [f"read{i}_{j}" for j in range(reads)]
+        for variant in VARIANTS:
+            names = variant.startswith("names")
+            suffix = ".out.gz" if variant.endswith("gz") else ".out"
+            stem = f"ds_file{i}{'names' if names else ''}_db1{suffix}"
+            path = str(out / "kraken" / stem)
+            write_text(path, kraken_lines(read_ids, pred_taxids, names))
+            jobs[variant].append(f"{path}\t{taxid[true_node]}\n")
+    for variant, lines in jobs.items():
+        with open(out / f"jobs_{variant}.tsv", "w") as f:
+            f.writelines(lines)
+
+    # Per-read pairs for weighted_entropy.py
+    true_nodes = rng.choice(species, size=reads)
+    pred_nodes = simulate_preds(rng, true_nodes, parent, n_nodes, outcomes)
+    with open(out / "pairs.tsv", "w") as f:
+        f.write("read_id\ttrue_taxid\tpred_taxid\n")
+        for j, (t, p) in enumerate(zip(taxid[true_nodes], pred_nodes)):
+            f.write(f"r{j}\t{t}\t{0 if p < 0 else taxid[p]}\n")
+
+    # Mixed sample: key file + N database outputs (summaries_extra.py), and its merged
+    # summary (basic_entropy.py)
+    true_nodes = rng.choice(species, size=summary_reads)
+    true_taxids = taxid[true_nodes]
+    ids = [f"m{j}" for j in range(summary_reads)]
+    with open(out / "keys" / "mix_key_final.txt", "w") as f:
+        f.writelines(f"@{r}/1\tGCF_{t}\t{t}\n" for r, t in zip(ids, true_taxids))
+    columns = []
+    for v in range(1, n_virid + 1):
+        pred_nodes = simulate_preds(rng, true_nodes, parent, n_nodes, outcomes)
+        pred_taxids = np.where(pred_nodes < 0, 0, taxid[np.maximum(pred_nodes, 0)])
+        write_text(str(out / "out" / f"mix_virid{v}.out"), kraken_lines(ids, pred_taxids, names=True))
+        columns.append(pred_taxids)
+    with open(out / "summaries" / "mix_virid_summary.txt", "w") as f:
+        f.write("SequenceID\ttrue_taxid\t" + "\t".join(f"virid{v}" for v in range(1, n_virid + 1)) + "\n")
+        for j, r in enumerate(ids):
+            preds = "\t".join(str(c[j]) for c in columns)
+            f.write(f"{r}\t{true_taxids[j]}\t{preds}\n")
+
+    info = {
+        "seed": seed,
+        "n_nodes": int(n_nodes),
+        "max_depth": int(depth.max()),
+        "levels": [list(level) for level in levels],
+        "reads_per_file": reads,
+        "files": files,
+        "summary_reads": summary_reads,
+        "n_virid": n_virid,
+    }
+    with open(out / "dataset.json", "w") as f:
+        json.dump(info, f, indent=2)
+    return info
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Generate synthetic taxonomy and Kraken outputs for benchmarks.")
+    ap.add_argument("--outdir", required=True)
+    ap.add_argument("--reads", type=int, default=200_000, help="Reads per Kraken output (default 200000)")
+    ap.add_argument("--files", type=int, default=3, help="Kraken outputs per variant (default 3)")
+    ap.add_argument("--summary-reads", type=int, default=50_000, help="Reads in the mixed summary sample")
+    ap.add_argument("--levels", default=None, help="Tree shape as rank:fanout,... (default: RefSeq-like, ~400k nodes)")
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+
+    levels = parse_levels(args.levels) if args.levels else DEFAULT_LEVELS
+    info = generate(args.outdir, args.reads, args.files, args.seed, levels, summary_reads=args.summary_reads)
+    print(json.dumps(info))
+
+
+if __name__ == "__main__":
+    main()